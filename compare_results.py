@@ -0,0 +1,13 @@
+import sys
+
+from src.cli import parse_compare_args
+from src.compare import compare
+
+
+def main():
+    args = parse_compare_args()
+    sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
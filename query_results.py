@@ -0,0 +1,11 @@
+from src.cli import parse_query_args
+from src.history import query
+
+
+def main():
+    args = parse_query_args()
+    query(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -25,17 +25,20 @@ def find_common_readlen(filename: str):
     return common_len
 
 
-def out_path(filename, mcl: int):
+def out_path(filename, mcl: int, outdir=None):
+    """Path of the filtered filename in outdir (the current folder by default)"""
     # Remove suffixes
     basename = os.path.basename(filename)
     out = basename.replace(".fq", "").replace(".fastq", "")
     out = f"{out}_len-{mcl}.fastq"
+    if outdir:
+        out = os.path.join(outdir, out)
     print(f"Writing reads to {out}...", file=sys.stderr)
     return out
 
 
-def process_reads_se(mates1: str, mcl: int):
-    out1 = out_path(mates1, mcl)
+def process_reads_se(mates1: str, mcl: int, outdir=None):
+    out1 = out_path(mates1, mcl, outdir)
     mcl += 1  # to account for '\n'
 
     with open(mates1, "r") as fin, open(out1, "w") as fout:
@@ -47,10 +50,12 @@ def process_reads_se(mates1: str, mcl: int):
                     fout.write("".join(lines))
                 lines.clear()
 
+    return [out1]
 
-def process_reads_pe(mates1: str, mates2: str, mcl: int):
-    out1 = out_path(mates1, mcl)
-    out2 = out_path(mates2, mcl)
+
+def process_reads_pe(mates1: str, mates2: str, mcl: int, outdir=None):
+    out1 = out_path(mates1, mcl, outdir)
+    out2 = out_path(mates2, mcl, outdir)
 
     mcl += 1  # to account for '\n'
 
@@ -74,6 +79,8 @@ def process_reads_pe(mates1: str, mates2: str, mcl: int):
                 lines1.clear()
                 lines2.clear()
 
+    return [out1, out2]
+
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
@@ -1,19 +1,19 @@
 import argparse
+import json
 import os
+import shutil
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+CONTAINER_OUTDIR = "/output"
 
-def download_fastq(cont_runtime, sra_id):
-    """
-    Runs an SRA Toolkit container to download FASTQ files for the given SRA dataset.
 
-    Args:
-        sra_id (str): The SRA accession number (e.g., SRR12345).
-    """
-    current_dir = os.getcwd()
+def check_runtime(cont_runtime):
+    """Ensure Docker/Podman is installed"""
+    if cont_runtime == "none":
+        return
 
-    # Ensure Docker/Podman is installed
     try:
         subprocess.run(
             [cont_runtime, "--version"],
@@ -21,38 +21,251 @@ def download_fastq(cont_runtime, sra_id):
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
         )
-    except subprocess.CalledProcessError:
+    except (subprocess.CalledProcessError, FileNotFoundError):
         print(f"Error: {cont_runtime} is not installed or not running.")
         sys.exit(1)
 
-    print(f"Downloading FASTQ data for {sra_id} to {current_dir}...")
 
-    # Run the container and use fasterq-dump
-    cmd = [
+def sra_tools_cmd(cont_runtime, image, outdir, args):
+    """
+    Prefix args (a command of SRA Toolkit) with the container invocation,
+    so that outdir is available as CONTAINER_OUTDIR; with runtime "none",
+    the tools installed on the host are used.
+    """
+    if cont_runtime == "none":
+        return [a.replace(CONTAINER_OUTDIR, outdir) for a in args]
+
+    return [
         cont_runtime,
         "run",
         "--rm",
         "-v",
-        f"{current_dir}:/output",
-        "ncbi/sra-tools",
+        f"{outdir}:{CONTAINER_OUTDIR}",
+        image,
+        *args,
+    ]
+
+
+def output_files(outdir, sra_id):
+    """Return downloaded .fastq files of sra_id"""
+    single = os.path.join(outdir, f"{sra_id}.fastq")
+    pair = [os.path.join(outdir, f"{sra_id}_{i}.fastq") for i in (1, 2)]
+    if all(os.path.exists(p) for p in pair):
+        return pair
+    if os.path.exists(single):
+        return [single]
+    return []
+
+
+def count_reads(fastq):
+    n_lines = 0
+    with open(fastq, "rb") as fin:
+        while chunk := fin.read(1 << 24):
+            n_lines += chunk.count(b"\n")
+    return n_lines // 4
+
+
+def marker_path(outdir, sra_id):
+    return os.path.join(outdir, f".{sra_id}.download.json")
+
+
+def is_complete(outdir, sra_id, expected_reads=None):
+    """
+    Check files of sra_id against the marker written after a successful download
+    (and against the expected number of reads, if given)
+    """
+    marker = marker_path(outdir, sra_id)
+    if not os.path.exists(marker):
+        return False
+
+    with open(marker, "r") as fin:
+        info = json.load(fin)
+
+    files = output_files(outdir, sra_id)
+    if [os.path.basename(f) for f in files] != list(info["files"]):
+        return False
+
+    for f in files:
+        if os.path.getsize(f) != info["files"][os.path.basename(f)]["size"]:
+            return False
+
+    if expected_reads is not None and info["reads"] != expected_reads:
+        return False
+
+    return True
+
+
+def write_marker(outdir, sra_id, files, expected_reads=None):
+    reads = [count_reads(f) for f in files]
+    if len(set(reads)) != 1:
+        raise RuntimeError(f"{sra_id}: mates have different number of reads {reads}")
+    if expected_reads is not None and reads[0] != expected_reads:
+        raise RuntimeError(
+            f"{sra_id}: expected {expected_reads} reads, downloaded {reads[0]}"
+        )
+
+    info = {
+        "reads": reads[0],
+        "files": {
+            os.path.basename(f): {"size": os.path.getsize(f), "reads": r}
+            for f, r in zip(files, reads)
+        },
+    }
+    with open(marker_path(outdir, sra_id), "w") as fout:
+        json.dump(info, fout, indent=1)
+
+
+def download_fastq(
+    cont_runtime,
+    sra_id,
+    outdir=None,
+    threads=6,
+    image="ncbi/sra-tools",
+    expected_reads=None,
+    verbose=True,
+):
+    """
+    Runs an SRA Toolkit container to download FASTQ files for the given SRA dataset.
+
+    The .sra file is fetched with prefetch first, which resumes interrupted
+    downloads, and then converted with fasterq-dump. Accessions already
+    downloaded completely are skipped.
+
+    Args:
+        sra_id (str): The SRA accession number (e.g., SRR12345).
+
+    Returns list of downloaded .fastq files.
+    """
+    outdir = os.path.abspath(outdir or os.getcwd())
+
+    if is_complete(outdir, sra_id, expected_reads):
+        print(f"{sra_id} is already downloaded, skipping")
+        return output_files(outdir, sra_id)
+
+    print(f"Downloading FASTQ data for {sra_id} to {outdir}...")
+
+    sra_dir = f"{CONTAINER_OUTDIR}/.sra"
+    tmp_dir = f"{CONTAINER_OUTDIR}/.tmp-{sra_id}"
+
+    # without --max-size, prefetch refuses to download files over 20 GB
+    prefetch = ["prefetch", "--max-size", "u", "--output-directory", sra_dir, sra_id]
+    fasterq_dump = [
         "fasterq-dump",
         "--outdir",
-        "/output",
+        CONTAINER_OUTDIR,
+        "--temp",
+        tmp_dir,
+        "--threads",
+        str(threads),
         "--qual-defline",
         "+",
-        "--verbose",
-        "--progress",
-        sra_id,
+        "--force",
+        f"{sra_dir}/{sra_id}",
     ]
+    if verbose:
+        fasterq_dump[1:1] = ["--verbose", "--progress"]
 
-    try:
-        subprocess.run(cmd, check=True)
-        print(
-            f"Download complete: {sra_id}_1.fastq, {sra_id}_2.fastq (if paired-end) or {sra_id}.fastq (if single-end)"
-        )
-    except subprocess.CalledProcessError:
-        print(f"Error: Failed to download FASTQ data for {sra_id}")
-        sys.exit(1)
+    for args in (prefetch, fasterq_dump):
+        cmd = sra_tools_cmd(cont_runtime, image, outdir, args)
+        try:
+            subprocess.run(cmd, check=True)
+        except subprocess.CalledProcessError:
+            raise RuntimeError(f"Failed to download FASTQ data for {sra_id}")
+
+    files = output_files(outdir, sra_id)
+    if not files:
+        raise RuntimeError(f"fasterq-dump produced no .fastq files for {sra_id}")
+
+    write_marker(outdir, sra_id, files, expected_reads)
+
+    # the .sra file is not needed anymore
+    shutil.rmtree(os.path.join(outdir, ".sra", sra_id), ignore_errors=True)
+    shutil.rmtree(os.path.join(outdir, f".tmp-{sra_id}"), ignore_errors=True)
+
+    print(f"Download complete: {', '.join(os.path.basename(f) for f in files)}")
+    return files
+
+
+def filter_const_length(files, outdir):
+    """
+    Keep only reads of the most common length (see const_length_filter.py),
+    writing them to outdir; return the filtered files
+    """
+    from const_length_filter import (
+        find_common_readlen,
+        process_reads_pe,
+        process_reads_se,
+    )
+
+    mcl = find_common_readlen(files[0])
+    print(f"{os.path.basename(files[0])}: most common length is {mcl}")
+    if len(files) == 2:
+        return process_reads_pe(files[0], files[1], mcl, outdir)
+    return process_reads_se(files[0], mcl, outdir)
+
+
+def filtered_files(outdir, sra_id):
+    """Return files of sra_id already filtered, as recorded in its marker"""
+    with open(marker_path(outdir, sra_id), "r") as fin:
+        info = json.load(fin)
+    files = [os.path.join(outdir, f) for f in info.get("filtered", [])]
+    if files and all(os.path.exists(f) for f in files):
+        return files
+    return []
+
+
+def mark_filtered(outdir, sra_id, files):
+    marker = marker_path(outdir, sra_id)
+    with open(marker, "r") as fin:
+        info = json.load(fin)
+    info["filtered"] = [os.path.basename(f) for f in files]
+    tmp = marker + f".{os.getpid()}.tmp"
+    with open(tmp, "w") as fout:
+        json.dump(info, fout, indent=1)
+    os.replace(tmp, marker)
+
+
+def fetch(args, sra_id, expected_reads):
+    """
+    Download sra_id and, with --filter-const-length, filter its reads,
+    as one task of the pool; return the downloaded files
+    """
+    outdir = os.path.abspath(args.outdir or os.getcwd())
+    files = download_fastq(
+        args.container_runtime,
+        sra_id,
+        outdir,
+        args.threads,
+        args.image,
+        expected_reads,
+        # progress bars of concurrent downloads would be unreadable
+        args.jobs == 1,
+    )
+    if not args.filter_const_length:
+        return files
+
+    if filtered_files(outdir, sra_id):
+        print(f"{sra_id} is already filtered, skipping")
+    else:
+        mark_filtered(outdir, sra_id, filter_const_length(files, outdir))
+    return files
+
+
+def read_accessions(args):
+    """Return list of (accession, expected number of reads or None)"""
+    accessions = [(sra_id, None) for sra_id in args.sra_id]
+
+    if args.list:
+        with open(args.list, "r") as fin:
+            for line in fin:
+                line = line.split("#")[0].strip()
+                if not line:
+                    continue
+                fields = line.split()
+                expected = int(fields[1]) if len(fields) > 1 else None
+                accessions.append((fields[0], expected))
+
+    return accessions
 
 
 def parse_args():
@@ -60,17 +273,90 @@ def parse_args():
     parser.add_argument(
         "--container-runtime",
         type=str,
-        help="the container runtime to use (docker or podman)",
-        choices=["docker", "podman"],
+        help="the container runtime to use (docker or podman), "
+        "or none to use SRA Toolkit installed on the system",
+        choices=["docker", "podman", "none"],
         required=False,
         default="docker",
     )
     parser.add_argument(
-        "sra_id", type=str, help="NCBI accession of the dataset to download"
+        "--image",
+        type=str,
+        help="image with SRA Toolkit",
+        required=False,
+        default="ncbi/sra-tools",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "-l",
+        "--list",
+        type=str,
+        help="file with accessions, one per line, optionally followed by the expected number of reads",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "-o",
+        "--outdir",
+        type=str,
+        help="folder to download to (current folder by default)",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="number of concurrent downloads",
+        required=False,
+        default=2,
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        help="threads of each fasterq-dump",
+        required=False,
+        default=6,
+    )
+    parser.add_argument(
+        "--filter-const-length",
+        action="store_true",
+        help="keep only reads of the most common length after downloading",
+    )
+    parser.add_argument(
+        "sra_id",
+        type=str,
+        nargs="*",
+        help="NCBI accessions of the datasets to download",
+    )
+    args = parser.parse_args()
+
+    if not args.sra_id and not args.list:
+        parser.error("specify accessions or --list")
+
+    return args
 
 
 if __name__ == "__main__":
     args = parse_args()
-    download_fastq(args.container_runtime, args.sra_id)
+    check_runtime(args.container_runtime)
+
+    accessions = read_accessions(args)
+    failed = []
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {
+            pool.submit(fetch, args, sra_id, expected): sra_id
+            for sra_id, expected in accessions
+        }
+        for future in as_completed(futures):
+            sra_id = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                # other accessions are still being downloaded
+                print(f"Error: {sra_id}: {e}")
+                failed.append(sra_id)
+
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+        sys.exit(1)
@@ -0,0 +1,453 @@
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from multiprocessing import Pool
+from statistics import NormalDist
+
+import numpy as np
+
+# 2-bit codes of bases, N is 4
+BASES = np.frombuffer(b"ACGTN", dtype=np.uint8)
+COMPLEMENT = np.array([3, 2, 1, 0, 4], dtype=np.uint8)
+N_CODE = 4
+
+# quality bins: (upper bound of Phred score, inclusive) -> value
+QUALITY_BINS = {
+    # Illumina 8-level binning
+    "illumina8": [
+        (1, 1),
+        (9, 6),
+        (19, 15),
+        (24, 22),
+        (29, 27),
+        (34, 33),
+        (39, 37),
+        (93, 40),
+    ],  # fmt: skip
+    # NovaSeq 4-level binning
+    "novaseq4": [(2, 2), (14, 12), (30, 23), (93, 37)],
+}
+
+# (mean quality at the start of a read, at the end, noise sd, max quality, bins)
+QUALITY_MODELS = {
+    "illumina": (37.0, 30.0, 4.0, 41, None),
+    "illumina-binned": (37.0, 30.0, 4.0, 41, "illumina8"),
+    "novaseq": (36.0, 31.0, 4.0, 41, "novaseq4"),
+    "mgi": (39.0, 34.0, 3.0, 41, None),
+}
+
+MIN_QUALITY = 2
+ERROR_QUALITY = (2, 15)  # range of qualities of sequencing errors
+
+SIZE_SUFFIXES = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+# set in each worker by _init_worker
+GENOME = None
+CONFIG = None
+
+
+def parse_size(s: str) -> int:
+    s = s.strip().upper().removesuffix("B")
+    if s and s[-1] in SIZE_SUFFIXES:
+        return int(float(s[:-1]) * SIZE_SUFFIXES[s[-1]])
+    return int(s)
+
+
+def load_genome(fasta: str, rng: np.random.Generator) -> np.ndarray:
+    """Concatenated sequences of fasta as 2-bit codes; non-ACGT are replaced at random"""
+    lut = np.full(256, 255, dtype=np.uint8)
+    for code, base in enumerate(b"ACGT"):
+        lut[base] = code
+        lut[base + 32] = code  # lowercase
+
+    chunks = []
+    with open(fasta, "rb") as fin:
+        for line in fin:
+            if not line.startswith(b">"):
+                chunks.append(line.rstrip())
+
+    genome = lut[np.frombuffer(b"".join(chunks), dtype=np.uint8)]
+    unknown = genome == 255
+    genome[unknown] = rng.integers(0, 4, unknown.sum(), dtype=np.uint8)
+    return genome
+
+
+def random_genome(size: int, rng: np.random.Generator) -> np.ndarray:
+    return rng.integers(0, 4, size, dtype=np.uint8)
+
+
+def quality_lut(bins: str) -> np.ndarray:
+    lut = np.arange(256, dtype=np.uint8)
+    if bins:
+        lo = 0
+        for hi, value in QUALITY_BINS[bins]:
+            lut[lo : hi + 1] = value
+            lo = hi + 1
+    return lut
+
+
+def _init_worker(genome, config):
+    global GENOME, CONFIG
+    GENOME = genome
+    CONFIG = config
+
+
+def _read_lengths(rng, n, cfg) -> np.ndarray:
+    if cfg.length_dist == "normal":
+        lengths = rng.normal(cfg.read_length, cfg.length_sd, n)
+    elif cfg.length_dist == "uniform":
+        lengths = rng.integers(cfg.min_length, cfg.max_length + 1, n)
+    else:
+        return np.full(n, cfg.read_length, dtype=np.int64)
+    return np.clip(np.rint(lengths), cfg.min_length, cfg.max_length).astype(np.int64)
+
+
+def _offsets_in_reads(lengths) -> np.ndarray:
+    """Offset of every base inside its read"""
+    starts = np.cumsum(lengths) - lengths
+    return np.arange(int(lengths.sum())) - np.repeat(starts, lengths)
+
+
+def _sequences(rng, pos, lengths, reverse, k, cfg):
+    """Flat array of base codes of all reads, and indices of errors and Ns"""
+    if k is None:  # all reads have the same length
+        length = int(lengths[0])
+        windows = np.lib.stride_tricks.sliding_window_view(GENOME, length)
+        seq = windows[pos]
+        seq[reverse] = COMPLEMENT[seq[reverse, ::-1]]
+        seq = seq.reshape(-1)
+    else:
+        pos_rep = np.repeat(pos, lengths)
+        rev_rep = np.repeat(reverse, lengths)
+        last = pos_rep + np.repeat(lengths, lengths) - 1
+        seq = GENOME[np.where(rev_rep, last - k, pos_rep + k)]
+        seq = np.where(rev_rep, COMPLEMENT[seq], seq)
+
+    total = len(seq)
+
+    # substitutions to one of the other 3 bases
+    errors = rng.integers(0, total, rng.binomial(total, cfg.error_rate))
+    shift = rng.integers(1, 4, len(errors), dtype=np.uint8)
+    seq[errors] = (seq[errors] + shift) % 4
+
+    ns = rng.integers(0, total, rng.binomial(total, cfg.n_rate))
+    seq[ns] = N_CODE
+
+    return seq, np.concatenate([errors, ns])
+
+
+def _noise_lut(sd: float) -> np.ndarray:
+    """Maps uniformly distributed bytes to (discretised) normally distributed noise"""
+    dist = NormalDist(0, sd)
+    return np.array([round(dist.inv_cdf((i + 0.5) / 256)) for i in range(256)], dtype=np.int16)  # fmt: skip
+
+
+def _qualities(rng, lengths, low, k, model):
+    start, end, sd, qmax, bins = model
+
+    # mean quality drops quadratically towards the end of a read
+    curve = start - (start - end) * (np.arange(256) / 255) ** 2
+    curve = np.rint(curve).astype(np.int16)
+    # and some reads are worse than others
+    read_offset = np.rint(rng.normal(0, sd / 2, len(lengths))).astype(np.int16)
+
+    if k is None:
+        length = int(lengths[0])
+        row = curve[np.arange(length) * 255 // max(length - 1, 1)]
+        q = (row[None, :] + read_offset[:, None]).reshape(-1)
+    else:
+        rel = k * 255 // np.maximum(np.repeat(lengths, lengths) - 1, 1)
+        q = curve[rel] + np.repeat(read_offset, lengths)
+
+    # random bytes are much cheaper than normal variates
+    q += _noise_lut(sd)[rng.integers(0, 256, len(q), dtype=np.uint8)]
+    np.clip(q, MIN_QUALITY, qmax, out=q)
+    q[low] = rng.integers(ERROR_QUALITY[0], ERROR_QUALITY[1] + 1, len(low))
+
+    lut = quality_lut(bins) + 33
+    return lut[q]
+
+
+def _headers(rng, first_read, n, mate, cfg) -> list[bytes]:
+    read_ids = range(first_read, first_read + n)
+    if cfg.header == "mgi":
+        # e.g. @V300012345L1C001R0010000001/1
+        lanes = rng.integers(1, 5, n).tolist()
+        cols = rng.integers(1, 1000, n).tolist()
+        rows = rng.integers(1, 1000, n).tolist()
+        return [
+            b"@%sL%dC%03dR%03d%07d/%d"
+            % (cfg.flowcell, lane, col, row, read_id % 10_000_000, mate)
+            for lane, col, row, read_id in zip(lanes, cols, rows, read_ids)
+        ]
+
+    # e.g. @A00123:42:HXXXXXDSX2:1:1101:10004:1000 1:N:0:ACGTACGT+TGCATGCA
+    lanes = rng.integers(1, 5, n).tolist()
+    tiles = (
+        rng.integers(1, 3, n) * 1000
+        + rng.integers(1, 3, n) * 100
+        + rng.integers(1, 79, n)
+    ).tolist()
+    # 5-digit coordinates keep all names of the same length
+    xs = rng.integers(10000, 32000, n).tolist()
+    ys = rng.integers(10000, 37000, n).tolist()
+    return [
+        b"@A00123:42:%s:%d:%d:%d:%d %d:N:0:%s"
+        % (cfg.flowcell, lane, tile, x, y, mate, cfg.barcode)
+        for lane, tile, x, y in zip(lanes, tiles, xs, ys)
+    ]
+
+
+def _assemble(headers, hlens, seq, qual, lengths) -> np.ndarray:
+    """Interleave headers, sequences and qualities into records"""
+    n = len(lengths)
+    hbytes = np.frombuffer(b"\n".join(headers) + b"\n", dtype=np.uint8)
+    bases = BASES[seq]
+
+    # fast path: all records have the same layout
+    if (hlens == hlens[0]).all() and (lengths == lengths[0]).all():
+        h, length = int(hlens[0]), int(lengths[0])
+        rec = np.empty((n, h + 2 * length + 4), dtype=np.uint8)
+        rec[:, :h] = hbytes.reshape(n, h)
+        rec[:, h : h + length] = bases.reshape(n, length)
+        rec[:, h + length : h + length + 3] = np.frombuffer(b"\n+\n", dtype=np.uint8)
+        rec[:, h + length + 3 : -1] = qual.reshape(n, length)
+        rec[:, -1] = ord("\n")
+        return rec.reshape(-1)
+
+    rec_lens = hlens + 2 * lengths + 4
+    rec_starts = np.cumsum(rec_lens) - rec_lens
+    out = np.empty(int(rec_lens.sum()), dtype=np.uint8)
+
+    hstarts = np.cumsum(hlens) - hlens
+    hk = np.arange(len(hbytes)) - np.repeat(hstarts, hlens)
+    out[np.repeat(rec_starts, hlens) + hk] = hbytes
+
+    seq_starts = np.cumsum(lengths) - lengths
+    k = np.arange(len(seq)) - np.repeat(seq_starts, lengths)
+    seq_pos = np.repeat(rec_starts + hlens, lengths) + k
+    out[seq_pos] = bases
+    out[seq_pos + np.repeat(lengths, lengths) + 3] = qual
+
+    sep = rec_starts + hlens + lengths
+    out[sep] = ord("\n")
+    out[sep + 1] = ord("+")
+    out[sep + 2] = ord("\n")
+    out[rec_starts + rec_lens - 1] = ord("\n")
+    return out
+
+
+def generate_batch(batch_idx: int) -> tuple[list[bytes], list[np.ndarray]]:
+    """
+    Return records of every mate and end offsets of the records.
+    Every batch has its own random stream, so output does not
+    depend on the number of workers.
+    """
+    cfg = CONFIG
+    rng = np.random.default_rng([cfg.seed, batch_idx])
+    n = cfg.batch
+    genome_size = len(GENOME)
+
+    lengths1 = _read_lengths(rng, n, cfg)
+    if cfg.paired:
+        lengths2 = _read_lengths(rng, n, cfg)
+        fragment = np.rint(rng.normal(cfg.insert_size, cfg.insert_sd, n)).astype(int)
+        fragment = np.clip(fragment, np.maximum(lengths1, lengths2), genome_size)
+    else:
+        fragment = lengths1
+
+    pos = rng.integers(0, genome_size - fragment + 1)
+    reverse = rng.random(n) < 0.5
+
+    # duplicates are copies of other fragments of the batch
+    dup = np.flatnonzero(rng.random(n) < cfg.duplication)
+    src = rng.integers(0, n, len(dup))
+    pos[dup], reverse[dup], fragment[dup] = pos[src], reverse[src], fragment[src]
+    lengths1[dup] = lengths1[src]
+
+    mates = [(lengths1, pos, reverse)]
+    if cfg.paired:
+        lengths2[dup] = lengths2[src]
+        # mates are read towards each other from both ends of the fragment
+        end1 = pos + fragment - lengths1
+        end2 = pos + fragment - lengths2
+        mates = [
+            (lengths1, np.where(reverse, end1, pos), reverse),
+            (lengths2, np.where(reverse, pos, end2), ~reverse),
+        ]
+
+    records, ends = [], []
+    model = QUALITY_MODELS[cfg.quality_model]
+    for mate, (lengths, mpos, mrev) in enumerate(mates, start=1):
+        k = None if cfg.length_dist == "fixed" else _offsets_in_reads(lengths)
+        seq, low = _sequences(rng, mpos, lengths, mrev, k, cfg)
+        qual = _qualities(rng, lengths, low, k, model)
+        headers = _headers(rng, batch_idx * n + 1, n, mate, cfg)
+        hlens = np.fromiter((len(h) + 1 for h in headers), dtype=np.int64, count=n)
+
+        rec = _assemble(headers, hlens, seq, qual, lengths)
+        records.append(rec.tobytes())
+        ends.append(np.cumsum(hlens + 2 * lengths + 4))
+
+    return records, ends
+
+
+def generate(cfg, genome, outputs):
+    fouts = [open(o, "wb") for o in outputs]
+    written = 0  # of the first mate
+    n_reads = 0
+    started = time.time()
+
+    with Pool(cfg.workers, initializer=_init_worker, initargs=(genome, cfg)) as pool:
+        pending = deque()
+        next_batch = 0
+        while True:
+            # keep a bounded number of batches in flight, results are written in order
+            while len(pending) < 2 * cfg.workers:
+                pending.append(pool.apply_async(generate_batch, (next_batch,)))
+                next_batch += 1
+
+            records, ends = pending.popleft().get()
+
+            # stop at a record boundary once the target is reached
+            n = len(ends[0])
+            if cfg.reads:
+                n = min(n, cfg.reads - n_reads)
+            if cfg.size:
+                n = min(n, int(np.searchsorted(ends[0], cfg.size - written)) + 1)
+
+            for fout, rec, end in zip(fouts, records, ends):
+                fout.write(memoryview(rec)[: end[n - 1]])
+            written += int(ends[0][n - 1])
+            n_reads += n
+
+            if (cfg.size and written >= cfg.size) or (
+                cfg.reads and n_reads >= cfg.reads
+            ):
+                break
+
+    for fout in fouts:
+        fout.close()
+
+    elapsed = time.time() - started
+    total = written * len(outputs)
+    print(
+        f"Generated {n_reads} reads ({total / 1e6:.1f} MB) in {elapsed:.1f}s "
+        f"({total / 1e6 / elapsed:.0f} MB/s): {', '.join(outputs)}",
+        file=sys.stderr,
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Generate deterministic synthetic FASTQ files",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("-o", "--prefix", type=str, required=True, help="output prefix")
+    parser.add_argument(
+        "-s",
+        "--size",
+        type=str,
+        default=None,
+        help="size of each file, e.g. 500M, 100G",
+    )
+    parser.add_argument(
+        "-n", "--reads", type=int, default=None, help="number of reads (of each mate)"
+    )
+    parser.add_argument(
+        "--paired", action="store_true", help="generate paired-end reads"
+    )
+    parser.add_argument("--seed", type=int, default=42, help="random seed")
+    parser.add_argument(
+        "--length-dist",
+        choices=["fixed", "normal", "uniform"],
+        default="fixed",
+        help="distribution of read lengths",
+    )
+    parser.add_argument(
+        "--read-length", type=int, default=150, help="(mean) read length"
+    )
+    parser.add_argument(
+        "--length-sd", type=float, default=10, help="sd of normal read lengths"
+    )
+    parser.add_argument("--min-length", type=int, default=35)
+    parser.add_argument("--max-length", type=int, default=150)
+    parser.add_argument(
+        "--quality-model",
+        choices=list(QUALITY_MODELS),
+        default="illumina",
+        help="quality model (-binned and novaseq use binned qualities)",
+    )
+    parser.add_argument(
+        "--header", choices=["illumina", "mgi"], default="illumina", help="read names"
+    )
+    parser.add_argument(
+        "--genome", type=str, default=None, help="FASTA to sample reads from"
+    )
+    parser.add_argument(
+        "--genome-size",
+        type=str,
+        default="10M",
+        help="size of random genome, if --genome is not given",
+    )
+    parser.add_argument(
+        "--duplication", type=float, default=0.05, help="fraction of duplicated reads"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.002, help="substitution rate per base"
+    )
+    parser.add_argument("--n-rate", type=float, default=0.0005, help="rate of N bases")
+    parser.add_argument(
+        "--insert-size", type=int, default=350, help="mean fragment size"
+    )
+    parser.add_argument(
+        "--insert-sd", type=float, default=50, help="sd of fragment size"
+    )
+    parser.add_argument("--batch", type=int, default=50_000, help="reads per batch")
+    parser.add_argument(
+        "-w", "--workers", type=int, default=os.cpu_count(), help="worker processes"
+    )
+
+    args = parser.parse_args()
+    if not args.size and not args.reads:
+        parser.error("specify --size or --reads")
+    if args.length_dist == "fixed":
+        args.min_length = args.max_length = args.read_length
+    if args.min_length > args.max_length:
+        parser.error("--min-length is larger than --max-length")
+
+    args.size = parse_size(args.size) if args.size else None
+
+    # run-wide constants of the headers
+    rng = np.random.default_rng(args.seed)
+    letters = np.frombuffer(b"ABCDEFGHJKLMNPQRSTUVWXYZ", dtype=np.uint8)
+    args.flowcell = b"H%sDSX2" % bytes(rng.choice(letters, 5))
+    if args.header == "mgi":
+        args.flowcell = b"V3000%05d" % rng.integers(0, 100000)
+    args.barcode = b"%s+%s" % (
+        bytes(BASES[rng.integers(0, 4, 8)]),
+        bytes(BASES[rng.integers(0, 4, 8)]),
+    )
+    return args
+
+
+if __name__ == "__main__":
+    cfg = parse_args()
+
+    genome_rng = np.random.default_rng([cfg.seed, 2**32 - 1])
+    if cfg.genome:
+        genome = load_genome(cfg.genome, genome_rng)
+    else:
+        genome = random_genome(parse_size(cfg.genome_size), genome_rng)
+
+    if len(genome) < max(cfg.max_length, cfg.insert_size):
+        sys.exit("genome is shorter than reads")
+
+    if cfg.paired:
+        outputs = [f"{cfg.prefix}_1.fastq", f"{cfg.prefix}_2.fastq"]
+    else:
+        outputs = [f"{cfg.prefix}.fastq"]
+
+    generate(cfg, genome, outputs)
@@ -0,0 +1,11 @@
+from src.cli import parse_selfbench_args
+from src.selfbench import self_benchmark
+
+
+def main():
+    args = parse_selfbench_args()
+    self_benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,11 @@ import argparse
 import os
 from os import path
 
-from src.tools import ZDUR_MODES, get_names_tools
+from src.dataset import is_compressed
+from src.mock import MockOptions
+from src.throttle import parse_profile
+from src.tools import MOCK_ENV, TOOL_NAMES, ZDUR_MODES, get_names_tools
+from src.transforms import MAX_K, SIGNATURES, parse_scheme
 
 
 def parse_args() -> argparse.Namespace:
@@ -23,14 +27,15 @@ def parse_args() -> argparse.Namespace:
         "--input1",
         type=argparse.FileType("r"),
         action=FileInSubtree,
-        help="fastq-file 1",
-        required=True,
+        help="fastq-file 1, plain or compressed (.gz, .zst) (required unless running as a worker)",
+        required=False,
+        default=None,
     )
     parser.add_argument(
         "-i2",
         "--input2",
         type=argparse.FileType("r"),
-        help="fastq-file 2",
+        help="fastq-file 2, plain or compressed (.gz, .zst)",
         action=FileInSubtree,
         required=False,
         default=None,
@@ -79,7 +84,8 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--timeout",
         type=int,
-        help="maximum allowed execution time per tool invocation (in hours)",
+        help="maximum allowed execution time per tool invocation (in hours), "
+        "also the upper bound of --auto-timeout",
         required=False,
         default=48,
     )
@@ -97,12 +103,631 @@ def parse_args() -> argparse.Namespace:
         required=False,
         default="c-simtree",
     )
+    parser.add_argument(
+        "--input-cache",
+        type=str,
+        action=FileInSubtree,
+        help="folder to keep decompressed copies of compressed inputs in",
+        required=False,
+        default=".fastq-cache",
+    )
+    parser.add_argument(
+        "--cache-budget",
+        type=float,
+        help="maximum size (in GB) of --input-cache; least recently used inputs are removed",
+        required=False,
+        default=200,
+    )
+    parser.add_argument(
+        "--decode-throughput",
+        type=str,
+        help="additionally measure decompression to /dev/null (null) "
+        "or to a pipe counting the decoded bytes (pipe), for tools that can write to stdout",
+        choices=["off", "null", "pipe"],
+        required=False,
+        default="off",
+    )
+    parser.add_argument(
+        "--decode-digest",
+        type=str,
+        help="digest of decoded data to compute with --decode-throughput pipe",
+        choices=["md5", "sha1", "sha256", "blake2b"],
+        required=False,
+        default="",
+    )
+    parser.add_argument(
+        "--results-db",
+        type=str,
+        action=FileInSubtree,
+        help="sqlite database to which results of this run are also appended",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--queue-dir",
+        type=str,
+        action=FileInSubtree,
+        help="folder on a shared filesystem holding the job queue; "
+        "without --worker, fills the queue and waits for workers to finish it",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--worker",
+        help="execute jobs from --queue-dir until it is drained",
+        action="store_true",
+        required=False,
+    )
+    parser.add_argument(
+        "--heartbeat",
+        type=float,
+        help="interval (in seconds) at which workers refresh their claims",
+        required=False,
+        default=30,
+    )
+    parser.add_argument(
+        "--stale-timeout",
+        type=float,
+        help="claims not refreshed for this long (in seconds) are released",
+        required=False,
+        default=600,
+    )
+    parser.add_argument(
+        "--stall-window",
+        type=float,
+        help="abort a command if neither its outputs, nor CPU time or I/O "
+        "of its processes have grown for this long (in seconds); 0 to disable",
+        required=False,
+        default=1800,
+    )
+    parser.add_argument(
+        "--min-throughput",
+        type=float,
+        help="abort a command if its processes read and write less than this many MB/s "
+        "within --stall-window; 0 to disable",
+        required=False,
+        default=0,
+    )
+    parser.add_argument(
+        "--watchdog-interval",
+        type=float,
+        help="interval (in seconds) at which running commands are checked",
+        required=False,
+        default=10,
+    )
+    parser.add_argument(
+        "--dry-run",
+        help="list the invocations the run would make, with expected durations "
+        "(from past results in --results-db, or from --calibrate), and exit",
+        action="store_true",
+        required=False,
+    )
+    parser.add_argument(
+        "--calibrate",
+        help="measure throughput of tools without past results on a sample of the dataset",
+        action="store_true",
+        required=False,
+    )
+    parser.add_argument(
+        "--calibration-reads",
+        type=int,
+        help="number of reads in the sample used by --calibrate",
+        required=False,
+        default=100000,
+    )
+    parser.add_argument(
+        "--auto-timeout",
+        type=float,
+        help="set the timeout of every invocation to this multiple of its expected duration "
+        "(tools without an estimate keep --timeout); 0 to disable",
+        required=False,
+        default=0,
+    )
+    parser.add_argument(
+        "--min-timeout",
+        type=float,
+        help="lower bound (in minutes) of --auto-timeout",
+        required=False,
+        default=10,
+    )
+    parser.add_argument(
+        "--parquet",
+        help="convert records.jsonl (one record per command invocation) "
+        "to .parquet at the end of the run (requires pyarrow)",
+        action="store_true",
+        required=False,
+    )
+    parser.add_argument(
+        "--scaling",
+        help="run tools on a geometric series of record-aligned prefixes of the dataset "
+        "and fit time and peak memory to power laws of the input size",
+        action="store_true",
+        required=False,
+    )
+    parser.add_argument(
+        "--scaling-min-fraction",
+        type=float,
+        help="size of the smallest prefix, as a fraction of the dataset",
+        required=False,
+        default=0.01,
+    )
+    parser.add_argument(
+        "--scaling-factor",
+        type=float,
+        help="ratio of sizes of consecutive prefixes",
+        required=False,
+        default=2,
+    )
+    parser.add_argument(
+        "--scaling-target",
+        type=float,
+        help="input size (in GB) to extrapolate the fits to",
+        required=False,
+        default=1000,
+    )
+    parser.add_argument(
+        "--scaling-dir",
+        type=str,
+        action=FileInSubtree,
+        help="folder to keep the prefixes in (they are reused by later runs)",
+        required=False,
+        default=".scaling-prefixes",
+    )
+    parser.add_argument(
+        "--streams",
+        help="analyse header, sequence and quality streams of the dataset: "
+        "empirical entropies and sizes with baseline codecs (requires NumPy)",
+        action="store_true",
+        required=False,
+    )
+    parser.add_argument(
+        "--stream-records",
+        type=int,
+        help="number of records of every file to analyse with --streams",
+        required=False,
+        default=200000,
+    )
+    parser.add_argument(
+        "--stream-symbols-per-context",
+        type=float,
+        help="fewest sampled symbols per possible (context, symbol) pair, "
+        "which limits the order of the entropies of --streams",
+        required=False,
+        default=16,
+    )
+    parser.add_argument(
+        "--result-cache",
+        type=str,
+        help="folder to cache results in; tools are only run for repeats missing "
+        "from the cache (for the same data, commands, images, threads and host)",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--result-cache-max-age",
+        type=float,
+        help="results older than this (in days) are removed from --result-cache",
+        required=False,
+        default=90,
+    )
+    parser.add_argument(
+        "--invalidate",
+        type=str,
+        help="comma-separated names of tools (or all) whose results "
+        "are removed from --result-cache before the run",
+        required=False,
+        default="",
+    )
+    parser.add_argument(
+        "--calibrate-host",
+        help="run a short calibration suite (compute on one and all cores, memory "
+        "bandwidth, disk in the output folder), stored with the run and in "
+        "calibration.json",
+        action="store_true",
+        required=False,
+    )
+    parser.add_argument(
+        "--normalise-to",
+        type=str,
+        help="calibration.json of a reference host: adds times scaled to it "
+        "to the results (requires --calibrate-host)",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        help="file kept up to date with the progress of the run in the Prometheus "
+        "text format (e.g. <dir>/fastq_benchmark.prom for the textfile collector "
+        "of node_exporter)",
+        required=False,
+        default="",
+    )
+    parser.add_argument(
+        "--load",
+        help="load mode: run concurrent instances of every tool, each with its share "
+        "of --threads, and report aggregate throughput and slowdown (to load.csv)",
+        action="store_true",
+        required=False,
+    )
+    parser.add_argument(
+        "--load-instances",
+        type=_int_list,
+        help="comma-separated numbers of concurrent instances for --load "
+        "(default: powers of two up to the number of cores)",
+        required=False,
+        default=[],
+    )
+    parser.add_argument(
+        "--small-files",
+        help="small-file mode: compress and decompress many small files with every "
+        "tool, several at a time, and report files per second, throughput and "
+        "the fixed latency of an invocation (to small_files.csv)",
+        action="store_true",
+        required=False,
+    )
+    parser.add_argument(
+        "--small-files-dir",
+        type=str,
+        action=FileInSubtree,
+        help="folder with the fastq files for --small-files (<name>_1 and <name>_2 "
+        "are paired); by default, they are split from the dataset",
+        required=False,
+        default="",
+    )
+    parser.add_argument(
+        "--small-file-count",
+        type=int,
+        help="number of small files split from the dataset",
+        required=False,
+        default=100,
+    )
+    parser.add_argument(
+        "--small-file-size",
+        type=float,
+        help="size of small files split from the dataset, in MB",
+        required=False,
+        default=4.0,
+    )
+    parser.add_argument(
+        "--small-files-concurrency",
+        type=int,
+        help="small files processed at the same time, each with its share of "
+        "--threads (default: the number of cores)",
+        required=False,
+        default=0,
+    )
+    parser.add_argument(
+        "--concurrent-mates",
+        help="for paired-end data, also run tools compressing mates separately with "
+        "both mates at the same time, each with half of --threads",
+        action="store_true",
+        required=False,
+    )
+    parser.add_argument(
+        "--throttle",
+        type=str,
+        help="comma-separated storage profiles (nas, nfs, lustre, or "
+        "<name>=<MB/s>[:<ms per block>[:<KB per block>]]); tools reading stdin are "
+        "also run with the input fed through a pipe throttled by each of them",
+        required=False,
+        default="",
+    )
+    parser.add_argument(
+        "--quality-binning",
+        type=str,
+        help="comma-separated quality binning schemes (illumina8, illumina4, "
+        "or <name>=<low>-<high>:<value>/...); tools are also run on copies of "
+        "the dataset with qualities binned by each of them",
+        required=False,
+        default="",
+    )
+    parser.add_argument(
+        "--reorder",
+        type=str,
+        help="comma-separated signatures (minimizer, kmer) to sort records by; tools "
+        "are also run on copies of the dataset reordered by each of them",
+        required=False,
+        default="",
+    )
+    parser.add_argument(
+        "--reorder-k",
+        type=int,
+        help="length of k-mers of reordering signatures",
+        required=False,
+        default=16,
+    )
+    parser.add_argument(
+        "--reorder-memory",
+        type=float,
+        help="memory for sorting records while reordering, in GB; "
+        "larger datasets are sorted in runs merged from disk",
+        required=False,
+        default=1.0,
+    )
+    parser.add_argument(
+        "--transform-dir",
+        type=str,
+        action=FileInSubtree,
+        help="folder to keep transformed copies of datasets in (they are reused by later runs)",
+        required=False,
+        default=".fastq-transforms",
+    )
 
     args = parser.parse_args()
 
+    if args.worker and not args.queue_dir:
+        parser.error("--worker requires --queue-dir")
+    if not args.worker and args.input1 is None:
+        parser.error("the following arguments are required: -i1/--input1")
+    if args.decode_digest and args.decode_throughput != "pipe":
+        parser.error("--decode-digest requires --decode-throughput pipe")
+    if args.stale_timeout <= args.heartbeat:
+        parser.error("--stale-timeout must be larger than --heartbeat")
+    if args.worker and (args.dry_run or args.calibrate):
+        parser.error("--dry-run and --calibrate can not be used with --worker")
+    if args.stall_window and args.stall_window < 2 * args.watchdog_interval:
+        parser.error("--stall-window must be at least twice --watchdog-interval")
+    if args.min_throughput and not args.stall_window:
+        parser.error("--min-throughput requires --stall-window")
+    if args.auto_timeout < 0:
+        parser.error("--auto-timeout must not be negative")
+    if args.scaling and args.queue_dir:
+        parser.error("--scaling can not be used with --queue-dir")
+    if not 0 < args.scaling_min_fraction <= 1:
+        parser.error("--scaling-min-fraction must be in (0, 1]")
+    if args.scaling_factor <= 1:
+        parser.error("--scaling-factor must be larger than 1")
+    if args.stream_records <= 0:
+        parser.error("--stream-records must be positive")
+    if args.stream_symbols_per_context <= 0:
+        parser.error("--stream-symbols-per-context must be positive")
+    if args.result_cache and args.queue_dir:
+        parser.error("--result-cache can not be used with --queue-dir")
+    if args.invalidate and not args.result_cache:
+        parser.error("--invalidate requires --result-cache")
+    if args.quality_binning and (args.queue_dir or args.scaling):
+        parser.error("--quality-binning can not be used with --queue-dir or --scaling")
+    if args.normalise_to and not args.calibrate_host:
+        parser.error("--normalise-to requires --calibrate-host")
+    if args.normalise_to and not path.isfile(args.normalise_to):
+        parser.error(f"{args.normalise_to} does not exist")
+    if args.load and (args.queue_dir or args.scaling or args.result_cache):
+        parser.error(
+            "--load can not be used with --queue-dir, --scaling or --result-cache"
+        )
+    if args.small_files and (
+        args.queue_dir or args.scaling or args.result_cache or args.load
+    ):
+        parser.error(
+            "--small-files can not be used with --queue-dir, --scaling, "
+            "--result-cache or --load"
+        )
+    if args.small_files_dir and not path.isdir(args.small_files_dir):
+        parser.error(f"{args.small_files_dir} is not a folder")
+    if args.small_file_count <= 0 or args.small_file_size <= 0:
+        parser.error("--small-file-count and --small-file-size must be positive")
+    if args.small_files_concurrency < 0:
+        parser.error("--small-files-concurrency must not be negative")
+    if args.metrics_file and (args.queue_dir or args.load or args.small_files):
+        parser.error(
+            "--metrics-file can not be used with --queue-dir, --load or --small-files"
+        )
+    if args.results_db and args.queue_dir:
+        # the coordinator only merges the files written by workers
+        parser.error("--results-db can not be used with --queue-dir")
+    if any(k < 1 for k in args.load_instances):
+        parser.error("--load-instances must be positive")
+    if args.concurrent_mates and (args.queue_dir or args.scaling or args.load):
+        parser.error(
+            "--concurrent-mates can not be used with --queue-dir, --scaling or --load"
+        )
+    if args.throttle and (args.queue_dir or args.scaling or args.load):
+        parser.error("--throttle can not be used with --queue-dir, --scaling or --load")
+    for spec in filter(None, args.throttle.split(",")):
+        try:
+            parse_profile(spec)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.reorder and (args.queue_dir or args.scaling):
+        parser.error("--reorder can not be used with --queue-dir or --scaling")
+    for signature in filter(None, args.reorder.split(",")):
+        if signature not in SIGNATURES:
+            parser.error(
+                f"Unknown reordering signature {signature}, "
+                f"expected one of {', '.join(SIGNATURES)}"
+            )
+    if not 1 <= args.reorder_k <= MAX_K:
+        parser.error(f"--reorder-k must be between 1 and {MAX_K}")
+    if args.reorder_memory <= 0:
+        parser.error("--reorder-memory must be positive")
+    if TOOL_NAMES["mock"] in args.tools.split(","):
+        try:
+            MockOptions.from_spec(os.environ.get(MOCK_ENV, ""))
+        except ValueError as e:
+            parser.error(f"{MOCK_ENV}: {e}")
+    for spec in filter(None, args.quality_binning.split(",")):
+        try:
+            parse_scheme(spec)
+        except ValueError as e:
+            parser.error(str(e))
+
+    return args
+
+
+def parse_query_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Query the historical results database",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        allow_abbrev=False,
+    )
+    parser.add_argument("db", type=str, help="sqlite database with results")
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("runs", help="list registered runs")
+
+    trend = subparsers.add_parser("trend", help="per-run statistics of a metric")
+    best = subparsers.add_parser("best", help="best value of a metric per tool")
+    export = subparsers.add_parser("export", help="dump results with run metadata")
+
+    for sub in (trend, best):
+        sub.add_argument(
+            "--metric",
+            type=str,
+            choices=["ctime", "dtime", "total_cr"],
+            default="ctime",
+            help="metric to report",
+        )
+
+    for sub in (trend, best, export):
+        sub.add_argument("--tool", type=str, default=None, help="filter by tool")
+        sub.add_argument("--dataset", type=str, default=None, help="filter by dataset")
+        sub.add_argument(
+            "--threads", type=int, default=None, help="filter by thread count"
+        )
+        sub.add_argument("--run", type=int, default=None, help="filter by run id")
+        sub.add_argument(
+            "--include-invalid",
+            action="store_true",
+            help="also report results of failed invocations",
+        )
+
+    export.add_argument("--format", type=str, choices=["csv", "json"], default="csv")
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help="output file (stdout if not specified)",
+    )
+
+    return parser.parse_args()
+
+
+def parse_compare_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare two sets of results and fail on regressions",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        allow_abbrev=False,
+    )
+    parser.add_argument(
+        "baseline",
+        type=str,
+        help="results folder or .csv file (or run id if --db is used)",
+    )
+    parser.add_argument(
+        "candidate",
+        type=str,
+        help="results folder or .csv file (or run id if --db is used)",
+    )
+    parser.add_argument(
+        "--db",
+        type=str,
+        help="results database to take both runs from",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--time-threshold",
+        type=float,
+        help="relative increase of (de)compression time considered a regression",
+        required=False,
+        default=0.05,
+    )
+    parser.add_argument(
+        "--memory-threshold",
+        type=float,
+        help="relative increase of peak memory considered a regression",
+        required=False,
+        default=0.1,
+    )
+    parser.add_argument(
+        "--ratio-threshold",
+        type=float,
+        help="relative decrease of compression ratio considered a regression",
+        required=False,
+        default=0.01,
+    )
+    parser.add_argument(
+        "--alpha",
+        type=float,
+        help="significance level of the Mann-Whitney U test",
+        required=False,
+        default=0.05,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        help="file to write the comparison to (stdout if not specified)",
+        required=False,
+        default=None,
+    )
+
+    return parser.parse_args()
+
+
+def parse_selfbench_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the harness itself with a mock tool, "
+        "without containers or real compressors",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        allow_abbrev=False,
+    )
+    parser.add_argument(
+        "-o",
+        "--output-folder",
+        type=str,
+        help="a folder in which to write results",
+        required=False,
+        default="./",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeats",
+        type=int,
+        help="number of jobs to measure the overhead per job on",
+        required=False,
+        default=10,
+    )
+    parser.add_argument(
+        "--durations",
+        type=_float_list,
+        help="comma-separated durations (in seconds) injected to check timing accuracy",
+        required=False,
+        default="0.5,1,2",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=_int_list,
+        help="comma-separated numbers of jobs to check scaling of the work queue "
+        "and of the outputs with",
+        required=False,
+        default="10,100,1000",
+    )
+    parser.add_argument(
+        "--dataset-size",
+        type=float,
+        help="size (in MB) of the dataset the mock tool is run on",
+        required=False,
+        default=10,
+    )
+
+    args = parser.parse_args()
+    if args.repeats < 1:
+        parser.error("--repeats must be positive")
     return args
 
 
+def _float_list(value: str) -> list[float]:
+    return [float(v) for v in value.split(",") if v]
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
 # As current folder gets mounted, paths to input files
 # and to the output folder must be inside of cwd
 class FileInSubtree(argparse.Action):
@@ -117,6 +742,14 @@ class FileInSubtree(argparse.Action):
         else:
             arg_path = values.name
 
+        # compressed inputs are decompressed into the cache,
+        # so they do not have to be mounted
+        if option_string in ("-i1", "--input1", "-i2", "--input2") and is_compressed(
+            arg_path
+        ):
+            setattr(namespace, self.dest, values)
+            return
+
         real_path = os.path.realpath(arg_path)
 
         # Check if the file is within the base directory or its subdirectories
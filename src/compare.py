@@ -0,0 +1,330 @@
+import argparse
+import csv
+import math
+import sqlite3
+import sys
+from collections import defaultdict
+from os import path
+from statistics import median
+
+from src.history import variant_columns
+from src.logger import logger
+from src.results import VARIANT_FIELDS, ResultWriter
+
+# metric -> True if a larger value is better
+METRICS = {
+    "ctime": False,
+    "dtime": False,
+    "cmem": False,
+    "dmem": False,
+    "total_cr": True,
+}
+
+# results are matched on these: (tool, dataset, threads, *values of VARIANT_FIELDS)
+Key = tuple
+Samples = dict[Key, dict[str, list[float]]]
+
+
+def compare(args: argparse.Namespace) -> int:
+    """
+    Compare candidate results against baseline ones.
+
+    Return 1 if any significant regression was found, 0 otherwise.
+    """
+    baseline = _load(args.baseline, args.db)
+    candidate = _load(args.candidate, args.db)
+
+    thresholds = {
+        "ctime": args.time_threshold,
+        "dtime": args.time_threshold,
+        "cmem": args.memory_threshold,
+        "dmem": args.memory_threshold,
+        "total_cr": args.ratio_threshold,
+    }
+
+    for key in sorted(set(baseline) ^ set(candidate)):
+        where = "baseline" if key in baseline else "candidate"
+        logger.warn(f"{key} is only present in the {where} results, skipping...")
+
+    rows = []
+    for key in sorted(set(baseline) & set(candidate)):
+        for metric, higher_is_better in METRICS.items():
+            base = baseline[key].get(metric, [])
+            cand = candidate[key].get(metric, [])
+            # e.g. memory is not reported by older versions of the harness
+            if not base or not cand or median(base) == 0:
+                continue
+
+            rows.append(
+                _compare_metric(
+                    key,
+                    metric,
+                    base,
+                    cand,
+                    higher_is_better,
+                    thresholds[metric],
+                    args.alpha,
+                )
+            )
+
+    _write_report(rows, args.output)
+
+    untested = [r for r in rows if r["significance"].startswith("not tested (n<")]
+    if untested:
+        logger.warn(
+            f"{len(untested)} comparison(s) have fewer repeats than the "
+            f"{min_repeats(args.alpha)} needed for significance at alpha {args.alpha}, "
+            "they are decided by the thresholds alone"
+        )
+
+    regressions = [r for r in rows if r["status"] == "regression"]
+    for r in regressions:
+        variant = "".join(
+            f", {name} {r[name]}"
+            for name, default in VARIANT_FIELDS.items()
+            if r[name] != default
+        )
+        logger.warn(
+            f"Regression in {r['metric']} for {r['tool']} on {r['dataset']} "
+            f"({r['threads']} threads{variant}): {r['baseline']} -> {r['candidate']} "
+            f"({r['change']:+.1%})"
+        )
+
+    if regressions:
+        logger.error(f"Found {len(regressions)} regression(s)")
+        return 1
+
+    logger.info(f"No regressions among {len(rows)} comparisons")
+    return 0
+
+
+def _compare_metric(
+    key: Key,
+    metric: str,
+    base: list[float],
+    cand: list[float],
+    higher_is_better: bool,
+    threshold: float,
+    alpha: float,
+) -> dict:
+    base_med = median(base)
+    cand_med = median(cand)
+    change = (cand_med - base_med) / base_med
+
+    # relative change in the "worse" direction
+    worse = -change if higher_is_better else change
+
+    # compression ratio is deterministic, so only the threshold matters;
+    # if there are too few repeats to ever reach significance, do the same
+    p_value = math.nan
+    significant = True
+    if metric == "total_cr":
+        significance = "not tested (deterministic)"
+    elif _min_p_value(len(base), len(cand)) <= alpha:
+        _, p_value = mann_whitney_u(base, cand)
+        significant = p_value <= alpha
+        significance = "tested"
+    else:
+        significance = f"not tested (n<{min_repeats(alpha)})"
+
+    if significant and worse > threshold:
+        status = "regression"
+    elif significant and worse < -threshold:
+        status = "improvement"
+    else:
+        status = "ok"
+
+    tool, dataset, threads, *variants = key
+    return {
+        "tool": tool,
+        "dataset": dataset,
+        "threads": threads,
+        **dict(zip(VARIANT_FIELDS, variants)),
+        "metric": metric,
+        "n_baseline": len(base),
+        "n_candidate": len(cand),
+        "baseline": round(base_med, 3),
+        "candidate": round(cand_med, 3),
+        "change": round(change, 4),
+        "p_value": round(p_value, 4),
+        "significance": significance,
+        "status": status,
+    }
+
+
+def _write_report(rows: list[dict], output: str):
+    fieldnames = [
+        "tool",
+        "dataset",
+        "threads",
+        *VARIANT_FIELDS,
+        "metric",
+        "n_baseline",
+        "n_candidate",
+        "baseline",
+        "candidate",
+        "change",
+        "p_value",
+        "significance",  # whether the change was tested, or decided by the threshold
+        "status",
+    ]
+    fout = open(output, "w", newline="") if output else sys.stdout
+    try:
+        writer = csv.DictWriter(
+            fout, dialect="unix", quoting=csv.QUOTE_MINIMAL, fieldnames=fieldnames
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+    finally:
+        if output:
+            fout.close()
+
+
+def _load(source: str, db: str) -> Samples:
+    if db:
+        return _load_from_db(db, int(source))
+    return _load_from_csv(source)
+
+
+def _load_from_csv(source: str) -> Samples:
+    """Read samples from a results folder or a results .csv file"""
+    csvfile = source
+    if path.isdir(source):
+        csvfile = path.join(source, "benchmark_results.csv")
+
+    # from readable names back to Result fields
+    to_field = {v: k for k, v in ResultWriter.fieldnames_map.items()}
+
+    samples: Samples = defaultdict(lambda: defaultdict(list))
+    with open(csvfile, "r") as fin:
+        for row in csv.DictReader(fin):
+            row = {to_field.get(k, k): v for k, v in row.items()}
+            # files older than the variant fields hold only plain results
+            variants = (
+                type(default)(row.get(name) or default)
+                for name, default in VARIANT_FIELDS.items()
+            )
+            key = (row["tool"], row["dataset"], int(row["n_threads"]), *variants)
+            for metric in METRICS:
+                if row.get(metric):
+                    samples[key][metric].append(float(row[metric]))
+
+    return samples
+
+
+def _load_from_db(db: str, run_id: int) -> Samples:
+    if not path.exists(db):
+        raise FileNotFoundError(db)
+
+    conn = sqlite3.connect(db)
+    try:
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(results)")}
+        metrics = [m for m in METRICS if m in columns]
+        variants = variant_columns(conn)
+        rows = conn.execute(
+            f"SELECT tool, dataset, n_threads, {', '.join(variants + metrics)} "
+            "FROM results "
+            "WHERE run_id = ? AND is_valid = 1",
+            (run_id,),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    if not rows:
+        raise ValueError(f"no valid results for run {run_id} in {db}")
+
+    samples: Samples = defaultdict(lambda: defaultdict(list))
+    for row in rows:
+        key, values = row[: 3 + len(variants)], row[3 + len(variants) :]
+        for metric, value in zip(metrics, values):
+            if value is not None:
+                samples[key][metric].append(float(value))
+
+    return samples
+
+
+def mann_whitney_u(x: list[float], y: list[float]) -> tuple[float, float]:
+    """
+    Two-sided Mann-Whitney U test.
+
+    Return U statistic of x and p-value. The p-value is exact for small
+    samples without ties, otherwise normal approximation
+    (with tie and continuity corrections) is used.
+    """
+    n1, n2 = len(x), len(y)
+    ranks = _average_ranks(list(x) + list(y))
+    u1 = sum(ranks[:n1]) - n1 * (n1 + 1) / 2
+    u = min(u1, n1 * n2 - u1)
+
+    has_ties = len(set(x) | set(y)) != n1 + n2
+    if not has_ties and n1 * n2 <= 400:
+        counts = _u_distribution(n1, n2)
+        total = sum(counts)
+        p = 2 * sum(counts[: int(u) + 1]) / total
+        return u1, min(p, 1.0)
+
+    n = n1 + n2
+    tie_term = 0
+    for v in set(ranks):
+        t = ranks.count(v)
+        tie_term += t**3 - t
+
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+    if sigma == 0:
+        return u1, 1.0
+
+    z = (abs(u1 - n1 * n2 / 2) - 0.5) / sigma
+    p = math.erfc(max(z, 0) / math.sqrt(2))
+    return u1, min(p, 1.0)
+
+
+def _average_ranks(values: list[float]) -> list[float]:
+    order = sorted(range(len(values)), key=lambda i: values[i])
+    ranks = [0.0] * len(values)
+
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[order[k]] = (i + j) / 2 + 1
+        i = j + 1
+
+    return ranks
+
+
+def _u_distribution(n1: int, n2: int) -> list[int]:
+    """Number of arrangements of two samples for each value of U"""
+    # dist[i][j] is the distribution for samples of sizes i and j
+    dist = [[None] * (n2 + 1) for _ in range(n1 + 1)]
+    for i in range(n1 + 1):
+        for j in range(n2 + 1):
+            if i == 0 or j == 0:
+                dist[i][j] = [1]
+                continue
+
+            # the largest value belongs either to the first sample
+            # (adds j to U) or to the second one
+            a = [0] * j + dist[i - 1][j]
+            b = dist[i][j - 1]
+            size = max(len(a), len(b))
+            dist[i][j] = [
+                (a[k] if k < len(a) else 0) + (b[k] if k < len(b) else 0)
+                for k in range(size)
+            ]
+
+    return dist[n1][n2]
+
+
+def min_repeats(alpha: float) -> int:
+    """Fewest results on each side with which the test can reach alpha"""
+    n = 1
+    while _min_p_value(n, n) > alpha:
+        n += 1
+    return n
+
+
+def _min_p_value(n1: int, n2: int) -> float:
+    """The smallest two-sided p-value attainable with these sample sizes"""
+    return 2 / math.comb(n1 + n2, n1)
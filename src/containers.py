@@ -1,11 +1,16 @@
+import copy
 import enum
 import os
+import signal
 import subprocess as sp
+import time
 from os import path
-from typing import Optional
+from typing import Optional, Union
 
 from src.compat import dataclass
+from src.dataset import Dataset
 from src.logger import logger
+from src.watchdog import Watchdog
 
 HOST_DIR = os.getcwd()
 CONTAINER_DIR = "/root"
@@ -80,9 +85,18 @@ class PathConverter:
 class ShellRunner:
     """Executes commands either on the host or in a container"""
 
-    def __init__(self, runtime: str, environ: Optional[ContainerEnv]):
+    def __init__(
+        self, runtime: str, environ: Optional[ContainerEnv], instance: str = ""
+    ):
+        """
+        instance is appended to the name of the running container,
+        so that several runners can be used at the same time
+        """
         self.runtime = runtime
 
+        # why the last command executed has failed
+        self.last_error = ""
+
         self.prefix = ""
         self.converter = None
         if runtime != "none":
@@ -90,6 +104,10 @@ class ShellRunner:
                 raise RuntimeError("must specify environment")
 
             self.converter = PathConverter()
+            self.container_name = DOCKER_DATA[environ].running_container_name
+            if instance:
+                self.container_name += f"-{instance}"
+
             self.prefix = " ".join([
                 runtime,
                 "run",
@@ -97,7 +115,7 @@ class ShellRunner:
                 self.converter.mount_args,
                 "--rm",
                 "--name",
-                DOCKER_DATA[environ].running_container_name,
+                self.container_name,
                 DOCKER_DATA[environ].image_name,
             ])
 
@@ -111,50 +129,144 @@ class ShellRunner:
         logfile: Optional[str] = None,
         gnu_time: bool = True,
         timeout: int = None,
+        stdout: Optional[str] = None,
+        watchdog: Optional[Watchdog] = None,
+        stdin: Optional[str] = None,
     ) -> bool:
         """
         Executes cmd, redirecting both stdout and stderr
         to logfile, which must be a path on the host.
 
+        If stdout (a path on the host) is given, only stderr
+        is written to the logfile, and stdout is redirected there.
+        If stdin (a path on the host) is given, it is read from there.
+
         If gnu_time is True, prepends cmd with /usr/bin/time -v.
 
+        If watchdog is given, cmd is killed as soon as it reports a reason to abort.
+
         Return True if cmd successfuly executed.
         """
 
         if gnu_time:
             cmd = "/usr/bin/time -v " + cmd
 
+        if stdout:
+            stdout_runtime = stdout
+            if self.converter and stdout != os.devnull:
+                stdout_runtime = self.converter.to_docker(stdout)
+
+            cmd += f' > "{stdout_runtime}"'
+
+        if stdin:
+            stdin_runtime = stdin
+            if self.converter:
+                stdin_runtime = self.converter.to_docker(stdin)
+
+            cmd += f' < "{stdin_runtime}"'
+
         if logfile:
             logfile_runtime = logfile
             if self.converter:
                 logfile_runtime = self.converter.to_docker(logfile)
 
-            cmd += f' > "{logfile_runtime}" 2>&1'
+            if stdout:
+                cmd += f' 2> "{logfile_runtime}"'
+            else:
+                cmd += f' > "{logfile_runtime}" 2>&1'
 
         to_run = (self.prefix + ' sh -c "' + cmd + '"').strip()
 
         logger.info(to_run)
-        try:
-            proc = sp.run(to_run, shell=True, capture_output=True, timeout=timeout)
-        except sp.TimeoutExpired:
-            logger.warning(
-                self._make_error_message(f"Timeout {timeout}s expired", proc, logfile)
-            )
-            return False
+        self.last_error = ""
+        if watchdog:
+            proc = self._run_watched(to_run, timeout, watchdog)
+            if proc.returncode is None:
+                logger.warning(self._make_error_message(self.last_error, proc, logfile))
+                return False
+        else:
+            try:
+                proc = sp.run(to_run, shell=True, capture_output=True, timeout=timeout)
+            except sp.TimeoutExpired as e:
+                self.last_error = f"Timeout {timeout}s expired"
+                logger.warning(self._make_error_message(self.last_error, e, logfile))
+                return False
 
         try:
             proc.check_returncode()
         except sp.CalledProcessError:
-            logger.warning(
-                self._make_error_message("Exited with non-zero code", proc, logfile)
-            )
+            self.last_error = f"Exited with non-zero code {proc.returncode}"
+            logger.warning(self._make_error_message(self.last_error, proc, logfile))
             return False
 
         return True
 
+    def _run_watched(
+        self, to_run: str, timeout: Optional[float], watchdog: Watchdog
+    ) -> sp.CompletedProcess:
+        """Run to_run, checking it every watchdog interval; returncode is None if killed"""
+        proc = sp.Popen(
+            to_run, shell=True, stdout=sp.PIPE, stderr=sp.PIPE, start_new_session=True
+        )
+        start = time.monotonic()
+        root_pid = None
+        while True:
+            try:
+                # retrying after a timeout does not lose any output
+                out, err = proc.communicate(timeout=watchdog.options.interval)
+                return sp.CompletedProcess(to_run, proc.returncode, out, err)
+            except sp.TimeoutExpired:
+                pass
+
+            if timeout and time.monotonic() - start > timeout:
+                self.last_error = f"Timeout {timeout}s expired"
+            else:
+                root_pid = root_pid or self._root_pid(proc)
+                self.last_error = watchdog.check(root_pid)
+            if self.last_error:
+                break
+
+        self._kill(proc)
+        out, err = proc.communicate()
+        return sp.CompletedProcess(to_run, None, out, err)
+
+    def _root_pid(self, proc: sp.Popen) -> Optional[int]:
+        """Host pid of the root of the process tree running the command"""
+        if self.runtime == "none":
+            return proc.pid
+
+        inspect = sp.run(
+            [
+                self.runtime,
+                "inspect",
+                "--format",
+                "{{.State.Pid}}",
+                self.container_name,
+            ],
+            capture_output=True,
+            text=True,
+        )
+        pid = inspect.stdout.strip()
+        # 0 if the container is not running (yet)
+        return (
+            int(pid)
+            if inspect.returncode == 0 and pid.isdigit() and pid != "0"
+            else None
+        )
+
+    def _kill(self, proc: sp.Popen):
+        if self.runtime != "none":
+            sp.run([self.runtime, "kill", self.container_name], capture_output=True)
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
     @staticmethod
     def _make_error_message(
-        first_line: str, proc: sp.CompletedProcess, logfile: Optional[str] = None
+        first_line: str,
+        proc: Union[sp.CompletedProcess, sp.TimeoutExpired],
+        logfile: Optional[str] = None,
     ) -> str:
         """
         Format:
@@ -164,7 +276,7 @@ class ShellRunner:
         """
         msg = first_line
 
-        err = proc.stderr.decode("utf8").rstrip()
+        err = (proc.stderr or b"").decode("utf8").rstrip()
         if err:
             msg += ":\n\t" + err
 
@@ -174,6 +286,59 @@ class ShellRunner:
         return msg
 
 
+class ShellSession(ShellRunner):
+    """
+    Executes commands in one container kept running between them, so that they
+    do not pay for starting a container (on the host, it is a plain ShellRunner).
+
+    The container is started and removed by using the session as a context manager.
+    Commands must not be run with a watchdog, killing one would stop the session.
+    """
+
+    def __init__(
+        self, runtime: str, environ: Optional[ContainerEnv], instance: str = ""
+    ):
+        super().__init__(runtime, environ, instance)
+        self._start = ""
+        if runtime != "none":
+            # idles until removed, commands are executed next to it
+            self._start = " ".join([
+                runtime,
+                "run",
+                "-d",
+                "-v",
+                self.converter.mount_args,
+                "--rm",
+                "--name",
+                self.container_name,
+                DOCKER_DATA[environ].image_name,
+                "sleep infinity",
+            ])
+            self.prefix = f"{runtime} exec {self.container_name}"
+
+    def __enter__(self) -> "ShellSession":
+        if self._start:
+            logger.info(self._start)
+            sp.run(self._start, shell=True, capture_output=True, check=True)
+        return self
+
+    def __exit__(self, *exc):
+        if self._start:
+            sp.run([self.runtime, "rm", "-f", self.container_name], capture_output=True)
+
+
+def container_dataset(data_local: Dataset, runtime: str) -> Dataset:
+    """Return copy of data_local with paths as seen by the tools"""
+    data_cont = copy.deepcopy(data_local)
+
+    if runtime != "none":
+        converter = PathConverter()
+        data_cont.name1 = converter.to_docker(data_cont.name1)
+        data_cont.name2 = converter.to_docker(data_cont.name2)
+
+    return data_cont
+
+
 def image_exists(runtime: str, image_name: str) -> bool:
     """Check if a Docker image exists locally."""
     try:
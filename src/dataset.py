@@ -1,8 +1,19 @@
+import copy
+import gzip
+import io
+import os
 from os import path
 
 from src.compat import dataclass
 from src.logger import logger
 
+# supported compressed inputs and their decompressors
+COMPRESSED_SUFFIXES = {".gz": "gzip", ".zst": "zstd"}
+
+
+def is_compressed(fastq: str) -> bool:
+    return path.splitext(fastq)[1] in COMPRESSED_SUFFIXES
+
 
 @dataclass(slots=True)
 class Dataset:
@@ -17,7 +28,11 @@ class Dataset:
     @property
     def name(self) -> str:
         """Name used to refer to this dataset in the output .csv file"""
-        base = path.splitext(path.basename(self.name1))[0]
+        base = path.basename(self.name1)
+        # as the decompressed copy would be named
+        if is_compressed(base):
+            base = path.splitext(base)[0]
+        base = path.splitext(base)[0]
         base += " (PE)" if self.is_pe else " (SE)"
         return base
 
@@ -33,9 +48,49 @@ class Dataset:
             ret.append(self.name2)
         return ret
 
+    def linked_into(self, dirname: str) -> "Dataset":
+        """
+        Return copy of the dataset with files replaced by relative symlinks in dirname,
+        so that tools write their outputs there instead of next to the original files
+        """
+        os.makedirs(dirname, exist_ok=True)
+
+        linked = copy.deepcopy(self)
+        for attr in ("name1", "name2"):
+            original = getattr(self, attr)
+            if not original:
+                continue
+
+            link = path.join(dirname, path.basename(original))
+            if path.lexists(link):
+                os.unlink(link)
+            os.symlink(path.relpath(path.realpath(original), dirname), link)
+            setattr(linked, attr, link)
+
+        return linked
+
+
+def open_fastq(fastq: str) -> io.TextIOBase:
+    """Open plain or compressed fastq for reading"""
+    suffix = path.splitext(fastq)[1]
+    if suffix == ".gz":
+        return gzip.open(fastq, "rt")
+    if suffix == ".zst":
+        # optional dependency, only needed to read .zst from Python
+        import zstandard
+
+        return io.TextIOWrapper(zstandard.open(fastq, "rb"))
+    return open(fastq, "r")
+
 
 def _check_for_quality_headers(fastq: str) -> None:
-    with open(fastq, "r") as fin:
+    try:
+        fin = open_fastq(fastq)
+    except ImportError:
+        logger.warn(f"zstandard is not installed, can not check headers of {fastq}")
+        return
+
+    with fin:
         lines = [next(fin).strip() for _ in range(4)]
 
     qheader = lines[2]
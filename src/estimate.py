@@ -0,0 +1,229 @@
+import argparse
+import os
+import sqlite3
+from datetime import timedelta
+from os import path
+from statistics import median
+from typing import Optional
+
+from src.compat import dataclass
+from src.containers import container_dataset
+from src.dataset import Dataset
+from src.history import variant_columns
+from src.logger import logger
+from src.measure import measure_tool
+from src.results import VARIANT_FIELDS
+from src.scaling import make_prefix
+from src.tools import Tool, get_tools
+from src.utils import now
+
+MB = 1e6
+
+
+@dataclass(slots=True)
+class Throughput:
+    compression: float = 0  # MB/s of the original data
+    decompression: float = 0
+    source: str = ""  # where the estimate comes from
+
+    def duration(self, size: int) -> float:
+        """Expected time (in seconds) to compress and decompress size bytes"""
+        return size / MB / self.compression + size / MB / self.decompression
+
+
+class Estimator:
+    """
+    Estimates durations of tool invocations from per-tool throughputs,
+    and sets timeouts as a multiple of the expected durations
+    """
+
+    def __init__(
+        self,
+        throughputs: dict[str, Throughput],
+        factor: float = 0,
+        min_timeout: float = 0,
+        max_timeout: float = 48,
+    ):
+        self.throughputs = throughputs
+        self.factor = factor
+        self.min_timeout = min_timeout  # in hours
+        self.max_timeout = max_timeout
+
+    def duration(self, tool: str, size: int) -> Optional[float]:
+        """Expected duration in seconds, or None if nothing is known about the tool"""
+        if tool not in self.throughputs:
+            return None
+        return self.throughputs[tool].duration(size)
+
+    def timeout(self, tool: str, size: int) -> float:
+        """Timeout (in hours) of an invocation of tool on size bytes"""
+        expected = self.duration(tool, size)
+        if not self.factor or expected is None:
+            return self.max_timeout
+        timeout = self.factor * expected / 3600
+        return min(max(timeout, self.min_timeout), self.max_timeout)
+
+
+def make_estimator(
+    args: argparse.Namespace, data_local: Dataset, tools: list[Tool]
+) -> Estimator:
+    """
+    Take throughputs from past results in --results-db,
+    and with --calibrate, measure them for the rest of the tools on a sample
+    """
+    throughputs = {}
+    if args.results_db and path.exists(args.results_db):
+        throughputs = throughputs_from_db(
+            args.results_db, [t.name for t in tools], args.threads
+        )
+
+    missing = [t.name for t in tools if t.name not in throughputs]
+    if missing and args.calibrate:
+        throughputs.update(calibrate(args, data_local, missing))
+
+    return Estimator(
+        throughputs,
+        factor=args.auto_timeout,
+        min_timeout=args.min_timeout / 60,
+        max_timeout=args.timeout,
+    )
+
+
+def throughputs_from_db(
+    dbname: str, tools: list[str], n_threads: int
+) -> dict[str, Throughput]:
+    """
+    Median throughputs of valid past results, preferring the closest thread count;
+    results of transformed datasets, concurrent commands etc. are left out
+    """
+    conn = sqlite3.connect(dbname)
+    try:
+        plain = "".join(
+            f" AND {column} = {default!r}"
+            for column, default in zip(variant_columns(conn), VARIANT_FIELDS.values())
+        )
+        rows = conn.execute(
+            "SELECT tool, n_threads, original_size, ctime, dtime FROM results "
+            "WHERE is_valid = 1 AND ctime > 0 AND dtime > 0 AND original_size > 0"
+            + plain
+        ).fetchall()
+    except sqlite3.OperationalError:
+        rows = []  # not a results database
+    finally:
+        conn.close()
+
+    ret = dict()
+    for tool in tools:
+        samples = [r for r in rows if r[0] == tool]
+        if not samples:
+            continue
+
+        closest = min({r[1] for r in samples}, key=lambda t: abs(t - n_threads))
+        samples = [r for r in samples if r[1] == closest]
+        ret[tool] = Throughput(
+            compression=median(size / MB / ctime for _, _, size, ctime, _ in samples),
+            decompression=median(size / MB / dtime for _, _, size, _, dtime in samples),
+            source=f"history ({len(samples)} results, {closest} threads)",
+        )
+
+    return ret
+
+
+def calibrate(
+    args: argparse.Namespace, data_local: Dataset, tools: list[str]
+) -> dict[str, Throughput]:
+    """
+    Measure throughputs on the first --calibration-reads reads of the dataset.
+
+    Startup costs weigh more on a small sample, so these estimates
+    are rather pessimistic.
+    """
+    n_reads = args.calibration_reads
+    try:
+        sample = make_prefix(data_local, n_reads, args.scaling_dir)
+    except ValueError:
+        sample = data_local  # the dataset is small enough itself
+    sample_cont = container_dataset(sample, args.container_runtime)
+
+    logdir = path.join(
+        args.scaling_dir, "calibration-" + now().strftime("%m-%d_%H-%M-%S")
+    )
+    os.makedirs(logdir, exist_ok=True)
+
+    ret = dict()
+    for tool in get_tools(sample_cont, args.threads, ",".join(tools), args.zdur_modes):
+        logger.info(f"Calibrating {tool.name} on {sample.name}")
+        result = measure_tool(
+            tool,
+            args.container_runtime,
+            sample,
+            args.threads,
+            path.join(logdir, tool.name),
+            args.timeout,
+        )
+        if not result or not result.ctime or not result.dtime:
+            logger.warn(f"Could not calibrate {tool.name}")
+            continue
+
+        ret[tool.name] = Throughput(
+            compression=result.original_size / MB / result.ctime,
+            decompression=result.original_size / MB / result.dtime,
+            source=f"calibration ({n_reads} reads)",
+        )
+
+    return ret
+
+
+def plan(
+    args: argparse.Namespace,
+    tools: list[Tool],
+    datasets: list[tuple[str, int]],
+    estimator: Estimator,
+) -> list[dict]:
+    """Every invocation the run would make, with expected durations and timeouts"""
+    rows = []
+    for name, size in datasets:
+        for iteration in range(1, args.repeats + 1):
+            for tool in tools:
+                expected = estimator.duration(tool.name, size)
+                throughput = estimator.throughputs.get(tool.name)
+                rows.append({
+                    "iteration": iteration,
+                    "tool": tool.name,
+                    "dataset": name,
+                    "threads": args.threads,
+                    "size_mb": round(size / MB, 1),
+                    "expected_s": None if expected is None else round(expected, 1),
+                    "timeout_h": round(estimator.timeout(tool.name, size), 2),
+                    "source": throughput.source if throughput else "unknown",
+                })
+    return rows
+
+
+def print_plan(rows: list[dict]):
+    header = list(rows[0]) if rows else []
+    widths = {h: max(len(h), *(len(_fmt(r[h])) for r in rows)) for h in header}
+    print("  ".join(h.ljust(widths[h]) for h in header))
+    for r in rows:
+        print("  ".join(_fmt(r[h]).ljust(widths[h]) for h in header))
+
+    known = [r["expected_s"] for r in rows if r["expected_s"] is not None]
+    total = sum(known)
+    print(
+        f"\n{len(rows)} invocations, expected to take {timedelta(seconds=round(total))} "
+        f"(finishing around {_finish_time(total)})"
+    )
+    n_unknown = len(rows) - len(known)
+    if n_unknown:
+        print(
+            f"{n_unknown} invocations have no estimate; "
+            "use --results-db with past results or --calibrate"
+        )
+
+
+def _fmt(value) -> str:
+    return "-" if value is None else str(value)
+
+
+def _finish_time(seconds: float) -> str:
+    return (now() + timedelta(seconds=seconds)).strftime("%a %d %b %H:%M")
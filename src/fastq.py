@@ -0,0 +1,267 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from multiprocessing import Pool
+from typing import Optional
+
+from src.logger import logger
+from src.pipes import CHUNK_SIZE
+
+LINES_PER_RECORD = 4
+
+# every INDEX_STRIDE-th record of a file is indexed
+INDEX_STRIDE = 1024
+INDEX_EXT = ".fqidx"
+# files are scanned in parallel in chunks of this size
+INDEX_CHUNK_SIZE = 64 << 20
+
+# magic, version, stride, number of records, file size, file mtime (ns), number of entries
+_HEADER = struct.Struct("<4sIIQQQQ")
+_MAGIC = b"FQIX"
+_VERSION = 1
+
+
+class FastqIndex:
+    """
+    Byte offsets of records of a plain fastq file.
+
+    The file is scanned in chunks, and every stride-th record of a chunk is indexed,
+    so any record is found by reading at most stride records from the nearest entry.
+    """
+
+    def __init__(
+        self,
+        fastq: str,
+        stride: int,
+        n_records: int,
+        records: array,
+        offsets: array,
+        size: int,
+        mtime_ns: int,
+    ):
+        self.fastq = fastq
+        self.stride = stride
+        self.n_records = n_records
+        self.records = records  # numbers of indexed records, ascending
+        self.offsets = offsets  # their byte offsets
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    @classmethod
+    def build(
+        cls, fastq: str, stride: int = INDEX_STRIDE, workers: Optional[int] = None
+    ) -> "FastqIndex":
+        stat = os.stat(fastq)
+        chunks = [
+            (fastq, begin, min(begin + INDEX_CHUNK_SIZE, stat.st_size), stride)
+            for begin in range(0, stat.st_size, INDEX_CHUNK_SIZE)
+        ]
+        workers = min(workers or os.cpu_count() or 1, len(chunks))
+        if workers > 1:
+            with Pool(workers) as pool:
+                scanned = pool.starmap(_scan_chunk, chunks)
+        else:
+            scanned = [_scan_chunk(*chunk) for chunk in chunks]
+
+        # number the records of every chunk after those of the previous ones
+        records, offsets = array("Q"), array("Q")
+        n_records = 0
+        for n_chunk, chunk_offsets in scanned:
+            records.extend(range(n_records, n_records + n_chunk, stride))
+            offsets.extend(chunk_offsets)
+            n_records += n_chunk
+
+        return cls(
+            fastq, stride, n_records, records, offsets, stat.st_size, stat.st_mtime_ns
+        )
+
+    @classmethod
+    def load(cls, fastq: str) -> Optional["FastqIndex"]:
+        """Index cached next to fastq, or None if there is none or fastq has changed"""
+        try:
+            with open(fastq + INDEX_EXT, "rb") as fin:
+                header = _HEADER.unpack(fin.read(_HEADER.size))
+                magic, version, stride, n_records, size, mtime_ns, n_entries = header
+                if magic != _MAGIC or version != _VERSION:
+                    return None
+                records, offsets = array("Q"), array("Q")
+                records.fromfile(fin, n_entries)
+                offsets.fromfile(fin, n_entries)
+            stat = os.stat(fastq)
+        except (OSError, EOFError, struct.error):
+            return None
+
+        if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            return None
+        if sys.byteorder != "little":
+            records.byteswap()
+            offsets.byteswap()
+        return cls(fastq, stride, n_records, records, offsets, size, mtime_ns)
+
+    def save(self):
+        records, offsets = array("Q", self.records), array("Q", self.offsets)
+        if sys.byteorder != "little":
+            records.byteswap()
+            offsets.byteswap()
+
+        outname = self.fastq + INDEX_EXT
+        partial = outname + f".{os.getpid()}.partial"
+        with open(partial, "wb") as fout:
+            fout.write(
+                _HEADER.pack(
+                    _MAGIC,
+                    _VERSION,
+                    self.stride,
+                    self.n_records,
+                    self.size,
+                    self.mtime_ns,
+                    len(records),
+                )
+            )
+            records.tofile(fout)
+            offsets.tofile(fout)
+        os.replace(partial, outname)
+
+    def offset(self, record: int) -> int:
+        """Byte offset of record (the file size for n_records)"""
+        if not 0 <= record <= self.n_records:
+            raise ValueError(f"{self.fastq} has no record {record}")
+        if record == self.n_records:
+            return self.size
+
+        entry = bisect_right(self.records, record) - 1
+        offset = self.offsets[entry]
+        lines_left = (record - self.records[entry]) * LINES_PER_RECORD
+        if not lines_left:
+            return offset
+
+        with open(self.fastq, "rb", buffering=0) as fin:
+            fin.seek(offset)
+            while chunk := fin.read(CHUNK_SIZE):
+                n_lines = chunk.count(b"\n")
+                if n_lines >= lines_left:
+                    end = -1
+                    for _ in range(lines_left):
+                        end = chunk.index(b"\n", end + 1)
+                    return offset + end + 1
+                offset += len(chunk)
+                lines_left -= n_lines
+
+        raise ValueError(f"{self.fastq} has changed since it was indexed")
+
+    def range(self, start: int, count: int) -> tuple[int, int]:
+        """Byte range [begin, end) of count records starting with record start"""
+        if start < 0 or count < 0 or start + count > self.n_records:
+            raise ValueError(
+                f"{self.fastq} has {self.n_records} records, "
+                f"can not take {count} from record {start}"
+            )
+        return self.offset(start), self.offset(start + count)
+
+    def shards(self, n: int) -> list[tuple[int, int]]:
+        """Byte ranges of n parts with equal numbers of records (±1)"""
+        bounds = [self.offset(round(i * self.n_records / n)) for i in range(n + 1)]
+        return list(zip(bounds, bounds[1:]))
+
+
+def fastq_index(
+    fastq: str, stride: int = INDEX_STRIDE, workers: Optional[int] = None
+) -> FastqIndex:
+    """Index of a plain fastq file, cached next to it (if the directory is writable)"""
+    index = FastqIndex.load(fastq)
+    if index is not None and index.stride == stride:
+        return index
+
+    logger.info(f"Indexing {fastq}...")
+    index = FastqIndex.build(fastq, stride, workers)
+    try:
+        index.save()
+    except OSError as e:
+        logger.warn(f"Could not cache index of {fastq}: {e}")
+    return index
+
+
+def copy_range(src: str, dst: str, begin: int, end: int):
+    """Copy bytes [begin, end) of src into dst"""
+    with open(src, "rb", buffering=0) as fin, open(dst, "wb") as fout:
+        fin.seek(begin)
+        left = end - begin
+        while left > 0:
+            chunk = fin.read(min(CHUNK_SIZE, left))
+            if not chunk:
+                raise ValueError(f"{src} is shorter than {end} bytes")
+            fout.write(chunk)
+            left -= len(chunk)
+
+
+def _scan_chunk(fastq: str, begin: int, end: int, stride: int) -> tuple[int, list[int]]:
+    """
+    Number of records starting within [begin, end) of fastq,
+    and offsets of every stride-th of them
+    """
+    with open(fastq, "rb") as fin:
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # the chunk most likely starts in the middle of a record
+            start = _first_record(mm, begin)
+            if start >= end:
+                return 0, []
+            starts = _record_starts(mm, start, end)
+            return len(starts), [int(s) for s in starts[::stride]]
+
+
+def _first_record(mm: mmap.mmap, pos: int) -> int:
+    """Offset of the first record starting at or after pos"""
+    if pos > 0 and mm[pos - 1] != ord("\n"):
+        pos = _next_line(mm, pos)
+
+    # a header starts with "@", and so might a quality line; but then
+    # the line after the next one is a sequence, not the "+" separator
+    while pos < len(mm):
+        separator = _next_line(mm, _next_line(mm, pos))
+        if mm[pos] == ord("@") and mm[separator : separator + 1] == b"+":
+            return pos
+        pos = _next_line(mm, pos)
+    return len(mm)
+
+
+def _next_line(mm: mmap.mmap, pos: int) -> int:
+    newline = mm.find(b"\n", pos)
+    return len(mm) if newline < 0 else newline + 1
+
+
+def _record_starts(mm: mmap.mmap, start: int, end: int):
+    """Offsets of records starting within [start, end), start being one of them"""
+    try:
+        # optional dependency, scanning is several times faster with it
+        import numpy as np
+    except ImportError:
+        data = mm[start:end]
+        starts = [start]
+        pos = -1
+        while True:
+            for _ in range(LINES_PER_RECORD):
+                pos = data.find(b"\n", pos + 1)
+                if pos < 0:
+                    return starts
+            if start + pos + 1 < end:
+                starts.append(start + pos + 1)
+
+    data = np.frombuffer(mm, dtype=np.uint8, count=end - start, offset=start)
+    newlines = np.flatnonzero(data == ord("\n"))
+    following = newlines[LINES_PER_RECORD - 1 :: LINES_PER_RECORD] + start + 1
+    return np.concatenate(([start], following[following < end]))
+
+
+def record_lines(buf):
+    """Line of every byte of buf (a NumPy array of whole records) within its record"""
+    import numpy as np
+
+    newlines = buf == ord("\n")
+    # the newline ends the line (uint8 wraps around, but a multiple of LINES_PER_RECORD)
+    line = np.cumsum(newlines, dtype=np.uint8)
+    line -= newlines
+    line %= LINES_PER_RECORD
+    return line
@@ -0,0 +1,329 @@
+import argparse
+import csv
+import dataclasses
+import json
+import os
+import sqlite3
+import subprocess as sp
+import sys
+from typing import Optional
+
+from src.containers import DOCKER_DATA
+from src.host import host_fingerprint
+from src.logger import logger
+from src.results import VARIANT_FIELDS, Result
+from src.utils import now
+
+# sqlite column types for the scalar fields of Result
+_SQL_TYPES = {int: "INTEGER", bool: "INTEGER", float: "REAL", str: "TEXT"}
+
+# metrics for which a smaller value is better
+_MINIMISED = {"ctime", "dtime"}
+
+
+def _result_columns() -> dict[str, str]:
+    """Map scalar fields of Result to sqlite column types"""
+    ret = dict()
+    for f in dataclasses.fields(Result):
+        if f.type in _SQL_TYPES:
+            ret[f.name] = _SQL_TYPES[f.type]
+    return ret
+
+
+class ResultDatabase:
+    """
+    Appends results of every run to a local sqlite database.
+
+    Rows are buffered and inserted in a single transaction
+    once batch_size results have been accumulated (or on flush/close).
+    """
+
+    def __init__(self, dbname: str, batch_size: int = 256):
+        self.dbname = dbname
+        self.batch_size = batch_size
+        self.run_id: Optional[int] = None
+        self._pending: list[tuple] = []
+        self._pending_phases: list[tuple] = []
+
+        self.columns = _result_columns()
+
+        logger.info(f"Appending results to database {dbname}")
+        self.conn = sqlite3.connect(dbname)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._init_schema()
+
+    def _init_schema(self):
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "started TEXT, git_commit TEXT, image_digests TEXT, "
+                "host TEXT, args TEXT)"
+            )
+            # added later, older databases lack it
+            runs = {row[1] for row in self.conn.execute("PRAGMA table_info(runs)")}
+            if "calibration" not in runs:
+                self.conn.execute("ALTER TABLE runs ADD COLUMN calibration TEXT")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "run_id INTEGER REFERENCES runs(id), iteration INTEGER)"
+            )
+
+            # new fields of Result get added as columns to older databases
+            existing = {
+                row[1] for row in self.conn.execute("PRAGMA table_info(results)")
+            }
+            for name, sqltype in self.columns.items():
+                if name not in existing:
+                    self.conn.execute(
+                        f"ALTER TABLE results ADD COLUMN {name} {sqltype}"
+                    )
+
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS results_key "
+                "ON results(tool, dataset, n_threads)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS results_run ON results(run_id)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS phases ("
+                "run_id INTEGER REFERENCES runs(id), iteration INTEGER, "
+                "tool TEXT, dataset TEXT, n_threads INTEGER, step TEXT, "
+                "name TEXT, elapsed_time REAL, max_rss INTEGER, source TEXT)"
+            )
+
+    def start_run(self, metadata: dict) -> int:
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO runs "
+                "(started, git_commit, image_digests, host, args, calibration) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    metadata.get("started", now().isoformat(timespec="seconds")),
+                    metadata.get("git_commit", ""),
+                    json.dumps(metadata.get("image_digests", {})),
+                    json.dumps(metadata.get("host", {})),
+                    json.dumps(metadata.get("args", {})),
+                    json.dumps(metadata.get("calibration", {})),
+                ),
+            )
+        self.run_id = cur.lastrowid
+        logger.info(f"Registered run {self.run_id} in {self.dbname}")
+        return self.run_id
+
+    def add_result(self, result: Result, iteration: int = 0):
+        if self.run_id is None:
+            raise RuntimeError("start_run must be called before adding results")
+
+        values = [getattr(result, name) for name in self.columns]
+        self._pending.append((self.run_id, iteration, *values))
+        for phase in result.phases:
+            self._pending_phases.append((
+                self.run_id,
+                iteration,
+                result.tool,
+                result.dataset,
+                result.n_threads,
+                phase.step,
+                phase.name,
+                phase.elapsed_time,
+                phase.max_rss,
+                phase.source,
+            ))
+
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+
+        names = ["run_id", "iteration", *self.columns]
+        placeholders = ", ".join("?" * len(names))
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT INTO results ({', '.join(names)}) VALUES ({placeholders})",
+                self._pending,
+            )
+            self.conn.executemany(
+                "INSERT INTO phases VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self._pending_phases,
+            )
+        self._pending.clear()
+        self._pending_phases.clear()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+def collect_run_metadata(args: argparse.Namespace) -> dict:
+    """Git commit, image digests, host fingerprint and CLI arguments of the current run"""
+    return {
+        "started": now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "image_digests": image_digests(args.container_runtime),
+        "host": host_fingerprint(args.container_runtime),
+        "args": {k: getattr(v, "name", v) for k, v in vars(args).items()},
+    }
+
+
+def _git_commit() -> str:
+    proc = sp.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True)
+    if proc.returncode != 0:
+        return ""
+    return proc.stdout.strip()
+
+
+def image_digests(runtime: str) -> dict[str, str]:
+    if runtime == "none":
+        return {}
+
+    ret = dict()
+    for data in DOCKER_DATA.values():
+        proc = sp.run(
+            [runtime, "image", "inspect", "--format", "{{.Id}}", data.image_name],
+            capture_output=True,
+            text=True,
+        )
+        if proc.returncode == 0:
+            ret[data.image_name] = proc.stdout.strip()
+    return ret
+
+
+def query(args: argparse.Namespace):
+    """Entry point of the query CLI"""
+    if not os.path.exists(args.db):
+        raise FileNotFoundError(args.db)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        header, rows = _QUERIES[args.command](conn, args)
+        if args.command == "export" and args.format == "json":
+            _write_json(header, rows, args.output)
+        else:
+            _write_csv(header, rows, args.output)
+    finally:
+        conn.close()
+
+
+def _filters(args: argparse.Namespace) -> tuple[str, list]:
+    conds, params = [], []
+    for column, value in [
+        ("r.tool", getattr(args, "tool", None)),
+        ("r.dataset", getattr(args, "dataset", None)),
+        ("r.n_threads", getattr(args, "threads", None)),
+        ("r.run_id", getattr(args, "run", None)),
+    ]:
+        if value is not None:
+            conds.append(f"{column} = ?")
+            params.append(value)
+
+    if not getattr(args, "include_invalid", False):
+        conds.append("r.is_valid = 1")
+
+    where = ("WHERE " + " AND ".join(conds)) if conds else ""
+    return where, params
+
+
+def _query_runs(conn: sqlite3.Connection, args: argparse.Namespace):
+    header = ["run_id", "started", "git_commit", "results"]
+    rows = conn.execute(
+        "SELECT runs.id, runs.started, runs.git_commit, COUNT(results.id) "
+        "FROM runs LEFT JOIN results ON results.run_id = runs.id "
+        "GROUP BY runs.id ORDER BY runs.id"
+    )
+    return header, rows
+
+
+def _query_trend(conn: sqlite3.Connection, args: argparse.Namespace):
+    where, params = _filters(args)
+    m = args.metric
+    variants = ", ".join(variant_columns(conn, "r"))
+    header = ["run_id", "started", "tool", "dataset", "threads", *VARIANT_FIELDS, "n", "mean", "min", "max"]  # fmt: skip
+    rows = conn.execute(
+        f"SELECT r.run_id, runs.started, r.tool, r.dataset, r.n_threads, {variants}, "
+        f"COUNT(*), ROUND(AVG(r.{m}), 3), MIN(r.{m}), MAX(r.{m}) "
+        f"FROM results r JOIN runs ON runs.id = r.run_id {where} "
+        f"GROUP BY r.run_id, r.tool, r.dataset, r.n_threads, {variants} "
+        f"ORDER BY r.tool, r.dataset, r.n_threads, {variants}, r.run_id",
+        params,
+    )
+    return header, rows
+
+
+def _query_best(conn: sqlite3.Connection, args: argparse.Namespace):
+    where, params = _filters(args)
+    m = args.metric
+    agg = "MIN" if m in _MINIMISED else "MAX"
+    variants = ", ".join(variant_columns(conn, "r"))
+    header = ["tool", "dataset", "threads", *VARIANT_FIELDS, "n", f"best_{m}", "run_id"]
+    # sqlite returns the values of the row holding MIN/MAX for bare columns
+    rows = conn.execute(
+        f"SELECT r.tool, r.dataset, r.n_threads, {variants}, COUNT(*), {agg}(r.{m}), "
+        f"r.run_id FROM results r {where} "
+        f"GROUP BY r.tool, r.dataset, r.n_threads, {variants} "
+        f"ORDER BY r.dataset, r.n_threads, {variants}, {agg}(r.{m})",
+        params,
+    )
+    return header, rows
+
+
+def variant_columns(conn: sqlite3.Connection, alias: str = "") -> list[str]:
+    """
+    SQL expressions of VARIANT_FIELDS of results, with their defaults
+    for rows (and databases) older than the fields
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(results)")}
+    prefix = f"{alias}." if alias else ""
+    # a bare integer would be taken for a column number by GROUP BY and ORDER BY
+    return [
+        f"COALESCE({prefix}{name}, {default!r})"
+        if name in columns
+        else f"CAST({default!r} AS {_SQL_TYPES[type(default)]})"
+        for name, default in VARIANT_FIELDS.items()
+    ]
+
+
+def _query_export(conn: sqlite3.Connection, args: argparse.Namespace):
+    where, params = _filters(args)
+    cur = conn.execute(
+        "SELECT r.*, runs.started, runs.git_commit, runs.image_digests, "
+        f"runs.host, runs.args, runs.calibration FROM results r JOIN runs ON runs.id = r.run_id {where} "
+        "ORDER BY r.id",
+        params,
+    )
+    header = [d[0] for d in cur.description]
+    return header, cur
+
+
+_QUERIES = {
+    "runs": _query_runs,
+    "trend": _query_trend,
+    "best": _query_best,
+    "export": _query_export,
+}
+
+
+def _write_csv(header: list[str], rows, output: Optional[str]):
+    fout = open(output, "w", newline="") if output else sys.stdout
+    try:
+        writer = csv.writer(fout, dialect="unix", quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(header)
+        writer.writerows(rows)
+    finally:
+        if output:
+            fout.close()
+
+
+def _write_json(header: list[str], rows, output: Optional[str]):
+    fout = open(output, "w") if output else sys.stdout
+    try:
+        for row in rows:
+            fout.write(json.dumps(dict(zip(header, row))) + "\n")
+    finally:
+        if output:
+            fout.close()
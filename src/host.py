@@ -0,0 +1,254 @@
+import glob
+import json
+import os
+import platform
+import random
+import subprocess as sp
+import time
+import zlib
+from multiprocessing import Pool
+from os import path
+from typing import Optional
+
+from src.logger import logger
+from src.results import Result
+
+# data compressed by every process of the compute benchmarks, in bytes, and how often
+COMPUTE_SIZE = 4 << 20
+COMPUTE_ROUNDS = 4
+# buffer copied by the memory benchmark, and how often
+MEMORY_SIZE = 256 << 20
+MEMORY_ROUNDS = 4
+# file written and read by the disk benchmark
+DISK_SIZE = 256 << 20
+DISK_BLOCK = 1 << 20
+
+CALIBRATION_NAME = "calibration.json"
+
+
+def host_fingerprint(runtime: str = "none") -> dict:
+    """CPU, memory, frequency scaling, OS and container runtime of the host"""
+    cpuinfo = _cpuinfo()
+    return {
+        "hostname": platform.node(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "kernel": platform.release(),
+        "python": platform.python_version(),
+        "cpu_model": cpuinfo.get("model name", platform.processor()),
+        "cpu_count": os.cpu_count(),
+        "physical_cores": _physical_cores(),
+        "cpu_max_mhz": _max_frequency(cpuinfo),
+        "governors": _governors(),
+        "memory_kb": _meminfo().get("MemTotal", 0),
+        "runtime": _runtime_version(runtime),
+    }
+
+
+def calibrate_host(scratch: str) -> dict:
+    """
+    Short micro-benchmarks of the host: zlib compression on one and on all cores
+    (MB/s of input), memory copy bandwidth (GB/s, read and written)
+    and sequential write and read of a file in scratch (MB/s)
+    """
+    logger.info("Calibrating host...")
+    n_cores = os.cpu_count() or 1
+    scores = {
+        "single_core_mbps": _compute(1),
+        "multi_core_mbps": _compute(n_cores),
+        "memory_gbps": _memory(),
+    }
+    scores["disk_write_mbps"], scores["disk_read_mbps"] = _disk(scratch)
+    scores = {k: round(v, 2) for k, v in scores.items()}
+    logger.info("Host calibration: " + ", ".join(f"{k} {v}" for k, v in scores.items()))
+    return scores
+
+
+def save_calibration(results_dir: str, host: dict, scores: dict) -> str:
+    outname = path.join(results_dir, CALIBRATION_NAME)
+    with open(outname, "w") as fout:
+        json.dump({"host": host, "scores": scores}, fout, indent=1)
+    return outname
+
+
+class Normaliser:
+    """
+    Adds times scaled to a reference host to results: times are multiplied by
+    the compute score of this host over the one of the reference, so they estimate
+    how long the reference host would take. Scores are per core: of the
+    single-core benchmark for one thread, else of the multi-core one.
+    """
+
+    fieldnames = [
+        "compression_time_normalised",
+        "decompression_time_normalised",
+        "decode_only_time_normalised",
+    ]
+
+    def __init__(self, scores: dict, reference: str):
+        with open(reference, "r") as fin:
+            ref = json.load(fin)
+        self.scores = scores
+        self.reference = ref["scores"]
+        self._n_cores = os.cpu_count() or 1
+        self._ref_cores = ref["host"].get("cpu_count") or 1
+
+    def columns(self, result: Result) -> dict:
+        factor = self._factor(result.n_threads)
+        return dict(
+            zip(
+                self.fieldnames,
+                (
+                    round(t * factor, 3)
+                    for t in (result.ctime, result.dtime, result.decode_time)
+                ),
+            )
+        )
+
+    def _factor(self, n_threads: int) -> float:
+        if n_threads <= 1:
+            return self.scores["single_core_mbps"] / self.reference["single_core_mbps"]
+        host = self.scores["multi_core_mbps"] / self._n_cores
+        ref = self.reference["multi_core_mbps"] / self._ref_cores
+        return host / ref
+
+
+def _compute(n_workers: int) -> float:
+    data = _sample_data()
+    start = time.perf_counter()
+    if n_workers > 1:
+        with Pool(n_workers) as pool:
+            pool.map(_compress_rounds, [data] * n_workers)
+    else:
+        _compress_rounds(data)
+    elapsed = time.perf_counter() - start
+    return n_workers * COMPUTE_ROUNDS * len(data) / 1e6 / elapsed
+
+
+def _sample_data() -> bytes:
+    """Random bases, compressible like sequences"""
+    table = bytes(b"ACGT"[i % 4] for i in range(256))
+    return random.Random(0).randbytes(COMPUTE_SIZE).translate(table)
+
+
+def _compress_rounds(data: bytes):
+    for _ in range(COMPUTE_ROUNDS):
+        zlib.compress(data, 6)
+
+
+def _memory() -> float:
+    src = bytearray(MEMORY_SIZE)
+    dst = bytearray(MEMORY_SIZE)
+    start = time.perf_counter()
+    for _ in range(MEMORY_ROUNDS):
+        dst[:] = src
+    elapsed = time.perf_counter() - start
+    return 2 * MEMORY_ROUNDS * MEMORY_SIZE / 1e9 / elapsed
+
+
+def _disk(scratch: str) -> tuple[float, float]:
+    """Sequential write (including fsync) and read of a file, bypassing the page cache"""
+    fname = path.join(scratch, f".calibration.{os.getpid()}")
+    block = os.urandom(DISK_BLOCK)
+    try:
+        start = time.perf_counter()
+        with open(fname, "wb", buffering=0) as fout:
+            for _ in range(DISK_SIZE // DISK_BLOCK):
+                fout.write(block)
+            os.fsync(fout.fileno())
+            # written pages are clean now, so they can be dropped from the cache
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fout.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        write = DISK_SIZE / 1e6 / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with open(fname, "rb", buffering=0) as fin:
+            while fin.read(DISK_BLOCK):
+                pass
+        read = DISK_SIZE / 1e6 / (time.perf_counter() - start)
+    finally:
+        if path.exists(fname):
+            os.unlink(fname)
+    return write, read
+
+
+def _cpuinfo() -> dict[str, str]:
+    """Fields of the first processor in /proc/cpuinfo"""
+    info = {}
+    try:
+        with open("/proc/cpuinfo", "r") as fin:
+            for line in fin:
+                if not line.strip():
+                    break
+                key, _, value = line.partition(":")
+                info[key.strip()] = value.strip()
+    except OSError:
+        pass
+    return info
+
+
+def _physical_cores() -> Optional[int]:
+    cores = set()
+    try:
+        with open("/proc/cpuinfo", "r") as fin:
+            package = ""
+            for line in fin:
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if key == "physical id":
+                    package = value.strip()
+                elif key == "core id":
+                    cores.add((package, value.strip()))
+    except OSError:
+        pass
+    return len(cores) or None
+
+
+def _max_frequency(cpuinfo: dict[str, str]) -> Optional[float]:
+    """Highest frequency of the CPU in MHz, or the current one if not known"""
+    freq = _read_sys("/sys/devices/system/cpu/cpu0/cpufreq/cpuinfo_max_freq")
+    if freq.isdigit():
+        return int(freq) / 1000
+    try:
+        return float(cpuinfo["cpu MHz"])
+    except (KeyError, ValueError):
+        return None
+
+
+def _governors() -> list[str]:
+    """Frequency scaling governors in use (empty if frequency scaling is not exposed)"""
+    files = glob.glob("/sys/devices/system/cpu/cpu*/cpufreq/scaling_governor")
+    return sorted({_read_sys(f) for f in files} - {""})
+
+
+def _meminfo() -> dict[str, int]:
+    """Fields of /proc/meminfo, in kB"""
+    info = {}
+    try:
+        with open("/proc/meminfo", "r") as fin:
+            for line in fin:
+                key, _, value = line.partition(":")
+                fields = value.split()
+                if fields and fields[0].isdigit():
+                    info[key] = int(fields[0])
+    except OSError:
+        pass
+    return info
+
+
+def _runtime_version(runtime: str) -> str:
+    if runtime == "none":
+        return ""
+    try:
+        proc = sp.run([runtime, "--version"], capture_output=True, text=True)
+    except OSError:
+        return ""
+    return proc.stdout.strip() if proc.returncode == 0 else ""
+
+
+def _read_sys(fname: str) -> str:
+    try:
+        with open(fname, "r") as fin:
+            return fin.read().strip()
+    except OSError:
+        return ""
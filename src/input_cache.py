@@ -0,0 +1,203 @@
+import json
+import os
+import shutil
+import subprocess as sp
+import time
+from os import path
+
+from src.containers import DOCKER_DATA, ContainerEnv, ShellRunner
+from src.dataset import COMPRESSED_SUFFIXES
+from src.logger import logger
+from src.pipes import file_digest
+
+INDEX_NAME = "index.json"
+
+# decompressors writing to stdout, in order of preference;
+# the first one available on the host is used
+DECOMPRESSORS = {
+    "gzip": [
+        ("rapidgzip", "rapidgzip -d -c -P {threads} {src}"),
+        ("pigz", "pigz -dc -p {threads} {src}"),
+        ("gzip", "gzip -dc {src}"),
+    ],
+    "zstd": [
+        ("zstd", "zstd -dc -T{threads} {src}"),
+    ],
+}
+
+# used if none of the above is available on the host
+IMAGE_DECOMPRESSORS = {
+    "gzip": ("pigz", "pigz -dc -p {threads} {src}"),
+    "zstd": ("zstd", "zstd -dc -T{threads} {src}"),
+}
+
+
+class InputCache:
+    """
+    Content-addressed cache of decompressed inputs.
+
+    Every compressed file is decompressed once into
+        <cache_dir>/<digest of the compressed file>/<name without suffix>,
+    so the cache is shared by all runs and tools. When the total size
+    exceeds budget, least recently used entries are removed. The last use
+    is kept in the index, the decompressed files are never touched, as their
+    mtime is part of the keys of other caches (e.g. results and transforms).
+    """
+
+    def __init__(self, cache_dir: str, budget: int, runtime: str, n_threads: int):
+        self.cache_dir = cache_dir
+        self.budget = budget  # in bytes
+        self.runtime = runtime
+        self.n_threads = n_threads
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index_path = path.join(cache_dir, INDEX_NAME)
+        self._index = self._load_index()
+
+        # entries used by this run must not be evicted
+        self._in_use: set[str] = set()
+
+    def _load_index(self) -> dict:
+        """realpath of a compressed file -> its size, mtime, digest and last use"""
+        if not path.exists(self._index_path):
+            return {}
+        with open(self._index_path, "r") as fin:
+            return json.load(fin)
+
+    def _save_index(self):
+        tmp = self._index_path + f".{os.getpid()}.tmp"
+        with open(tmp, "w") as fout:
+            json.dump(self._index, fout, indent=1)
+        os.replace(tmp, self._index_path)
+
+    def _digest(self, compressed: str) -> str:
+        """Digest of the file, recomputed only if the file has changed"""
+        real = path.realpath(compressed)
+        stat = os.stat(real)
+        known = self._index.get(real)
+        if (
+            known
+            and known["size"] == stat.st_size
+            and known["mtime"] == stat.st_mtime_ns
+        ):
+            return known["digest"]
+
+        logger.info(f"Computing digest of {compressed}...")
+        digest = file_digest([real], "sha256")
+        self._index[real] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "digest": digest,
+        }
+        self._save_index()
+        return digest
+
+    def get(self, compressed: str) -> str:
+        """Return local path to the decompressed copy of compressed"""
+        digest = self._digest(compressed)
+        entry = path.join(self.cache_dir, digest)
+        name = path.splitext(path.basename(compressed))[0]
+        decompressed = path.join(entry, name)
+        self._in_use.add(entry)
+        self._index[path.realpath(compressed)]["last_used"] = time.time()
+        self._save_index()
+
+        if path.exists(decompressed):
+            logger.info(f"Using cached {decompressed} for {compressed}")
+            return decompressed
+
+        os.makedirs(entry, exist_ok=True)
+        # decompress to a temporary name, so that
+        # interrupted decompression does not end up in the cache
+        partial = decompressed + f".{os.getpid()}.partial"
+        self._decompress(compressed, partial)
+        os.replace(partial, decompressed)
+
+        self._evict()
+        return decompressed
+
+    def _decompress(self, compressed: str, out: str):
+        fmt = COMPRESSED_SUFFIXES[path.splitext(compressed)[1]]
+
+        candidates = DECOMPRESSORS[fmt]
+        for binary, template in candidates:
+            if shutil.which(binary):
+                runner = ShellRunner("none", None)
+                logger.info(f"Decompressing {compressed} with {binary}...")
+                cmd = template.format(threads=self.n_threads, src=compressed)
+                if not runner.execute(cmd, gnu_time=False, stdout=path.abspath(out)):
+                    self._fail(compressed, out, runner.last_error)
+                return
+
+        if self.runtime == "none":
+            raise RuntimeError(
+                f"none of {', '.join(b for b, _ in candidates)} found to decompress {compressed}"
+            )
+        self._decompress_in_image(compressed, out, fmt)
+
+    def _decompress_in_image(self, compressed: str, out: str, fmt: str):
+        """
+        Decompress with the tools image, streaming the file through the container,
+        so that it does not have to be mounted (it may be outside the working directory)
+        """
+        binary, template = IMAGE_DECOMPRESSORS[fmt]
+        # without a file, the decompressors read stdin
+        cmd = template.format(threads=self.n_threads, src="").strip()
+        to_run = [
+            self.runtime,
+            "run",
+            "-i",
+            "--rm",
+            DOCKER_DATA[ContainerEnv.Common].image_name,
+            "sh",
+            "-c",
+            cmd,
+        ]
+        logger.info(f"Decompressing {compressed} with {binary} in a container...")
+        logger.info(" ".join(to_run) + f" < {compressed} > {out}")
+        with open(compressed, "rb") as fin, open(out, "wb") as fout:
+            proc = sp.run(to_run, stdin=fin, stdout=fout, stderr=sp.PIPE)
+        if proc.returncode != 0:
+            self._fail(
+                compressed,
+                out,
+                f"Exited with non-zero code {proc.returncode}: "
+                + proc.stderr.decode("utf8", errors="replace").rstrip(),
+            )
+
+    @staticmethod
+    def _fail(compressed: str, out: str, error: str):
+        if path.exists(out):
+            os.unlink(out)
+        raise RuntimeError(f"failed to decompress {compressed}: {error}")
+
+    def _evict(self):
+        # an entry is shared by all copies of the same compressed file
+        last_use: dict[str, float] = {}
+        for known in self._index.values():
+            digest = known["digest"]
+            last_use[digest] = max(last_use.get(digest, 0), known.get("last_used", 0))
+
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            entry = path.join(self.cache_dir, name)
+            if not path.isdir(entry):
+                continue
+            size = sum(path.getsize(path.join(entry, f)) for f in os.listdir(entry))
+            entries.append((last_use.get(name, 0), size, entry))
+            total += size
+
+        for _, size, entry in sorted(entries):
+            if total <= self.budget:
+                break
+            if entry in self._in_use:
+                continue
+            logger.info(f"Evicting {entry} from the input cache")
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+        if total > self.budget:
+            logger.warn(
+                f"Inputs of this run ({total} bytes) do not fit in the cache budget ({self.budget} bytes)"
+            )
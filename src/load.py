@@ -0,0 +1,263 @@
+import argparse
+import csv
+import dataclasses
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from statistics import mean
+from typing import Optional
+
+from src.containers import container_dataset
+from src.dataset import Dataset
+from src.estimate import Estimator
+from src.logger import logger
+from src.measure import MeasureOptions, measure_tool, options_from_args
+from src.results import Result
+from src.tools import Tool, get_tools, scaled_tool
+
+FIELDNAMES = [
+    "tool",  # as in the runs with all threads, the same at every number of instances
+    "run_as",  # tool run by every instance, e.g. gzipx2 (in 2 chunks) for gzipx4
+    "dataset",
+    "iteration",
+    "instances",
+    "threads",  # of every instance
+    "wall_time",  # from the start of the first instance to the end of the last one
+    "aggregate_gb_per_hour",  # data compressed and decompressed by all instances
+    "instance_time",  # mean compression and decompression time of an instance
+    "solo_time",  # the same, of one instance running alone
+    "slowdown",  # instance_time / solo_time
+    "memory_sum_kb",  # sum of peak memory of the instances (upper bound of the peak)
+    "memory_used_kb",  # peak increase of memory used on the host during the batch
+    "failed",  # instances with invalid results
+]
+
+# how often the memory used on the host is sampled, in seconds
+MEMORY_INTERVAL = 0.1
+
+
+def load_instances(n_cores: int) -> list[int]:
+    """Default numbers of concurrent instances: powers of two up to n_cores, and n_cores"""
+    counts = []
+    k = 1
+    while k < n_cores:
+        counts.append(k)
+        k *= 2
+    return counts + [n_cores]
+
+
+def measure_load(
+    args: argparse.Namespace,
+    data_local: Dataset,
+    results_dir: str,
+    estimator: Estimator,
+) -> list[dict]:
+    """
+    Run K concurrent instances of every tool, for every K of args.load_instances,
+    and write their aggregate throughput and slowdown to load.csv.
+
+    Every instance works on its own links to the dataset (so outputs do not clash)
+    with args.threads / K threads; slowdowns are relative to one instance
+    with as many threads running alone. The tools are those offered with
+    args.threads, built with fewer threads as needed (see scaled_tool).
+    """
+    counts = args.load_instances or load_instances(os.cpu_count() or 1)
+    scratch = path.join(results_dir, "load")
+    logdir = path.join(results_dir, "logs")
+    os.makedirs(logdir, exist_ok=True)
+
+    options = options_from_args(args)
+    size = sum(path.getsize(f) for f in data_local.files)
+    # with fewer threads, get_tools would offer other tools (e.g. gzip for pigz)
+    data_cont = container_dataset(data_local, args.container_runtime)
+    names = [
+        t.name for t in get_tools(data_cont, args.threads, args.tools, args.zdur_modes)
+    ]
+    solo: dict[tuple[str, int], float] = {}
+    rows = []
+    for k in counts:
+        n_threads = max(1, args.threads // k)
+        instances = []
+        for i in range(k):
+            linked = data_local.linked_into(
+                path.join(scratch, f"{k}x{n_threads}", str(i))
+            )
+            data_cont = container_dataset(linked, args.container_runtime)
+            tools = [scaled_tool(data_cont, name, n_threads) for name in names]
+            instances.append((linked, tools))
+
+        for j, (name, tool) in enumerate(zip(names, instances[0][1])):
+            if tool.name != name:
+                logger.info(f"{name} runs as {tool.name} with {n_threads} threads")
+            timeout = estimator.timeout(name, size)
+            # one instance alone is the solo run
+            if k > 1 and (name, n_threads) not in solo:
+                linked, tools = instances[0]
+                logger.info(f"Solo run of {tool.name} with {n_threads} threads")
+                results, _, _ = _run_batch(
+                    [tools[j]],
+                    [linked],
+                    args.container_runtime,
+                    n_threads,
+                    path.join(logdir, f"{tool.name}_solo{n_threads}"),
+                    timeout,
+                    options,
+                )
+                solo[(name, n_threads)] = _round_trip(results[0])
+
+            for iteration in range(1, args.repeats + 1):
+                logger.info(
+                    f"Iteration {iteration} for {k} instances of {tool.name} "
+                    f"with {n_threads} threads each"
+                )
+                results, wall, used = _run_batch(
+                    [tools[j] for _, tools in instances],
+                    [linked for linked, _ in instances],
+                    args.container_runtime,
+                    n_threads,
+                    path.join(logdir, f"{tool.name}_load{k}_iter{iteration}"),
+                    timeout * k,
+                    options,
+                )
+                if k == 1:
+                    solo.setdefault((name, n_threads), _round_trip(results[0]))
+                row = _row(tool, data_local, results, wall, used)
+                solo_time = solo[(name, n_threads)]
+                row.update(
+                    tool=name,
+                    iteration=iteration,
+                    instances=k,
+                    threads=n_threads,
+                    solo_time=solo_time,
+                    slowdown=(
+                        round(row["instance_time"] / solo_time, 3)
+                        if row["instance_time"] and solo_time
+                        else None
+                    ),
+                )
+                rows.append(row)
+
+    shutil.rmtree(scratch)
+
+    outname = path.join(results_dir, "load.csv")
+    with open(outname, "w") as fout:
+        writer = csv.DictWriter(
+            fout,
+            dialect="unix",
+            quoting=csv.QUOTE_MINIMAL,
+            fieldnames=FIELDNAMES,
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+
+    for r in rows:
+        logger.info(
+            f"{r['tool']} x{r['instances']} ({r['threads']} threads): "
+            f"{r['aggregate_gb_per_hour']} GB/h, slowdown {r['slowdown']}"
+        )
+    logger.info(f"Wrote {outname}")
+    return rows
+
+
+def _run_batch(
+    tools: list[Tool],
+    datasets: list[Dataset],
+    runtime: str,
+    n_threads: int,
+    logfile_prefix: str,
+    timeout: float,
+    options: MeasureOptions,
+) -> tuple[list[Result], float, Optional[int]]:
+    """
+    Measure tools concurrently, return their results, the wall time of the batch
+    and the peak increase of memory used on the host (in kB, if known)
+    """
+    sampler = _MemorySampler()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(tools)) as pool:
+        futures = []
+        for i, (tool, data_local) in enumerate(zip(tools, datasets)):
+            # every instance runs in its own container
+            instance_options = dataclasses.replace(options, instance=f"load{i}")
+            futures.append(
+                pool.submit(
+                    measure_tool,
+                    tool,
+                    runtime,
+                    data_local,
+                    n_threads,
+                    f"{logfile_prefix}_{i}",
+                    timeout,
+                    instance_options,
+                )
+            )
+        results = [f.result() for f in futures]
+    wall = time.perf_counter() - start
+    return results, wall, sampler.stop()
+
+
+def _row(
+    tool: Tool,
+    data_local: Dataset,
+    results: list[Result],
+    wall: float,
+    used: Optional[int],
+) -> dict:
+    valid = [r for r in results if r]
+    processed = sum(r.original_size + r.decompressed_size for r in valid)
+    return {
+        "run_as": tool.name,
+        "dataset": data_local.name,
+        "wall_time": round(wall, 3),
+        "aggregate_gb_per_hour": round(processed / 1024**3 / wall * 3600, 3),
+        "instance_time": (
+            round(mean(_round_trip(r) for r in valid), 3) if valid else None
+        ),
+        "memory_sum_kb": sum(max(r.cmem, r.dmem) for r in valid),
+        "memory_used_kb": used,
+        "failed": len(results) - len(valid),
+    }
+
+
+def _round_trip(result: Result) -> float:
+    return round(result.ctime + result.dtime, 3) if result else 0.0
+
+
+class _MemorySampler:
+    """Samples memory used on the host (total less available) in a thread"""
+
+    def __init__(self):
+        self._baseline = _used_memory()
+        self._peak = self._baseline
+        self._stop = threading.Event()
+        self._thread = None
+        if self._baseline is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+
+    def _sample(self):
+        while not self._stop.wait(MEMORY_INTERVAL):
+            self._peak = max(self._peak, _used_memory() or 0)
+
+    def stop(self) -> Optional[int]:
+        """Peak increase of used memory since the start, in kB"""
+        if self._thread is None:
+            return None
+        self._stop.set()
+        self._thread.join()
+        return max(self._peak - self._baseline, 0)
+
+
+def _used_memory() -> Optional[int]:
+    """Memory used on the host in kB, None if /proc/meminfo is not available"""
+    try:
+        with open("/proc/meminfo", "r") as fin:
+            info = dict(line.split(":", 1) for line in fin)
+        total = int(info["MemTotal"].split()[0])
+        available = int(info["MemAvailable"].split()[0])
+    except (OSError, KeyError, ValueError):
+        return None
+    return total - available
@@ -1,12 +1,70 @@
+import argparse
 import copy
+import dataclasses
 import os
+from concurrent.futures import ThreadPoolExecutor
 from os import path
+from typing import Callable, Iterable, Optional
 
+from src.compat import dataclass
 from src.containers import ContainerEnv, ShellRunner
 from src.dataset import Dataset
 from src.logger import logger
+from src.phases import Phase, parse_phases
+from src.pipes import CountingPipe, ThrottledPipe, file_digest
 from src.results import Result, parse_logfile_for_stats
-from src.tools import Tool
+from src.throttle import ThrottleProfile
+from src.tools import CompressDecompress, Tool
+from src.watchdog import Watchdog, WatchdogOptions
+
+
+@dataclass(slots=True)
+class MeasureOptions:
+    """Optional settings of measure_tool"""
+
+    # appended to container names to allow several concurrent measurements
+    instance: str = ""
+
+    # where to send output of decompression_stdout commands:
+    # "null" for /dev/null, "pipe" for a pipe counting (and hashing) the output;
+    # empty string disables decode-only measurements
+    decode_sink: str = ""
+    decode_digest: str = ""  # hashlib algorithm, only used with "pipe"
+
+    # aborts stalled or too slow commands; disabled here, but enabled by
+    # options_from_args unless --stall-window is 0
+    watchdog: WatchdogOptions = dataclasses.field(default_factory=WatchdogOptions)
+
+    # if given, compression reads the input from a pipe throttled like network storage
+    # (only commands with compression_stdin)
+    throttle: Optional[ThrottleProfile] = None
+
+    # run the commands of a tool (e.g. one per mate) at the same time
+    concurrent_commands: bool = False
+
+    # if given, commands are executed there instead of in a new container each
+    # (its container must already be running and have the binary of the tool)
+    session: Optional[ShellRunner] = None
+
+    # called with the name of every step (e.g. compression1) when it starts
+    on_step: Optional[Callable[[str], None]] = None
+
+
+def options_from_args(args: argparse.Namespace) -> MeasureOptions:
+    return MeasureOptions(
+        decode_sink="" if args.decode_throughput == "off" else args.decode_throughput,
+        decode_digest=args.decode_digest,
+        watchdog=WatchdogOptions(
+            interval=args.watchdog_interval,
+            stall_window=args.stall_window,
+            min_throughput=args.min_throughput,
+        ),
+    )
+
+
+def tool_environment(tool: Tool) -> ContainerEnv:
+    """Container the tool is run in"""
+    return ContainerEnv.FaStore if tool.name == "FaStore" else ContainerEnv.Common
 
 
 # all paths are local
@@ -17,14 +75,17 @@ def measure_tool(
     data_local: Dataset,
     n_threads: int,
     logfile_prefix: str,
-    timeout: int,
+    timeout: float,
+    options: Optional[MeasureOptions] = None,
 ) -> Result:
     """
-    Paths in data_local and logfile_prefix are local
+    Paths in data_local and logfile_prefix are local, timeout is in hours
     """
+    options = options or MeasureOptions()
 
-    environ = ContainerEnv.FaStore if tool.name == "FaStore" else ContainerEnv.Common
-    runner = ShellRunner(runtime, environ)
+    runner = options.session or ShellRunner(
+        runtime, tool_environment(tool), options.instance
+    )
 
     empty_result = Result(
         tool=tool.name,
@@ -34,76 +95,323 @@ def measure_tool(
 
     result_total = copy.deepcopy(empty_result)
 
-    if not runner.exec_exists(tool.binary):
+    if not options.session and not runner.exec_exists(tool.binary):
         result_total.is_valid = False
+        result_total.failure = f"{tool.binary} not found"
         logger.warn(f"{tool.name} not found, skipping...")
         return result_total
 
     timeout = timeout * 60 * 60
 
+    if options.concurrent_commands and len(tool.commands) > 1:
+        return _measure_concurrently(
+            tool, runtime, result_total, logfile_prefix, timeout, options
+        )
+
     for idx_cmd, cmd in enumerate(tool.commands):
         result = copy.deepcopy(empty_result)
+        result_total.commands.append(result)
 
-        logfile = logfile_prefix + f"_compression{idx_cmd + 1}"
-
-        # Compression...
-        if not runner.execute(cmd.compression, logfile, timeout=timeout):
-            result_total.is_valid = False
+        failed = _compress(
+            tool, idx_cmd, runner, result, logfile_prefix, timeout, options
+        ) or _decompress(
+            tool, idx_cmd, runner, result, logfile_prefix, timeout, options
+        )
+        if failed:
+            _fail(result_total, result, failed, runner)
             break
 
-        compr_stats = parse_logfile_for_stats(logfile)
-        result.ctime = compr_stats.elapsed_time
+        result_total += result
+        _cleanup(cmd, runner, timeout)
 
-        # get all original sizes from local paths
-        for original_file in cmd.original_files_host(runner.converter):
-            result.original_size += path.getsize(original_file)
+    return result_total
 
-        # get all compressed sizes (also from local paths)
-        for archive_file in cmd.archive_files_host(runner.converter):
-            result.compressed_size += path.getsize(archive_file)
 
-        result.total_cr = round(result.original_size / result.compressed_size, 3)
+def _measure_concurrently(
+    tool: Tool,
+    runtime: str,
+    result_total: Result,
+    logfile_prefix: str,
+    timeout: float,
+    options: MeasureOptions,
+) -> Result:
+    """Run every step of all commands of tool at the same time, each in its own container"""
+    runners = [
+        ShellRunner(runtime, tool_environment(tool), f"{options.instance}cmd{idx + 1}")
+        for idx in range(len(tool.commands))
+    ]
+    result_total.concurrent = 1
+    results = [copy.deepcopy(result_total) for _ in tool.commands]
+    result_total.commands += results
 
-        # Post compression...
-        if cmd.post_compression:
-            runner.execute(cmd.post_compression, gnu_time=False, timeout=timeout)
+    with ThreadPoolExecutor(max_workers=len(tool.commands)) as pool:
+        try:
+            for step in (_compress, _decompress):
+                failures = list(
+                    pool.map(
+                        lambda idx: step(
+                            tool,
+                            idx,
+                            runners[idx],
+                            results[idx],
+                            logfile_prefix,
+                            timeout,
+                            options,
+                        ),
+                        range(len(tool.commands)),
+                    )
+                )
+                for idx, failed in enumerate(failures):
+                    if failed:
+                        _fail(result_total, results[idx], failed, runners[idx])
+                        return result_total
 
-        # Decompression...
-        logfile = logfile_prefix + f"_decompression{idx_cmd + 1}"
-        if not runner.execute(cmd.decompression, logfile, timeout=timeout):
-            result_total.is_valid = False
-            break
+            for result in results:
+                result_total += result
+        finally:
+            # the commands shared the threads of the tool, each was built with
+            # its share (set only now, as results with other threads can not be added)
+            for result in results:
+                result.n_threads = max(1, result_total.n_threads // len(tool.commands))
+            # outputs of the other commands are removed also when one has failed
+            list(pool.map(_cleanup, tool.commands, runners, [timeout] * len(runners)))
 
-        decompr_stats = parse_logfile_for_stats(logfile)
-        result.dtime = decompr_stats.elapsed_time
+    # the commands took as long as the slowest one, and their peaks add up
+    result_total.ctime = max(r.ctime for r in results)
+    result_total.dtime = max(r.dtime for r in results)
+    result_total.decode_time = max(r.decode_time for r in results)
+    result_total.cmem = sum(r.cmem for r in results)
+    result_total.dmem = sum(r.dmem for r in results)
+    return result_total
 
-        # check if size of decompressed files is the same as of original files
-        # (and warn, if it's not)
-        decompressed_size = 0
-        for dfile in cmd.decompressed_files_host(runner.converter):
-            decompressed_size += path.getsize(dfile)
-        result.decompressed_size = decompressed_size
 
-        if result.original_size != decompressed_size:
-            result.decompressed_same_size = 0
-            logger.warn(
-                f"Size of decompressed files ({decompressed_size}) does not match with the original ({result.original_size})"
-            )
+def _compress(
+    tool: Tool,
+    idx_cmd: int,
+    runner: ShellRunner,
+    result: Result,
+    logfile_prefix: str,
+    timeout: float,
+    options: MeasureOptions,
+) -> str:
+    """Run compression of command idx_cmd of tool, return the failed step (if any)"""
+    cmd = tool.commands[idx_cmd]
+    step = f"compression{idx_cmd + 1}"
+    logfile = logfile_prefix + f"_{step}"
+    _report_step(options, step)
 
-        result_total += result
+    watchdog = _watchdog(options, cmd.archive_files_host(runner.converter), logfile)
+    if options.throttle:
+        compressed = _compress_throttled(
+            cmd,
+            runner,
+            result,
+            options.throttle,
+            logfile,
+            step,
+            timeout,
+            watchdog,
+        )
+    else:
+        compressed = runner.execute(
+            cmd.compression, logfile, timeout=timeout, watchdog=watchdog
+        )
+    if not compressed:
+        return step
+
+    compr_stats = parse_logfile_for_stats(logfile)
+    result.ctime = compr_stats.elapsed_time
+    result.cmem = compr_stats.max_rss
+    result.ccpu = compr_stats.cpu_time
+    result.phases += parse_phases(tool.binary, logfile, step)
+
+    # get all original sizes from local paths
+    for original_file in cmd.original_files_host(runner.converter):
+        result.original_size += path.getsize(original_file)
+
+    # get all compressed sizes (also from local paths)
+    for archive_file in cmd.archive_files_host(runner.converter):
+        result.compressed_size += path.getsize(archive_file)
 
-        # Post decompression...
-        if cmd.post_decompression:
-            runner.execute(cmd.post_decompression, gnu_time=False, timeout=timeout)
+    result.total_cr = round(result.original_size / result.compressed_size, 3)
 
-        # Cleanup...
-        paths_to_remove = list(cmd.archive_files_host(runner.converter)) + list(
-            cmd.decompressed_files_host(runner.converter)
+    # Post compression...
+    if cmd.post_compression:
+        runner.execute(cmd.post_compression, gnu_time=False, timeout=timeout)
+    return ""
+
+
+def _decompress(
+    tool: Tool,
+    idx_cmd: int,
+    runner: ShellRunner,
+    result: Result,
+    logfile_prefix: str,
+    timeout: float,
+    options: MeasureOptions,
+) -> str:
+    """Run decompression (and decode-only) of command idx_cmd, return the failed step"""
+    cmd = tool.commands[idx_cmd]
+    step = f"decompression{idx_cmd + 1}"
+    logfile = logfile_prefix + f"_{step}"
+    _report_step(options, step)
+
+    watchdog = _watchdog(
+        options, cmd.decompressed_files_host(runner.converter), logfile
+    )
+    if not runner.execute(
+        cmd.decompression, logfile, timeout=timeout, watchdog=watchdog
+    ):
+        return step
+
+    decompr_stats = parse_logfile_for_stats(logfile)
+    result.dtime = decompr_stats.elapsed_time
+    result.dmem = decompr_stats.max_rss
+    result.dcpu = decompr_stats.cpu_time
+    result.phases += parse_phases(tool.binary, logfile, step)
+
+    # check if size of decompressed files is the same as of original files
+    # (and warn, if it's not)
+    decompressed_size = 0
+    for dfile in cmd.decompressed_files_host(runner.converter):
+        decompressed_size += path.getsize(dfile)
+    result.decompressed_size = decompressed_size
+
+    if result.original_size != decompressed_size:
+        result.decompressed_same_size = 0
+        logger.warn(
+            f"Size of decompressed files ({decompressed_size}) does not match with the original ({result.original_size})"
         )
-        msg = ", ".join(paths_to_remove)
-        logger.info("Cleanup: " + msg)
-        for p in paths_to_remove:
-            if path.exists(p):
-                os.unlink(p)
 
-    return result_total
+    # Decode-only...
+    if options.decode_sink and cmd.decompression_stdout:
+        logfile = logfile_prefix + f"_decode{idx_cmd + 1}"
+        _report_step(options, f"decode{idx_cmd + 1}")
+        if not _measure_decoding(cmd, runner, result, options, logfile, timeout):
+            return f"decode{idx_cmd + 1}"
+    return ""
+
+
+def _cleanup(cmd: CompressDecompress, runner: ShellRunner, timeout: float):
+    # Post decompression...
+    if cmd.post_decompression:
+        runner.execute(cmd.post_decompression, gnu_time=False, timeout=timeout)
+
+    paths_to_remove = list(cmd.archive_files_host(runner.converter)) + list(
+        cmd.decompressed_files_host(runner.converter)
+    )
+    msg = ", ".join(paths_to_remove)
+    logger.info("Cleanup: " + msg)
+    for p in paths_to_remove:
+        if path.exists(p):
+            os.unlink(p)
+
+
+def _watchdog(
+    options: MeasureOptions, outputs: Iterable[str], logfile: str
+) -> Optional[Watchdog]:
+    """Watchdog of a command writing outputs (local paths) and logfile"""
+    if not options.watchdog.enabled:
+        return None
+    return Watchdog(options.watchdog, [*outputs, logfile])
+
+
+def _report_step(options: MeasureOptions, step: str):
+    if options.on_step:
+        options.on_step(step)
+
+
+def _fail(result_total: Result, result: Result, step: str, runner: ShellRunner):
+    result.is_valid = False
+    result.failure = f"{step}: {runner.last_error}"
+    result_total.is_valid = False
+    result_total.failure = result.failure
+
+
+def _compress_throttled(
+    cmd: CompressDecompress,
+    runner: ShellRunner,
+    result: Result,
+    throttle: ThrottleProfile,
+    logfile: str,
+    step: str,
+    timeout: int,
+    watchdog: Optional[Watchdog],
+) -> bool:
+    """Run compression reading stdin from a throttled pipe, record how long the pipe waited"""
+    if not cmd.compression_stdin:
+        runner.last_error = "can not read the input from stdin"
+        return False
+
+    original = next(cmd.original_files_host(runner.converter))
+    archive = next(cmd.archive_files_host(runner.converter))
+    with ThrottledPipe(
+        logfile + ".fifo",
+        original,
+        throttle.bandwidth,
+        throttle.latency,
+        throttle.block,
+    ) as pipe:
+        success = runner.execute(
+            cmd.compression_stdin,
+            logfile,
+            timeout=timeout,
+            stdout=archive,
+            watchdog=watchdog,
+            stdin=pipe.fifo,
+        )
+
+    result.phases += [
+        Phase(step, "storage_wait", round(pipe.storage_wait, 3), source="pipe"),
+        Phase(step, "tool_wait", round(pipe.reader_wait, 3), source="pipe"),
+    ]
+    return success
+
+
+def _measure_decoding(
+    cmd: CompressDecompress,
+    runner: ShellRunner,
+    result: Result,
+    options: MeasureOptions,
+    logfile: str,
+    timeout: int,
+) -> bool:
+    """Run decompression to stdout, discarding the output"""
+    if options.decode_sink == "null":
+        if not runner.execute(
+            cmd.decompression_stdout,
+            logfile,
+            timeout=timeout,
+            stdout=os.devnull,
+            watchdog=_watchdog(options, [], logfile),
+        ):
+            return False
+        result.decode_time = parse_logfile_for_stats(logfile).elapsed_time
+        return True
+
+    with CountingPipe(logfile + ".fifo", options.decode_digest) as pipe:
+        success = runner.execute(
+            cmd.decompression_stdout,
+            logfile,
+            timeout=timeout,
+            stdout=pipe.fifo,
+            watchdog=_watchdog(options, [], logfile),
+        )
+    if not success:
+        return False
+
+    result.decode_time = parse_logfile_for_stats(logfile).elapsed_time
+    result.decode_size = pipe.size
+    result.decode_digest = pipe.hexdigest
+
+    if result.original_size != pipe.size:
+        logger.warn(
+            f"Size of decoded data ({pipe.size}) does not match with the original ({result.original_size})"
+        )
+
+    if options.decode_digest:
+        originals = list(cmd.original_files_host(runner.converter))
+        if file_digest(originals, options.decode_digest) != pipe.hexdigest:
+            logger.warn(f"Digest of decoded data does not match with {originals}")
+
+    return True
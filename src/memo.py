@@ -0,0 +1,202 @@
+import dataclasses
+import hashlib
+import json
+import os
+import shutil
+from datetime import timedelta
+from os import path
+from typing import Optional
+
+from src.containers import DOCKER_DATA, container_dataset
+from src.dataset import Dataset
+from src.history import image_digests
+from src.host import host_fingerprint
+from src.logger import logger
+from src.measure import MeasureOptions, tool_environment
+from src.phases import Phase
+from src.pipes import file_digest
+from src.results import Result
+from src.tools import Tool
+from src.utils import now
+
+DIGESTS_NAME = "digests.json"
+
+# properties of the host which results depend on
+HOST_KEYS = ("hostname", "machine", "kernel", "cpu_count", "cpu_model")
+
+
+class ResultCache:
+    """
+    Content-addressed cache of valid results.
+
+    Results of a tool are kept in <cache_dir>/<key>.json, the key being a digest
+    of everything the measurement depends on (see key): the dataset contents,
+    commands of the tool, its image (or binary), thread count, host and
+    measurement options. Results older than max_age days are removed.
+    """
+
+    def __init__(self, cache_dir: str, runtime: str, max_age: float):
+        self.cache_dir = cache_dir
+        self.runtime = runtime
+        self.max_age = max_age
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._digests_path = path.join(cache_dir, DIGESTS_NAME)
+        self._digests = self._load_json(self._digests_path) or {}
+        self._images: Optional[dict[str, str]] = None
+        host = host_fingerprint()
+        self._host = {k: host[k] for k in HOST_KEYS}
+        self._evict()
+
+    def key(
+        self,
+        tool: Tool,
+        data_local: Dataset,
+        n_threads: int,
+        options: MeasureOptions,
+    ) -> str:
+        # commands do not depend on where the dataset is
+        commands = json.dumps([dataclasses.asdict(c) for c in tool.commands])
+        data_cont = container_dataset(data_local, self.runtime)
+        for idx, fastq in enumerate(data_cont.files, start=1):
+            commands = commands.replace(fastq, f"{{input{idx}}}")
+
+        components = {
+            "dataset": [self._file_digest(f) for f in data_local.files],
+            "commands": commands,
+            "binary": self._binary(tool),
+            "threads": n_threads,
+            "host": self._host,
+            # the watchdog only aborts commands, it does not change results
+            "options": [options.decode_sink, options.decode_digest],
+            # the page cache is neither dropped nor warmed up before a measurement,
+            # so there is no cache state to tell results apart by (yet)
+        }
+        if options.throttle:
+            components["throttle"] = options.throttle.to_spec()
+        if options.concurrent_commands:
+            components["concurrent"] = True
+        return hashlib.sha256(
+            json.dumps(components, sort_keys=True).encode()
+        ).hexdigest()
+
+    def get(self, key: str) -> list[Result]:
+        """Cached results, most recent first"""
+        entry = self._load_json(self._entry_path(key))
+        if not entry:
+            return []
+        stored = sorted(entry["results"], key=lambda r: r["stored"], reverse=True)
+        return [_result_from_dict(r["result"]) for r in stored]
+
+    def add(self, key: str, result: Result):
+        if not result:
+            return
+        entry = self._load_json(self._entry_path(key)) or {
+            "tool": result.tool,
+            "dataset": result.dataset,
+            "n_threads": result.n_threads,
+            "results": [],
+        }
+        entry["results"].append({
+            "stored": now().isoformat(timespec="seconds"),
+            "result": dataclasses.asdict(result),
+        })
+        self._save_json(self._entry_path(key), entry)
+
+    def invalidate(self, tools: list[str]) -> int:
+        """Remove results of tools ("all" for every tool), return number of entries removed"""
+        removed = 0
+        for entry_path, entry in self._entries():
+            if "all" in tools or entry["tool"] in tools:
+                os.unlink(entry_path)
+                removed += 1
+        logger.info(f"Invalidated {removed} entries of the result cache")
+        return removed
+
+    def _evict(self):
+        oldest = (now() - timedelta(days=self.max_age)).isoformat(timespec="seconds")
+        for entry_path, entry in self._entries():
+            kept = [r for r in entry["results"] if r["stored"] >= oldest]
+            if len(kept) == len(entry["results"]):
+                continue
+
+            logger.info(
+                f"Evicting {len(entry['results']) - len(kept)} results of "
+                f"{entry['tool']} older than {self.max_age} days from the result cache"
+            )
+            if kept:
+                entry["results"] = kept
+                self._save_json(entry_path, entry)
+            else:
+                os.unlink(entry_path)
+
+    def _entries(self):
+        for name in os.listdir(self.cache_dir):
+            if name == DIGESTS_NAME or not name.endswith(".json"):
+                continue
+            entry_path = path.join(self.cache_dir, name)
+            entry = self._load_json(entry_path)
+            if entry:
+                yield entry_path, entry
+
+    def _entry_path(self, key: str) -> str:
+        return path.join(self.cache_dir, key + ".json")
+
+    def _file_digest(self, fastq: str) -> str:
+        """Digest of the file, recomputed only if the file has changed"""
+        real = path.realpath(fastq)
+        stat = os.stat(real)
+        known = self._digests.get(real)
+        if known and (known["size"], known["mtime"]) == (
+            stat.st_size,
+            stat.st_mtime_ns,
+        ):
+            return known["digest"]
+
+        logger.info(f"Computing digest of {fastq}...")
+        digest = file_digest([real], "sha256")
+        self._digests[real] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "digest": digest,
+        }
+        self._save_json(self._digests_path, self._digests)
+        return digest
+
+    def _binary(self, tool: Tool) -> str:
+        """Digest of the image of the tool, or location and mtime of the binary"""
+        if self.runtime != "none":
+            if self._images is None:
+                self._images = image_digests(self.runtime)
+            image = DOCKER_DATA[tool_environment(tool)].image_name
+            return self._images.get(image, "")
+
+        binary = shutil.which(tool.binary)
+        if binary is None:
+            return ""
+        stat = os.stat(binary)
+        return f"{path.realpath(binary)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    @staticmethod
+    def _load_json(json_path: str) -> Optional[dict]:
+        try:
+            with open(json_path, "r") as fin:
+                return json.load(fin)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _save_json(json_path: str, data: dict):
+        tmp = json_path + f".{os.getpid()}.tmp"
+        with open(tmp, "w") as fout:
+            json.dump(data, fout, indent=1)
+        os.replace(tmp, json_path)
+
+
+def _result_from_dict(fields: dict) -> Result:
+    # fields removed from Result since the result was stored are dropped
+    known = {f.name for f in dataclasses.fields(Result)}
+    fields = {k: v for k, v in fields.items() if k in known}
+    fields["phases"] = [Phase(**p) for p in fields.get("phases", [])]
+    fields["commands"] = [_result_from_dict(c) for c in fields.get("commands", [])]
+    return Result(**fields)
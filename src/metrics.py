@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+
+from src.logger import logger
+from src.results import Result
+
+PREFIX = "fastq_benchmark"
+
+# name, type and help of every metric
+METRICS = {
+    "jobs_planned": ("gauge", "Invocations of tools the run is expected to make"),
+    "jobs_completed_total": ("counter", "Invocations of tools finished, valid or not"),
+    "jobs_remaining": ("gauge", "Planned invocations not finished yet"),
+    "running": ("gauge", "1 while the run is in progress, 0 once it has ended"),
+    "current_job": (
+        "gauge",
+        "1 for the invocation in progress, labelled with its tool, dataset and step",
+    ),
+    "start_timestamp_seconds": ("gauge", "Unix time the run started at"),
+    "last_update_timestamp_seconds": ("gauge", "Unix time of the last update"),
+    "elapsed_seconds": (
+        "gauge",
+        "Seconds from the start of the run to the last update",
+    ),
+    "throughput_bytes_per_second": (
+        "gauge",
+        "Original bytes per second of the latest valid invocation of every tool",
+    ),
+    "peak_memory_bytes": (
+        "gauge",
+        "Highest peak memory of an invocation of every tool so far",
+    ),
+    "failures_total": ("counter", "Failed invocations by tool and failed step"),
+}
+
+
+class MetricsExporter:
+    """
+    Keeps the progress of a run in a file in the Prometheus text format,
+    e.g. for the textfile collector of node_exporter.
+
+    The file is rewritten (atomically) on every transition: when an invocation
+    or one of its steps starts, and when it finishes.
+    """
+
+    def __init__(self, outname: str, n_jobs: int):
+        self.outname = outname
+        self.n_jobs = n_jobs
+        self.n_completed = 0
+        self.current: dict[str, str] = {}
+        self.throughput: dict[tuple[str, str], float] = {}
+        self.peak_memory: dict[str, int] = {}
+        self.failures: dict[tuple[str, str], int] = {}
+        self.running = 1
+        self.start = time.time()
+        # steps of concurrent commands are reported from several threads
+        self._lock = threading.Lock()
+        logger.info(f"Writing metrics to {self.outname}")
+        self._write()
+
+    def add_jobs(self, n: int):
+        """Plan n more invocations (or fewer, if n is negative)"""
+        with self._lock:
+            self.n_jobs += n
+            self._write()
+
+    def start_job(self, tool: str, dataset: str, iteration: int):
+        with self._lock:
+            self.current = {
+                "tool": tool,
+                "dataset": dataset,
+                "iteration": str(iteration),
+                "step": "",
+            }
+            self._write()
+
+    def start_step(self, step: str):
+        with self._lock:
+            if self.current:
+                self.current["step"] = step
+                self._write()
+
+    def finish_job(self, result: Result):
+        with self._lock:
+            self.n_completed += 1
+            self.current = {}
+            if result:
+                for direction, seconds in (
+                    ("compression", result.ctime),
+                    ("decompression", result.dtime),
+                ):
+                    if seconds:
+                        self.throughput[(result.tool, direction)] = (
+                            result.original_size / seconds
+                        )
+                peak = max(result.cmem, result.dmem) * 1024
+                self.peak_memory[result.tool] = max(
+                    self.peak_memory.get(result.tool, 0), peak
+                )
+            else:
+                # e.g. "compression1: Timeout 60s expired", or "<binary> not found"
+                step, sep, _ = result.failure.partition(":")
+                key = (result.tool, step if sep else "start")
+                self.failures[key] = self.failures.get(key, 0) + 1
+            self._write()
+
+    def close(self):
+        """Mark the run as ended"""
+        with self._lock:
+            self.running = 0
+            self.current = {}
+            self._write()
+
+    def _write(self):
+        now = time.time()
+        samples = {
+            "jobs_planned": [({}, self.n_jobs)],
+            "jobs_completed_total": [({}, self.n_completed)],
+            "jobs_remaining": [({}, max(self.n_jobs - self.n_completed, 0))],
+            "running": [({}, self.running)],
+            "current_job": [(self.current, 1)] if self.current else [],
+            "start_timestamp_seconds": [({}, round(self.start, 3))],
+            "last_update_timestamp_seconds": [({}, round(now, 3))],
+            "elapsed_seconds": [({}, round(now - self.start, 3))],
+            "throughput_bytes_per_second": [
+                ({"tool": tool, "direction": direction}, round(value, 1))
+                for (tool, direction), value in sorted(self.throughput.items())
+            ],
+            "peak_memory_bytes": [
+                ({"tool": tool}, value)
+                for tool, value in sorted(self.peak_memory.items())
+            ],
+            "failures_total": [
+                ({"tool": tool, "step": step}, count)
+                for (tool, step), count in sorted(self.failures.items())
+            ],
+        }
+
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            for labels, value in samples[name]:
+                lines.append(f"{PREFIX}_{name}{_format_labels(labels)} {value}")
+
+        # the collector must never see a partial file
+        partial = self.outname + f".{os.getpid()}.tmp"
+        with open(partial, "w") as fout:
+            fout.write("\n".join(lines) + "\n")
+        os.replace(partial, self.outname)
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
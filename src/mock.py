@@ -0,0 +1,149 @@
+"""
+Fake compressor with configurable cost, used to test the harness without real tools:
+
+    python3 -m src.mock compress|decompress <input> <output> [<option>=<value>,...]
+
+Archives hold the original size followed by filler bytes, and decompression
+restores the size, not the contents, of the original file.
+"""
+
+import dataclasses
+import os
+import signal
+import struct
+import sys
+import time
+from multiprocessing import Process
+from os import path
+
+from src.compat import dataclass
+
+MB = 1 << 20
+
+# how the mock fails, if at all
+FAILURES = ("", "compression", "decompression", "crash", "hang", "size")
+
+
+@dataclass(slots=True)
+class MockOptions:
+    cpu: float = 0  # seconds of busy CPU time per thread, in each step
+    sleep: float = 0  # seconds of idle time in each step
+    memory: int = 0  # MB allocated in each step
+    io: int = 0  # MB written to (and read back from) a scratch file in each step
+    ratio: float = 4  # compression ratio
+    threads: int = 1  # processes burning CPU
+    # "compression"/"decompression": the step exits with an error, "crash": compression
+    # is killed, "hang": compression never ends, "size": one byte is lost in decompression
+    fail: str = ""
+
+    @classmethod
+    def from_spec(cls, spec: str) -> "MockOptions":
+        """Parse options given as e.g. cpu=0.5,memory=100,fail=hang"""
+        options = cls()
+        types = {f.name: f.type for f in dataclasses.fields(cls)}
+        for item in filter(None, spec.split(",")):
+            name, _, value = item.partition("=")
+            if name not in types:
+                raise ValueError(f"Unknown option of the mock tool: {name}")
+            setattr(options, name, types[name](value))
+        if options.fail not in FAILURES:
+            raise ValueError(f"Unknown failure of the mock tool: {options.fail}")
+        return options
+
+    def to_spec(self) -> str:
+        return ",".join(f"{k}={v}" for k, v in dataclasses.asdict(self).items())
+
+
+def compress(src: str, dst: str, options: MockOptions):
+    if options.fail == "crash":
+        os.kill(os.getpid(), signal.SIGKILL)
+    if options.fail == "hang":
+        while True:
+            time.sleep(60)
+
+    size = _read(src)
+    _work(options, dst)
+    if options.fail == "compression":
+        sys.exit(1)
+
+    with open(dst, "wb") as fout:
+        fout.write(struct.pack("<Q", size))
+        _fill(fout, max(0, round(size / options.ratio) - 8))
+
+
+def decompress(src: str, dst: str, options: MockOptions):
+    with open(src, "rb") as fin:
+        (size,) = struct.unpack("<Q", fin.read(8))
+    _read(src)
+    _work(options, dst)
+    if options.fail == "decompression":
+        sys.exit(1)
+
+    with open(dst, "wb") as fout:
+        _fill(fout, size - 1 if options.fail == "size" else size)
+
+
+def _read(src: str) -> int:
+    size = 0
+    with open(src, "rb", buffering=0) as fin:
+        while chunk := fin.read(MB):
+            size += len(chunk)
+    return size
+
+
+def _fill(fout, size: int):
+    block = b"N" * MB
+    while size > 0:
+        fout.write(block[: min(size, MB)])
+        size -= MB
+
+
+def _work(options: MockOptions, dst: str):
+    # touch every page, so that the memory counts towards the resident set size
+    memory = bytearray(options.memory * MB)
+    for i in range(0, len(memory), 4096):
+        memory[i] = 1
+
+    if options.io:
+        scratch = dst + ".mock-io"
+        with open(scratch, "wb") as fout:
+            _fill(fout, options.io * MB)
+            fout.flush()
+            os.fsync(fout.fileno())
+        _read(scratch)
+        os.unlink(scratch)
+
+    if options.cpu:
+        burners = [
+            Process(target=_burn, args=(options.cpu,))
+            for _ in range(options.threads - 1)
+        ]
+        for p in burners:
+            p.start()
+        _burn(options.cpu)
+        for p in burners:
+            p.join()
+
+    time.sleep(options.sleep)
+
+
+def _burn(seconds: float):
+    start = time.process_time()
+    while time.process_time() - start < seconds:
+        pass
+
+
+def main():
+    if len(sys.argv) not in (4, 5) or sys.argv[1] not in ("compress", "decompress"):
+        print(__doc__, file=sys.stderr)
+        sys.exit(2)
+
+    step, src, dst = sys.argv[1:4]
+    options = MockOptions.from_spec(sys.argv[4] if len(sys.argv) == 5 else "")
+    if not path.exists(src):
+        sys.exit(f"{src} does not exist")
+    (compress if step == "compress" else decompress)(src, dst, options)
+
+
+if __name__ == "__main__":
+    main()
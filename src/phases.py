@@ -0,0 +1,169 @@
+import csv
+import dataclasses
+import re
+from os import path
+from typing import Callable
+
+from src.compat import dataclass
+from src.results import Result, parse_elapsed_time
+
+
+@dataclass(slots=True)
+class Phase:
+    step: str = ""  # e.g. compression1, decompression2
+    name: str = ""
+    elapsed_time: float = 0  # in seconds
+    max_rss: int = 0  # in KB, 0 if not reported
+    source: str = ""  # "log" if reported by the tool, "time" if by GNU time
+
+
+# binary of a tool (Tool.binary) -> functions returning phases reported in the log of a command
+PhaseParser = Callable[[list[str]], list[Phase]]
+PARSERS: dict[str, list[PhaseParser]] = {}
+
+
+def register(*binaries: str):
+    """Register the decorated function as a phase parser for logs of binaries"""
+
+    def decorator(parser: PhaseParser) -> PhaseParser:
+        for binary in binaries:
+            PARSERS.setdefault(binary, []).append(parser)
+        return parser
+
+    return decorator
+
+
+def parse_phases(binary: str, logfile: str, step: str) -> list[Phase]:
+    """
+    Return phases found in logfile: those reported by the tool itself
+    and GNU time blocks of sub-steps, if the tool runs a pipeline
+    """
+    if not path.exists(logfile):
+        return []
+
+    with open(logfile, "r", errors="replace") as fin:
+        lines = fin.read().splitlines()
+
+    tool_lines, blocks = _split_gnu_time(lines)
+
+    phases = []
+    for parser in PARSERS.get(binary, []):
+        phases += parser(tool_lines)
+
+    # the last block belongs to the whole command
+    for command, elapsed, max_rss in blocks[:-1]:
+        name = path.basename(command.split()[0]) if command else "unknown"
+        phases.append(
+            Phase(name=name, elapsed_time=elapsed, max_rss=max_rss, source="time")
+        )
+
+    for phase in phases:
+        phase.step = step
+    return phases
+
+
+def _split_gnu_time(lines: list[str]) -> tuple[list[str], list[tuple[str, float, int]]]:
+    """Separate output of the tool from blocks of GNU time -v: (command, elapsed, max rss)"""
+    tool_lines = []
+    blocks = []
+    in_block = False
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("Command being timed:"):
+            in_block = True
+            command = stripped.split(":", 1)[1].strip().strip('"')
+            blocks.append([command, 0.0, 0])
+        elif in_block and line.startswith("\t"):
+            if stripped.startswith("Elapsed"):
+                blocks[-1][1] = parse_elapsed_time(stripped.split()[-1])
+            elif stripped.startswith("Maximum resident set size"):
+                blocks[-1][2] = int(stripped.split()[-1])
+            elif stripped.startswith("Exit status"):
+                in_block = False
+        else:
+            in_block = False
+            tool_lines.append(line)
+
+    return tool_lines, [tuple(b) for b in blocks]
+
+
+# e.g. "Reordering ..." followed (maybe not immediately) by "Time for this step: 12 s"
+_SPRING_PHASE = re.compile(r"^(?P<name>[A-Za-z][\w ]*?)\s*\.\.\.$")
+_SPRING_TIME = re.compile(r"^Time for this step:\s*(?P<time>[\d.]+)\s*s")
+
+
+@register("spring")
+def _spring_phases(lines: list[str]) -> list[Phase]:
+    phases = []
+    name = ""
+    for line in lines:
+        line = line.strip()
+        if m := _SPRING_PHASE.match(line):
+            name = m["name"]
+        elif (m := _SPRING_TIME.match(line)) and name:
+            phases.append(Phase(name=name, elapsed_time=float(m["time"]), source="log"))
+            name = ""
+    return phases
+
+
+# e.g. "Compression time: 1.23 s", "names time = 0.5 sec"
+_TIMED_PHASE = re.compile(
+    r"^(?P<name>[A-Za-z][\w /-]*?)\s+time\s*[:=]\s*(?P<time>[\d.]+)\s*"
+    r"(?P<unit>ms|s|sec|seconds)?\.?$",
+    re.IGNORECASE,
+)
+
+
+@register("dsrc", "fqzcomp5", "leon", "fastore_compress.sh")
+def _timed_phases(lines: list[str]) -> list[Phase]:
+    """Generic "<phase> time: <seconds>" lines printed by verbose tools"""
+    phases = []
+    for line in lines:
+        m = _TIMED_PHASE.match(line.strip())
+        if not m:
+            continue
+        elapsed = float(m["time"])
+        if m["unit"] == "ms":
+            elapsed /= 1000
+        phases.append(Phase(name=m["name"].strip(), elapsed_time=elapsed, source="log"))
+    return phases
+
+
+class PhaseWriter:
+    """Writes phases of results to a .csv file, one row per phase"""
+
+    fieldnames = [
+        "tool",
+        "dataset",
+        "threads",
+        *(f.name for f in dataclasses.fields(Phase)),
+    ]
+
+    def __init__(self, outname: str):
+        self.outname = outname
+        with open(self.outname, "w") as fout:
+            csv.DictWriter(
+                fout,
+                dialect="unix",
+                quoting=csv.QUOTE_MINIMAL,
+                fieldnames=self.fieldnames,
+            ).writeheader()
+
+    def add_phases(self, result: Result):
+        if not result.phases:
+            return
+
+        with open(self.outname, "a") as fout:
+            writer = csv.DictWriter(
+                fout,
+                dialect="unix",
+                quoting=csv.QUOTE_MINIMAL,
+                fieldnames=self.fieldnames,
+            )
+            for phase in result.phases:
+                writer.writerow({
+                    "tool": result.tool,
+                    "dataset": result.dataset,
+                    "threads": result.n_threads,
+                    **dataclasses.asdict(phase),
+                })
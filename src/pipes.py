@@ -0,0 +1,159 @@
+import hashlib
+import os
+import threading
+import time
+
+CHUNK_SIZE = 1 << 20
+
+# how often a thread blocked in opening a pipe is unblocked at exit, in seconds
+UNBLOCK_INTERVAL = 0.01
+
+
+class CountingPipe:
+    """
+    Named pipe which discards everything written into it,
+    only counting bytes and optionally computing a digest.
+
+    Usage:
+        with CountingPipe(fifo, "md5") as pipe:
+            <run a command writing to fifo>
+        pipe.size, pipe.hexdigest
+    """
+
+    def __init__(self, fifo: str, digest: str = ""):
+        self.fifo = fifo
+        self.size = 0
+        self._hash = hashlib.new(digest) if digest else None
+        self._opened = threading.Event()
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+
+    @property
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest() if self._hash else ""
+
+    def __enter__(self):
+        if os.path.exists(self.fifo):
+            os.unlink(self.fifo)
+        os.mkfifo(self.fifo)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        # if the writer never opened the pipe (e.g. the command failed),
+        # the reader is (or is about to be) blocked in open(), so open it ourselves
+        while self._thread.is_alive() and not self._opened.is_set():
+            try:
+                os.close(os.open(self.fifo, os.O_WRONLY | os.O_NONBLOCK))
+            except OSError:
+                pass  # the reader has not reached open() yet
+            self._opened.wait(UNBLOCK_INTERVAL)
+        self._thread.join()
+        os.unlink(self.fifo)
+
+    def _drain(self):
+        buf = bytearray(CHUNK_SIZE)
+        view = memoryview(buf)
+        with open(self.fifo, "rb", buffering=0) as fin:
+            self._opened.set()
+            while True:
+                n = fin.readinto(buf)
+                if not n:
+                    break
+                self.size += n
+                if self._hash:
+                    self._hash.update(view[:n])
+
+
+class ThrottledPipe:
+    """
+    Named pipe serving the contents of a file once, at most at bandwidth (MB/s),
+    in blocks (of block KB) each delayed by latency (ms), like network storage.
+
+    Time spent delaying blocks (the reader waits for storage) and blocked in
+    writing them (storage waits for the reader) is measured.
+
+    Usage:
+        with ThrottledPipe(fifo, source, 300, 1, 1024) as pipe:
+            <run a command reading from fifo>
+        pipe.size, pipe.storage_wait, pipe.reader_wait
+    """
+
+    def __init__(
+        self, fifo: str, source: str, bandwidth: float, latency: float, block: int
+    ):
+        self.fifo = fifo
+        self.source = source
+        self.size = 0
+        self.storage_wait = 0.0  # in seconds
+        self.reader_wait = 0.0
+        self._bandwidth = bandwidth * 1e6
+        self._latency = latency / 1000
+        self._block = block * 1024
+        self._opened = threading.Event()
+        self._thread = threading.Thread(target=self._feed, daemon=True)
+
+    def __enter__(self):
+        if os.path.exists(self.fifo):
+            os.unlink(self.fifo)
+        os.mkfifo(self.fifo)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        # if the reader never opened the pipe (e.g. the command failed),
+        # the writer is (or is about to be) blocked in open(), so open it ourselves,
+        # keeping it open until the writer's open() returns
+        while self._thread.is_alive() and not self._opened.is_set():
+            fd = os.open(self.fifo, os.O_RDONLY | os.O_NONBLOCK)
+            try:
+                self._opened.wait(UNBLOCK_INTERVAL)
+            finally:
+                os.close(fd)
+        self._thread.join()
+        os.unlink(self.fifo)
+
+    def _feed(self):
+        with open(self.source, "rb", buffering=0) as fin:
+            fd = os.open(self.fifo, os.O_WRONLY)
+            self._opened.set()
+            try:
+                start = time.monotonic()
+                n_blocks = 0
+                while chunk := fin.read(self._block):
+                    n_blocks += 1
+                    due = (
+                        start
+                        + n_blocks * self._latency
+                        + (self.size + len(chunk)) / self._bandwidth
+                    )
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                        self.storage_wait += delay
+
+                    before = time.monotonic()
+                    view = memoryview(chunk)
+                    while view:
+                        view = view[os.write(fd, view) :]
+                    self.reader_wait += time.monotonic() - before
+                    self.size += len(chunk)
+            except BrokenPipeError:
+                # the reader has exited early
+                pass
+            finally:
+                os.close(fd)
+
+
+def file_digest(paths: list[str], digest: str) -> str:
+    """Digest of concatenation of the files"""
+    h = hashlib.new(digest)
+    buf = bytearray(CHUNK_SIZE)
+    view = memoryview(buf)
+    for p in paths:
+        with open(p, "rb", buffering=0) as fin:
+            while True:
+                n = fin.readinto(buf)
+                if not n:
+                    break
+                h.update(view[:n])
+    return h.hexdigest()
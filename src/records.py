@@ -0,0 +1,126 @@
+import dataclasses
+import json
+from os import path
+from typing import Optional
+
+from src.compat import dataclass
+from src.history import ResultDatabase
+from src.logger import logger
+from src.metrics import MetricsExporter
+from src.phases import PhaseWriter
+from src.results import Result, ResultWriter
+
+# fields of Result not written as part of a record
+_NESTED = {"phases", "commands"}
+
+# fields of run metadata stored as JSON strings in .parquet
+_JSON_IN_PARQUET = ("image_digests", "args", "calibration")
+
+
+class RecordWriter:
+    """
+    Streams one JSON record per command invocation to a .jsonl file.
+
+    Unlike ResultWriter, commands of a tool are not merged, and failed
+    invocations are kept, along with the reason of the failure.
+    Every record holds the metadata of the run (see collect_run_metadata).
+    """
+
+    def __init__(self, outname: str, metadata: dict, append: bool = False):
+        self.outname = outname
+        self.metadata = metadata
+        if not append:
+            logger.info(f"Writing records to {self.outname}")
+            open(self.outname, "w").close()
+
+    def add_result(self, result: Result, iteration: int = 0):
+        # a tool that was not even started has no commands
+        commands = result.commands or [result]
+        with open(self.outname, "a") as fout:
+            for idx, cmd in enumerate(commands, start=1):
+                record = {
+                    "run": self.metadata,
+                    "iteration": iteration,
+                    "command": idx,
+                    "n_commands": len(result.commands),
+                    **{
+                        k: v
+                        for k, v in dataclasses.asdict(cmd).items()
+                        if k not in _NESTED
+                    },
+                    "phases": [dataclasses.asdict(p) for p in cmd.phases],
+                }
+                fout.write(json.dumps(record) + "\n")
+
+    def to_parquet(self) -> Optional[str]:
+        """Convert the records to .parquet next to the .jsonl file, if pyarrow is available"""
+        try:
+            # optional dependency, only needed for the conversion
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            logger.warn(f"pyarrow is not installed, keeping only {self.outname}")
+            return None
+
+        records = []
+        with open(self.outname, "r") as fin:
+            for line in fin:
+                record = json.loads(line)
+                # free-form mappings (which might also be empty, and parquet
+                # can not store empty structs) are kept as JSON strings
+                run = record["run"]
+                for key in _JSON_IN_PARQUET:
+                    run[key] = json.dumps(run.get(key, {}))
+                records.append(record)
+
+        if not records:
+            return None
+
+        outname = path.splitext(self.outname)[0] + ".parquet"
+        pyarrow.parquet.write_table(pyarrow.Table.from_pylist(records), outname)
+        logger.info(f"Converted records to {outname}")
+        return outname
+
+
+@dataclass(slots=True)
+class Outputs:
+    """Everything results of a run are written to"""
+
+    writer: ResultWriter
+    phase_writer: PhaseWriter
+    record_writer: RecordWriter
+    database: Optional[ResultDatabase] = None
+    metrics: Optional[MetricsExporter] = None
+
+    def add_jobs(self, n: int):
+        if self.metrics:
+            self.metrics.add_jobs(n)
+
+    def start_job(self, tool: str, dataset: str, iteration: int):
+        if self.metrics:
+            self.metrics.start_job(tool, dataset, iteration)
+
+    def start_step(self, step: str):
+        if self.metrics:
+            self.metrics.start_step(step)
+
+    def add_result(self, result: Result, iteration: int):
+        if self.metrics:
+            self.metrics.finish_job(result)
+
+        # failed invocations are only kept in the records and the database
+        self.record_writer.add_result(result, iteration)
+        if self.database:
+            self.database.add_result(result, iteration)
+
+        if result:
+            self.writer.add_result(result)
+            self.phase_writer.add_phases(result)
+
+    def close(self, parquet: bool = False):
+        if self.metrics:
+            self.metrics.close()
+        if self.database:
+            self.database.close()
+        if parquet:
+            self.record_writer.to_parquet()
@@ -35,23 +35,55 @@ def get_results_dir(parent: str) -> str:
     return RESULTS_DIR
 
 
+# fields of Result (and their defaults) telling apart results of a tool on a dataset
+# measured in different ways, which must not be pooled with one another
+VARIANT_FIELDS = {"transform": "", "throttle": "", "concurrent": 0}
+
+
 @dataclass(slots=True)
 class Result:
     tool: str = ""  # name of the tool
     dataset: str = ""  # name of the dataset
-    n_threads: int = 0  # how many threads were used
+    transform: str = ""  # e.g. quality binning scheme the dataset was made with
+    throttle: str = ""  # storage profile the input was read with (see src/throttle.py)
+    # 1 if the commands (e.g. of both mates) ran at the same time: times are then
+    # those of the slowest command, and memory is the sum of their peaks
+    concurrent: int = 0
+    # how many threads were used; with concurrent commands, by all of them together
+    # (each command had its share, see the records)
+    n_threads: int = 0
     original_size: int = 0  # sizes in bytes
     compressed_size: int = 0
     decompressed_size: int = 0
     total_cr: float = 0  # original size (in bytes) divided by all archive files
     ctime: float = 0  # compression time
     dtime: float = 0  # decompression time
+    cmem: int = 0  # peak memory (maximum resident set size, in KB) of compression
+    dmem: int = 0  # peak memory of decompression
+    ccpu: float = 0  # CPU time (user and system) of compression
+    dcpu: float = 0  # CPU time of decompression
+
+    # decompression with output discarded (only for some tools, 0 if not measured)
+    decode_time: float = 0
+    decode_size: int = 0  # number of bytes decoded
+    decode_digest: str = ""  # digest of decoded data (if requested)
+
+    # internal phases of the commands (see src/phases.py), not written to .csv
+    phases: list = dataclasses.field(default_factory=list)
+
+    # results of the individual commands merged into this one,
+    # including the failed one, if any (not written to .csv)
+    commands: list = dataclasses.field(default_factory=list)
 
     # whether the size of decompressed and original files is the same
     decompressed_same_size: int = 1
 
     # result is valid if both compression and decompression commands succeeded
     is_valid: bool = True
+    failure: str = ""  # why the result is invalid
+
+    # 1 if the result was taken from the result cache instead of measured
+    cached: int = 0
 
     def fieldnames(self) -> list[str]:
         return [f.name for f in dataclasses.fields(self)]
@@ -69,11 +101,23 @@ class Result:
 
         self.ctime += other.ctime
         self.dtime += other.dtime
+        # commands are run one after another, so peaks do not add up
+        self.cmem = max(self.cmem, other.cmem)
+        self.dmem = max(self.dmem, other.dmem)
+        self.ccpu += other.ccpu
+        self.dcpu += other.dcpu
+        self.decode_time += other.decode_time
+        self.decode_size += other.decode_size
+        self.decode_digest = ",".join(
+            d for d in (self.decode_digest, other.decode_digest) if d
+        )
+        self.phases += other.phases
         self.original_size += other.original_size
         self.compressed_size += other.compressed_size
         self.decompressed_size += other.decompressed_size
 
         self.is_valid = self.is_valid and other.is_valid
+        self.failure = self.failure or other.failure
         self.decompressed_same_size = int(
             self.decompressed_same_size and other.decompressed_same_size
         )
@@ -86,26 +130,61 @@ class Result:
 class GnuTimeStats:
     # TODO: might add other fields later
     elapsed_time: float = 0
+    max_rss: int = 0  # in KB
+    cpu_time: float = 0  # user and system time
 
 
 def parse_logfile_for_stats(logfile: str) -> GnuTimeStats:
-    return GnuTimeStats(elapsed_time=_get_elapsed_time_from_logfile(logfile))
+    return GnuTimeStats(
+        elapsed_time=_get_elapsed_time_from_logfile(logfile),
+        max_rss=_get_max_rss_from_logfile(logfile),
+        cpu_time=_get_cpu_time_from_logfile(logfile),
+    )
 
 
 def _get_elapsed_time_from_logfile(logfile: str) -> float:
+    # tools running pipelines might report times of their sub-steps
+    # before the block of the whole command, so the last one is taken
+    elapsed = None
     with open(logfile, "r") as fin:
         for line in fin:
             line = line.strip()
-            if not line.startswith("Elapsed"):
-                continue
-            timestr = line.split()[-1]
-            if timestr.count(":") == 1:  # m:ss
-                m, s = map(float, timestr.split(":"))
-                return m * 60 + s
-            else:  # h:mm:ss
-                h, m, s = map(float, timestr.split(":"))
-                return h * 3600 + m * 60 + s
+            if line.startswith("Elapsed"):
+                elapsed = parse_elapsed_time(line.split()[-1])
+    if elapsed is None:
         raise ValueError(f"coudn't find Elapsed (wall clock) time in {logfile}")
+    return elapsed
+
+
+def parse_elapsed_time(timestr: str) -> float:
+    if timestr.count(":") == 1:  # m:ss
+        m, s = map(float, timestr.split(":"))
+        return m * 60 + s
+    else:  # h:mm:ss
+        h, m, s = map(float, timestr.split(":"))
+        return h * 3600 + m * 60 + s
+
+
+def _get_max_rss_from_logfile(logfile: str) -> int:
+    # older versions of GNU time might not report it
+    max_rss = 0
+    with open(logfile, "r") as fin:
+        for line in fin:
+            line = line.strip()
+            if line.startswith("Maximum resident set size"):
+                max_rss = int(line.split()[-1])
+    return max_rss
+
+
+def _get_cpu_time_from_logfile(logfile: str) -> float:
+    # like the elapsed time, the last block is of the whole command
+    times = {}
+    with open(logfile, "r") as fin:
+        for line in fin:
+            line = line.strip()
+            if line.startswith(("User time", "System time")):
+                times[line.split()[0]] = float(line.split()[-1])
+    return round(sum(times.values()), 2)
 
 
 class ResultWriter:
@@ -115,13 +194,21 @@ class ResultWriter:
         "total cr": "compression_ratio",
         "ctime": "compression_time",
         "dtime": "decompression_time",
+        "cmem": "compression_memory_kb",
+        "dmem": "decompression_memory_kb",
+        "ccpu": "compression_cpu_time",
+        "dcpu": "decompression_cpu_time",
+        "decode_time": "decode_only_time",
+        "decode_size": "decode_only_size",
         "n_threads": "threads",
     }
 
-    fields_to_drop = {"is_valid"}
+    fields_to_drop = {"is_valid", "failure", "phases", "commands"}
 
-    def __init__(self, outname):
+    def __init__(self, outname, normaliser=None):
+        """normaliser (see src/host.py) adds columns of times scaled to another host"""
         self.outname = outname
+        self.normaliser = normaliser
         self._init_file()
 
     @property
@@ -137,6 +224,8 @@ class ResultWriter:
             except KeyError:
                 ret.append(f)
 
+        if self.normaliser:
+            ret += self.normaliser.fieldnames
         return ret
 
     def _init_file(self):
@@ -151,9 +240,8 @@ class ResultWriter:
             writer.writeheader()
 
     def add_result(self, result: Result):
-        result = dataclasses.asdict(result)
         to_write = dict()
-        for k, v in result.items():
+        for k, v in dataclasses.asdict(result).items():
             if k in self.fields_to_drop:
                 continue
 
@@ -162,6 +250,9 @@ class ResultWriter:
             except KeyError:
                 to_write[k] = v
 
+        if self.normaliser:
+            to_write.update(self.normaliser.columns(result))
+
         with open(self.outname, "a") as fout:
             writer = csv.DictWriter(
                 fout,
@@ -1,37 +1,375 @@
 import argparse
-import copy
 import os
 import random
 from os import path
 
-from src.containers import PathConverter, build_images
-from src.dataset import Dataset
+from src.containers import build_images, container_dataset
+from src.dataset import Dataset, is_compressed
+from src.estimate import make_estimator, plan, print_plan
+from src.history import ResultDatabase, collect_run_metadata
+from src.host import Normaliser, calibrate_host, save_calibration
+from src.input_cache import InputCache
+from src.load import measure_load
 from src.logger import logger
-from src.measure import measure_tool
-from src.results import ResultWriter, get_results_dir
-from src.tools import get_tools
+from src.measure import measure_tool, options_from_args
+from src.memo import ResultCache
+from src.metrics import MetricsExporter
+from src.phases import PhaseWriter
+from src.records import Outputs, RecordWriter
+from src.results import Result, ResultWriter, get_results_dir
+from src.scaling import make_prefixes, report_scaling, scaling_fractions
+from src.smallfiles import measure_small_files
+from src.streams import analyse_streams, report_bounds
+from src.throttle import ThrottleProfile, parse_profile, report_throttling
+from src.tools import get_tools, per_mate_tool
+from src.transforms import (
+    Transformed,
+    bin_qualities,
+    parse_scheme,
+    reorder_name,
+    reorder_records,
+    write_costs,
+)
+from src.workqueue import coordinate, work
 
 
 def run(args: argparse.Namespace):
-    build_images(args.container_runtime)
+    # planning alone does not run any tools
+    if not args.dry_run or args.calibrate:
+        build_images(args.container_runtime)
 
-    data_local = Dataset(args.input1.name, args.input2.name if args.input2 else "")
-    data_cont = copy.deepcopy(data_local)
+    if args.worker:
+        work(args)
+        return
 
-    if args.container_runtime != "none":
-        converter = PathConverter()
-        data_cont.name1 = converter.to_docker(data_cont.name1)
-        data_cont.name2 = converter.to_docker(data_cont.name2)
+    # calibration runs tools on the dataset, planning alone does not need it
+    if args.dry_run and not args.calibrate:
+        _print_plan(args)
+        return
 
-    results_dir = get_results_dir(parent=args.output_folder)
-    logdir = path.join(results_dir, "logs")
-    os.mkdir(logdir)
+    data_local = _open_dataset(args)
+    data_cont = container_dataset(data_local, args.container_runtime)
 
     tools = get_tools(data_cont, args.threads, args.tools, args.zdur_modes)
     if len(set(t.name for t in tools)) != len(tools):
         raise RuntimeError("Duplicated tool names are not allowed")
 
-    writer = ResultWriter(path.join(results_dir, "benchmark_results.csv"))
+    estimator = make_estimator(args, data_local, tools)
+    if args.dry_run:
+        print_plan(plan(args, tools, _planned_datasets(args, data_local), estimator))
+        return
+
+    results_dir = get_results_dir(parent=args.output_folder)
+
+    streams = []
+    if args.streams:
+        streams = analyse_streams(
+            data_local,
+            args.stream_records,
+            args.threads,
+            path.join(results_dir, "streams.csv"),
+            args.stream_symbols_per_context,
+        )
+
+    if args.queue_dir:
+        coordinate(args, data_local, tools, results_dir, estimator)
+        return
+
+    if args.load:
+        measure_load(args, data_local, results_dir, estimator)
+        return
+
+    if args.small_files:
+        measure_small_files(args, data_local, results_dir, estimator)
+        return
+
+    logdir = path.join(results_dir, "logs")
+    os.mkdir(logdir)
+
+    metadata = collect_run_metadata(args)
+    normaliser = None
+    if args.calibrate_host:
+        # the disk is benchmarked where the results (and usually the data) are
+        metadata["calibration"] = calibrate_host(results_dir)
+        save_calibration(results_dir, metadata["host"], metadata["calibration"])
+        if args.normalise_to:
+            normaliser = Normaliser(metadata["calibration"], args.normalise_to)
+
+    outputs = Outputs(
+        writer=ResultWriter(
+            path.join(results_dir, "benchmark_results.csv"), normaliser
+        ),
+        phase_writer=PhaseWriter(path.join(results_dir, "phases.csv")),
+        record_writer=RecordWriter(path.join(results_dir, "records.jsonl"), metadata),
+    )
+
+    if args.metrics_file:
+        n_jobs = len(plan(args, tools, _planned_datasets(args, data_local), estimator))
+        outputs.metrics = MetricsExporter(args.metrics_file, n_jobs)
+
+    if args.results_db:
+        outputs.database = ResultDatabase(args.results_db)
+        outputs.database.start_run(metadata)
+
+    result_cache = None
+    if args.result_cache:
+        result_cache = ResultCache(
+            args.result_cache, args.container_runtime, args.result_cache_max_age
+        )
+        if args.invalidate:
+            result_cache.invalidate(args.invalidate.split(","))
+
+    try:
+        if args.scaling:
+            results = _run_scaling(
+                args, data_local, results_dir, logdir, outputs, estimator, result_cache
+            )
+        else:
+            results = _run_iterations(
+                args, tools, data_local, logdir, outputs, estimator, result_cache
+            )
+            if args.concurrent_mates and data_local.is_pe:
+                results += _run_concurrent_mates(
+                    args, tools, data_local, logdir, outputs, estimator, result_cache
+                )
+            if args.throttle:
+                results += _run_throttled(
+                    args, tools, data_local, logdir, outputs, estimator, result_cache
+                )
+                report_throttling(
+                    results,
+                    _throttle_profiles(args),
+                    path.join(results_dir, "throttle.csv"),
+                )
+            transformed = _transform_datasets(args, data_local)
+            if transformed:
+                # preprocessing is not part of the measurements of tools
+                write_costs(transformed, path.join(results_dir, "transforms.csv"))
+            results += _run_transformed(
+                args, transformed, logdir, outputs, estimator, result_cache
+            )
+        report_bounds(results, streams)
+    finally:
+        outputs.close(args.parquet)
+
+
+def _open_dataset(args: argparse.Namespace) -> Dataset:
+    """Compressed inputs are replaced by their decompressed copies from the cache"""
+    inputs = [args.input1.name, args.input2.name if args.input2 else ""]
+
+    if any(is_compressed(p) for p in inputs):
+        cache = InputCache(
+            args.input_cache,
+            int(args.cache_budget * 1024**3),
+            args.container_runtime,
+            args.threads,
+        )
+        inputs = [cache.get(p) if is_compressed(p) else p for p in inputs]
+
+    return Dataset(*inputs)
+
+
+def _print_plan(args: argparse.Namespace):
+    """Print the plan without opening the dataset, so compressed inputs are not decompressed"""
+    inputs = [args.input1.name, args.input2.name if args.input2 else ""]
+    if any(is_compressed(p) for p in inputs):
+        logger.warn(
+            "Planning with sizes of compressed inputs, durations are underestimated"
+        )
+    data_local = Dataset(*inputs)
+
+    # tools are not run, so paths need not be converted
+    tools = get_tools(data_local, args.threads, args.tools, args.zdur_modes)
+    estimator = make_estimator(args, data_local, tools)
+    print_plan(plan(args, tools, _planned_datasets(args, data_local), estimator))
+
+
+def _planned_datasets(
+    args: argparse.Namespace, data_local: Dataset
+) -> list[tuple[str, int]]:
+    """Names and sizes of the datasets the run would use"""
+    size = sum(path.getsize(f) for f in data_local.files)
+    if not args.scaling:
+        transforms = [
+            parse_scheme(s)[0] for s in filter(None, args.quality_binning.split(","))
+        ] + [
+            reorder_name(s, args.reorder_k)
+            for s in filter(None, args.reorder.split(","))
+        ]
+        transforms += [f"throttled {p.name}" for p in _throttle_profiles(args)]
+        return [(data_local.name, size)] + [
+            (f"{data_local.name} {t}", size) for t in transforms
+        ]
+
+    fractions = scaling_fractions(args.scaling_min_fraction, args.scaling_factor)
+    return [(f"{data_local.name} {f:.1%}", round(size * f)) for f in fractions]
+
+
+def _run_scaling(
+    args, data_local, results_dir, logdir, outputs, estimator, result_cache
+) -> list[Result]:
+    """Run all tools on growing prefixes of the dataset and fit the results"""
+    fractions = scaling_fractions(args.scaling_min_fraction, args.scaling_factor)
+    prefixes = make_prefixes(data_local, fractions, args.scaling_dir)
+
+    results = []
+    for prefix in prefixes:
+        logger.info(f"Scaling step: {prefix.name}")
+        data_cont = container_dataset(prefix, args.container_runtime)
+        tools = get_tools(data_cont, args.threads, args.tools, args.zdur_modes)
+
+        prefix_logdir = path.join(logdir, path.splitext(path.basename(prefix.name1))[0])
+        os.mkdir(prefix_logdir)
+        results += _run_iterations(
+            args, tools, prefix, prefix_logdir, outputs, estimator, result_cache
+        )
+
+    report_scaling(
+        results,
+        args.scaling_target * 1024**3,
+        path.join(results_dir, "scaling_results.csv"),
+    )
+    return results
+
+
+def _run_concurrent_mates(
+    args, tools, data_local, logdir, outputs, estimator, result_cache
+) -> list[Result]:
+    """Run tools compressing mates separately again, with both mates at the same time"""
+    data_cont = container_dataset(data_local, args.container_runtime)
+    # the same tools as in the sequential runs, but the mates share the threads
+    tools = [per_mate_tool(data_cont, t.name, max(1, args.threads // 2)) for t in tools]
+    tools = [t for t in tools if t]
+    if not tools:
+        return []
+
+    logger.info("Concurrent mates: " + ", ".join(t.name for t in tools))
+    # they are not part of the plan
+    outputs.add_jobs(len(tools) * args.repeats)
+    mates_logdir = path.join(logdir, "concurrent-mates")
+    os.mkdir(mates_logdir)
+    return _run_iterations(
+        args,
+        tools,
+        data_local,
+        mates_logdir,
+        outputs,
+        estimator,
+        result_cache,
+        concurrent=True,
+    )
+
+
+def _throttle_profiles(args) -> list[ThrottleProfile]:
+    return [parse_profile(s) for s in filter(None, args.throttle.split(","))]
+
+
+def _run_throttled(
+    args, tools, data_local, logdir, outputs, estimator, result_cache
+) -> list[Result]:
+    """Run tools reading stdin again, with the input throttled by every profile"""
+    throttled = [t for t in tools if all(c.compression_stdin for c in t.commands)]
+    skipped = [t.name for t in tools if t not in throttled]
+    if skipped:
+        logger.warn(f"{', '.join(skipped)} can not read stdin, input is not throttled")
+        outputs.add_jobs(-len(skipped) * args.repeats * len(_throttle_profiles(args)))
+
+    results = []
+    for profile in _throttle_profiles(args):
+        logger.info(
+            f"Throttled input: {profile.name} ({profile.bandwidth} MB/s, "
+            f"{profile.latency} ms per {profile.block} KB)"
+        )
+        throttle_logdir = path.join(logdir, f"throttle-{profile.name}")
+        os.mkdir(throttle_logdir)
+        results += _run_iterations(
+            args,
+            throttled,
+            data_local,
+            throttle_logdir,
+            outputs,
+            estimator,
+            result_cache,
+            throttle=profile,
+        )
+    return results
+
+
+def _transform_datasets(args, data_local) -> list[Transformed]:
+    """Copies of the dataset with binned qualities or reordered records"""
+    transformed = [
+        bin_qualities(data_local, spec, args.transform_dir, args.threads)
+        for spec in filter(None, args.quality_binning.split(","))
+    ]
+    for signature in filter(None, args.reorder.split(",")):
+        reordered = reorder_records(
+            data_local,
+            signature,
+            args.reorder_k,
+            args.transform_dir,
+            args.threads,
+            int(args.reorder_memory * 1024**3),
+        )
+        if reordered:
+            transformed.append(reordered)
+    return transformed
+
+
+def _run_transformed(
+    args, transformed, logdir, outputs, estimator, result_cache
+) -> list[Result]:
+    """Run all tools on transformed copies of the dataset"""
+    results = []
+    for t in transformed:
+        data_cont = container_dataset(t.data, args.container_runtime)
+        tools = get_tools(data_cont, args.threads, args.tools, args.zdur_modes)
+
+        logger.info(f"Transform: {t.transform}")
+        transform_logdir = path.join(logdir, t.transform)
+        os.mkdir(transform_logdir)
+        results += _run_iterations(
+            args,
+            tools,
+            t.data,
+            transform_logdir,
+            outputs,
+            estimator,
+            result_cache,
+            transform=t.transform,
+        )
+    return results
+
+
+def _run_iterations(
+    args,
+    tools,
+    data_local,
+    logdir,
+    outputs,
+    estimator,
+    result_cache=None,
+    transform="",
+    throttle=None,
+    concurrent=False,
+) -> list[Result]:
+    options = options_from_args(args)
+    options.throttle = throttle
+    options.concurrent_commands = concurrent
+    options.on_step = outputs.start_step
+    throttle_name = throttle.name if throttle else ""
+    size = sum(path.getsize(f) for f in data_local.files)
+    results = []
+
+    # up to --repeats results of every tool are reused from the cache
+    keys, cached = {}, {}
+    if result_cache:
+        for tool in tools:
+            keys[tool.name] = result_cache.key(tool, data_local, args.threads, options)
+            cached[tool.name] = result_cache.get(keys[tool.name])[: args.repeats]
+            if cached[tool.name]:
+                logger.info(
+                    f"Reusing {len(cached[tool.name])} cached results of {tool.name}"
+                )
 
     for iteration in range(1, args.repeats + 1):
         random.shuffle(tools)  # execute in random order (just in case)
@@ -39,6 +377,21 @@ def run(args: argparse.Namespace):
         logger.info("Scheduled order: " + ", ".join([tool.name for tool in tools]))
 
         for tool in tools:
+            outputs.start_job(tool.name, data_local.name, iteration)
+            if cached.get(tool.name):
+                result = cached[tool.name].pop()
+                result.cached = 1
+                # results are reported for this run, though the same contents
+                # may have been measured under another name
+                for r in [result, *result.commands]:
+                    r.dataset = data_local.name
+                result.n_threads = args.threads
+                result.transform = transform
+                result.throttle = throttle_name
+                results.append(result)
+                outputs.add_result(result, iteration)
+                continue
+
             logger.info(f"Iteration {iteration} for {tool.name}")
             logfile_prefix = path.join(logdir, f"{tool.name}_iter{iteration}")
             result = measure_tool(
@@ -47,10 +400,17 @@ def run(args: argparse.Namespace):
                 data_local,
                 args.threads,
                 logfile_prefix,
-                args.timeout,
+                estimator.timeout(tool.name, size),
+                options,
             )
+            result.transform = transform
+            result.throttle = throttle_name
+            if result_cache:
+                result_cache.add(keys[tool.name], result)
 
-            if result:
-                writer.add_result(result)
-            else:
+            results.append(result)
+            outputs.add_result(result, iteration)
+            if not result:
                 logger.warn(f"Results for {tool.name} are invalid")
+
+    return results
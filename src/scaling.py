@@ -0,0 +1,193 @@
+import csv
+import hashlib
+import math
+import os
+from collections import defaultdict
+from os import path
+from statistics import median
+from typing import Optional
+
+from src.compat import dataclass
+from src.dataset import Dataset
+from src.fastq import copy_range, fastq_index
+from src.logger import logger
+from src.results import Result
+
+# metrics fitted against input size
+METRICS = ("ctime", "dtime", "cmem", "dmem")
+
+# tools growing faster than size^SUPERLINEAR_EXPONENT are flagged
+SUPERLINEAR_EXPONENT = 1.1
+
+FIELDNAMES = [
+    "tool",
+    "threads",
+    "metric",
+    "n_sizes",
+    "max_size",  # largest input size (in bytes) measured
+    "exponent",
+    "r2",
+    "target_size",
+    "extrapolated",  # value of the metric at target_size
+    "superlinear",
+]
+
+
+@dataclass(slots=True)
+class PowerLaw:
+    """value = coefficient * size^exponent"""
+
+    coefficient: float = 0
+    exponent: float = 0
+    r2: float = 0  # coefficient of determination of the fit in log-log space
+
+    def __call__(self, size: float) -> float:
+        return self.coefficient * size**self.exponent
+
+
+def scaling_fractions(min_fraction: float, factor: float) -> list[float]:
+    """Geometric series min_fraction, min_fraction*factor, ..., ending with 1"""
+    fractions = []
+    fraction = min_fraction
+    while fraction < 1:
+        fractions.append(fraction)
+        fraction *= factor
+    fractions.append(1.0)
+    return fractions
+
+
+def make_prefixes(data: Dataset, fractions: list[float], outdir: str) -> list[Dataset]:
+    """
+    Return datasets made of the first records of data, one per fraction
+    (the last one is data itself). Prefixes already present in outdir are reused.
+    """
+    n_total = fastq_index(data.name1).n_records
+
+    prefixes = []
+    seen = set()
+    for fraction in fractions:
+        n_records = max(1, round(n_total * fraction))
+        if n_records in seen:
+            continue
+        seen.add(n_records)
+
+        if n_records == n_total:
+            prefixes.append(data)
+            continue
+
+        prefixes.append(make_prefix(data, n_records, outdir))
+
+    return prefixes
+
+
+def make_prefix(data: Dataset, n_records: int, outdir: str) -> Dataset:
+    """
+    Return dataset made of the first n_records of data, reusing files already in outdir;
+    raise ValueError if data is shorter.
+
+    Prefixes are kept in folders specific to the original files, so that they are
+    remade if a file changes (or another file of the same name is used).
+    """
+    files = []
+    for fastq in data.files:
+        stat = os.stat(fastq)
+        key = f"{path.realpath(fastq)}:{stat.st_size}:{stat.st_mtime_ns}".encode()
+        entry = path.join(outdir, hashlib.sha256(key).hexdigest()[:16])
+        os.makedirs(entry, exist_ok=True)
+
+        stem, ext = path.splitext(path.basename(fastq))
+        prefix = path.join(entry, f"{stem}_{n_records}reads{ext}")
+        if not path.exists(prefix):
+            logger.info(f"Writing first {n_records} records of {fastq}...")
+            # copy to a temporary name, so that interrupted runs leave no partial prefixes
+            partial = prefix + f".{os.getpid()}.partial"
+            begin, end = fastq_index(fastq).range(0, n_records)
+            copy_range(fastq, partial, begin, end)
+            os.replace(partial, prefix)
+        files.append(prefix)
+
+    return Dataset(*files)
+
+
+def fit_power_law(sizes: list[float], values: list[float]) -> Optional[PowerLaw]:
+    """Least squares fit of log(value) = log(coefficient) + exponent * log(size)"""
+    points = [
+        (math.log(s), math.log(v)) for s, v in zip(sizes, values) if s > 0 and v > 0
+    ]
+    if len(set(x for x, _ in points)) < 2:
+        return None
+
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    sxx = sum((x - mean_x) ** 2 for x, _ in points)
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    syy = sum((y - mean_y) ** 2 for _, y in points)
+
+    exponent = sxy / sxx
+    intercept = mean_y - exponent * mean_x
+    r2 = 1.0 if syy == 0 else sxy**2 / (sxx * syy)
+    return PowerLaw(math.exp(intercept), exponent, r2)
+
+
+def report_scaling(
+    results: list[Result], target_size: float, outname: str
+) -> list[dict]:
+    """
+    Fit every metric of every tool to a power law of the input size,
+    write the fits (and values extrapolated to target_size bytes) to outname
+    """
+    # (tool, threads) -> metric -> input size -> values of all repeats
+    samples = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+    for r in results:
+        if not r:
+            continue
+        for metric in METRICS:
+            samples[(r.tool, r.n_threads)][metric][r.original_size].append(
+                getattr(r, metric)
+            )
+
+    rows = []
+    for (tool, threads), metrics in sorted(samples.items()):
+        for metric, by_size in metrics.items():
+            sizes = sorted(by_size)
+            medians = [median(by_size[s]) for s in sizes]
+            fit = fit_power_law(sizes, medians)
+            if fit is None:
+                continue
+
+            rows.append({
+                "tool": tool,
+                "threads": threads,
+                "metric": metric,
+                "n_sizes": len(sizes),
+                "max_size": sizes[-1],
+                "exponent": round(fit.exponent, 3),
+                "r2": round(fit.r2, 3),
+                "target_size": int(target_size),
+                "extrapolated": round(fit(target_size), 3),
+                "superlinear": int(fit.exponent > SUPERLINEAR_EXPONENT),
+            })
+
+    with open(outname, "w") as fout:
+        writer = csv.DictWriter(
+            fout,
+            dialect="unix",
+            quoting=csv.QUOTE_MINIMAL,
+            fieldnames=FIELDNAMES,
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+
+    for r in rows:
+        logger.info(
+            f"{r['tool']}: {r['metric']} ~ size^{r['exponent']} (R^2 {r['r2']}), "
+            f"{r['extrapolated']} at {r['target_size']} bytes"
+        )
+        if r["superlinear"]:
+            logger.warn(
+                f"{r['tool']}: {r['metric']} grows super-linearly with input size "
+                f"(exponent {r['exponent']})"
+            )
+
+    return rows
@@ -0,0 +1,198 @@
+import argparse
+import copy
+import csv
+import os
+import time
+from os import path
+from statistics import median, quantiles
+from typing import Optional
+
+from src.dataset import Dataset
+from src.logger import logger
+from src.measure import MeasureOptions, measure_tool
+from src.mock import MockOptions
+from src.phases import PhaseWriter
+from src.records import Outputs, RecordWriter
+from src.results import Result, ResultWriter, get_results_dir
+from src.tools import mock
+from src.watchdog import WatchdogOptions
+from src.workqueue import Job, WorkQueue
+
+FIELDNAMES = ["suite", "case", "n", "value", "unit"]
+
+# memory injected to check reported peak memory, in MB
+INJECTED_MEMORY = 100
+
+# the hanging mock is aborted by the watchdog after this many seconds
+HANG_TIMEOUT = 5
+
+
+def self_benchmark(args: argparse.Namespace):
+    """
+    Benchmark the harness itself with the mock tool and --container-runtime none:
+    overhead per job, accuracy of reported times and memory, detection of
+    failures, and scaling of the work queue and of the outputs with the number of jobs
+    """
+    results_dir = get_results_dir(parent=args.output_folder)
+    scratch = path.join(results_dir, "scratch")
+    logdir = path.join(results_dir, "logs")
+    os.mkdir(scratch)
+    os.mkdir(logdir)
+
+    data = _make_dataset(path.join(scratch, "selfbench.fastq"), args.dataset_size)
+
+    rows = _overhead(data, args.repeats, logdir)
+    baseline = next(r["value"] for r in rows if r["case"] == "tool_startup")
+    rows += _accuracy(data, args.durations, baseline, logdir)
+    rows += _failures(data, logdir)
+    rows += _scaling(args.jobs, scratch)
+
+    outname = path.join(results_dir, "selfbench.csv")
+    with open(outname, "w") as fout:
+        writer = csv.DictWriter(
+            fout,
+            dialect="unix",
+            quoting=csv.QUOTE_MINIMAL,
+            fieldnames=FIELDNAMES,
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+
+    for r in rows:
+        logger.info(f"{r['suite']} {r['case']} (n={r['n']}): {r['value']} {r['unit']}")
+    logger.info(f"Wrote {outname}")
+
+
+def _make_dataset(fastq: str, size: float) -> Dataset:
+    """Plain fastq of about size MB"""
+    record = b"@selfbench\n" + b"ACGT" * 25 + b"\n+\n" + b"F" * 100 + b"\n"
+    n_records = max(1, int(size * 1e6 / len(record)))
+    with open(fastq, "wb") as fout:
+        fout.write(record * n_records)
+    return Dataset(fastq)
+
+
+def _run(
+    data: Dataset,
+    options: MockOptions,
+    logdir: str,
+    name: str,
+    measure_options: Optional[MeasureOptions] = None,
+) -> Result:
+    tool = mock(data, options.threads, options)
+    return measure_tool(
+        tool,
+        "none",
+        data,
+        options.threads,
+        path.join(logdir, name),
+        timeout=1,
+        options=measure_options,
+    )
+
+
+def _overhead(data: Dataset, repeats: int, logdir: str) -> list[dict]:
+    """Wall time of measure_tool not spent in the (idle) tool"""
+    startup, overhead = [], []
+    for i in range(repeats):
+        start = time.perf_counter()
+        result = _run(data, MockOptions(), logdir, f"overhead{i}")
+        wall = time.perf_counter() - start
+        if not result:
+            raise RuntimeError(f"the mock tool failed: {result.failure}")
+        startup.append((result.ctime + result.dtime) / 2)
+        overhead.append(wall - result.ctime - result.dtime)
+
+    return [
+        _row("overhead", "tool_startup", repeats, median(startup), "s"),
+        _row("overhead", "per_job_median", repeats, median(overhead), "s"),
+        _row("overhead", "per_job_p95", repeats, _p95(overhead), "s"),
+    ]
+
+
+def _accuracy(
+    data: Dataset, durations: list[float], baseline: float, logdir: str
+) -> list[dict]:
+    """Differences of reported times (less the idle tool's) and injected durations"""
+    rows = []
+    for duration in durations:
+        for kind in ("sleep", "cpu"):
+            options = MockOptions(**{kind: duration})
+            result = _run(data, options, logdir, f"accuracy_{kind}{duration}")
+            for step, elapsed in (
+                ("compression", result.ctime),
+                ("decompression", result.dtime),
+            ):
+                error = elapsed - baseline - duration
+                rows.append(
+                    _row("accuracy", f"{kind}_{step}_{duration}s", 1, error, "s")
+                )
+
+    idle = _run(data, MockOptions(), logdir, "accuracy_memory_idle")
+    result = _run(data, MockOptions(memory=INJECTED_MEMORY), logdir, "accuracy_memory")
+    error = (result.cmem - idle.cmem) / 1024 - INJECTED_MEMORY
+    rows.append(_row("accuracy", f"memory_{INJECTED_MEMORY}MB", 1, error, "MB"))
+    return rows
+
+
+def _failures(data: Dataset, logdir: str) -> list[dict]:
+    """1 if a failure of the mock is detected by the harness, 0 if not"""
+    # the watchdog kills the whole process tree, unlike a timeout
+    measure_options = MeasureOptions(
+        watchdog=WatchdogOptions(interval=1, stall_window=HANG_TIMEOUT)
+    )
+    rows = []
+    for fail in ("compression", "decompression", "crash", "hang", "size"):
+        result = _run(
+            data, MockOptions(fail=fail), logdir, f"fail_{fail}", measure_options
+        )
+        detected = not result or not result.decompressed_same_size
+        rows.append(_row("failures", fail, 1, int(detected), "detected"))
+    return rows
+
+
+def _scaling(counts: list[int], scratch: str) -> list[dict]:
+    """Time per job of the work queue and of writing outputs, for growing numbers of jobs"""
+    rows = []
+    for n in counts:
+        queue_dir = path.join(scratch, f"queue{n}")
+        queue = WorkQueue(queue_dir, stale_timeout=3600)
+        jobs = [Job(tool="mock", input1="x.fastq", iteration=i) for i in range(n)]
+
+        start = time.perf_counter()
+        queue.enqueue(jobs)
+        while claimed := queue.claim("selfbench"):
+            queue.finish(claimed[0])
+        rows.append(_row("scaling", "queue_per_job", n, _per_job(start, n), "ms"))
+
+        outputs = Outputs(
+            writer=ResultWriter(path.join(queue_dir, "results.csv")),
+            phase_writer=PhaseWriter(path.join(queue_dir, "phases.csv")),
+            record_writer=RecordWriter(path.join(queue_dir, "records.jsonl"), {}),
+        )
+        result = Result(tool="mock", dataset="x", n_threads=1, compressed_size=1)
+        result.commands = [copy.deepcopy(result)]
+        start = time.perf_counter()
+        for i in range(n):
+            outputs.add_result(result, i)
+        rows.append(_row("scaling", "outputs_per_job", n, _per_job(start, n), "ms"))
+
+    return rows
+
+
+def _per_job(start: float, n: int) -> float:
+    return (time.perf_counter() - start) * 1000 / n
+
+
+def _p95(values: list[float]) -> float:
+    return quantiles(values, n=20)[-1] if len(values) > 1 else values[0]
+
+
+def _row(suite: str, case: str, n: int, value: float, unit: str) -> dict:
+    return {
+        "suite": suite,
+        "case": case,
+        "n": n,
+        "value": round(value, 4),
+        "unit": unit,
+    }
@@ -0,0 +1,320 @@
+import argparse
+import csv
+import dataclasses
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from statistics import mean, median
+from typing import Optional
+
+from src.containers import ShellSession, container_dataset
+from src.dataset import Dataset
+from src.estimate import Estimator
+from src.fastq import copy_range, fastq_index
+from src.logger import logger
+from src.measure import (
+    MeasureOptions,
+    measure_tool,
+    options_from_args,
+    tool_environment,
+)
+from src.results import Result
+from src.tools import Tool, get_tools
+from src.watchdog import WatchdogOptions
+
+FIELDNAMES = [
+    "tool",
+    "dataset",
+    "iteration",
+    "files",
+    "concurrency",  # files processed at the same time
+    "threads",  # of every invocation
+    "wall_time",  # from the first file started to the last one finished
+    "files_per_second",  # compressed and decompressed
+    "mb_per_second",  # original MB of the files compressed and decompressed per second
+    "total_cr",
+    "file_ctime",  # mean compression time of a file
+    "file_dtime",  # mean decompression time of a file
+    "startup_ctime",  # median compression time of a single record: fixed latency
+    "startup_dtime",  # the same, of decompression
+    # share of the time of a file spent on the fixed latency
+    "startup_share",
+    "failed",  # files with invalid results
+]
+
+# fastq files taken from a directory
+FASTQ_SUFFIXES = (".fastq", ".fq")
+# mates of paired-end files taken from a directory
+MATE_SUFFIXES = ("_1", "_2")
+
+# how often a single record is compressed to measure the fixed latency
+STARTUP_RUNS = 3
+
+
+def measure_small_files(
+    args: argparse.Namespace,
+    data_local: Dataset,
+    results_dir: str,
+    estimator: Estimator,
+) -> list[dict]:
+    """
+    Compress and decompress many small files with every tool, args.small_files_concurrency
+    at a time, and write files per second, throughput and the fixed latency of an
+    invocation to small_files.csv.
+
+    Files are taken from args.small_files_dir, or split from the dataset. Commands of
+    a tool run in one session, so that containers are not started for every file;
+    the fixed latency is the time to compress (and decompress) a single record.
+    """
+    scratch = path.join(results_dir, "small-files")
+    logdir = path.join(results_dir, "logs")
+    os.makedirs(logdir, exist_ok=True)
+
+    name = data_local.name
+    if args.small_files_dir:
+        name = path.basename(path.normpath(args.small_files_dir))
+        datasets = [
+            d.linked_into(path.join(scratch, str(i)))
+            for i, d in enumerate(small_file_datasets(args.small_files_dir))
+        ]
+    else:
+        datasets = split_dataset(
+            data_local,
+            args.small_file_count,
+            int(args.small_file_size * 1024**2),
+            scratch,
+        )
+    if not datasets:
+        logger.warn("No small files to compress")
+        return []
+    single = _single_record(datasets[0], path.join(scratch, "single"))
+
+    concurrency = args.small_files_concurrency or os.cpu_count() or 1
+    n_threads = max(1, args.threads // concurrency)
+    options = options_from_args(args)
+    # commands of small files are too short to watch, and killing one
+    # would stop the session
+    options.watchdog = WatchdogOptions()
+    logger.info(
+        f"{len(datasets)} small files, {concurrency} at a time "
+        f"with {n_threads} threads each"
+    )
+
+    # the tools of every file, by name
+    file_tools = [_tools_by_name(args, d, n_threads) for d in datasets]
+    rows = []
+    for tool in _tools_by_name(args, single, n_threads).values():
+        with ShellSession(
+            args.container_runtime, tool_environment(tool), "smallfiles"
+        ) as session:
+            if not session.exec_exists(tool.binary):
+                logger.warn(f"{tool.name} not found, skipping...")
+                continue
+            session_options = dataclasses.replace(options, session=session)
+            tool_logdir = path.join(logdir, f"{tool.name}_small-files")
+            os.makedirs(tool_logdir, exist_ok=True)
+
+            startup = [
+                measure_tool(
+                    tool,
+                    args.container_runtime,
+                    single,
+                    n_threads,
+                    path.join(tool_logdir, f"single{i}"),
+                    estimator.timeout(tool.name, 0),
+                    session_options,
+                )
+                for i in range(STARTUP_RUNS)
+            ]
+            startup = [r for r in startup if r]
+
+            for iteration in range(1, args.repeats + 1):
+                logger.info(
+                    f"Iteration {iteration} for {tool.name} on {len(datasets)} small files"
+                )
+                results, wall = _run_files(
+                    [tools[tool.name] for tools in file_tools],
+                    datasets,
+                    args.container_runtime,
+                    n_threads,
+                    path.join(tool_logdir, f"iter{iteration}"),
+                    estimator,
+                    session_options,
+                    concurrency,
+                )
+                row = _row(tool, name, results, wall, startup)
+                row.update(
+                    iteration=iteration, concurrency=concurrency, threads=n_threads
+                )
+                rows.append(row)
+
+    shutil.rmtree(scratch)
+
+    outname = path.join(results_dir, "small_files.csv")
+    with open(outname, "w") as fout:
+        writer = csv.DictWriter(
+            fout,
+            dialect="unix",
+            quoting=csv.QUOTE_MINIMAL,
+            fieldnames=FIELDNAMES,
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+
+    for r in rows:
+        logger.info(
+            f"{r['tool']} on {r['files']} small files: {r['files_per_second']} files/s, "
+            f"{r['mb_per_second']} MB/s, startup {r['startup_ctime']}s + "
+            f"{r['startup_dtime']}s ({r['startup_share']} of a file)"
+        )
+    logger.info(f"Wrote {outname}")
+    return rows
+
+
+def small_file_datasets(dirname: str) -> list[Dataset]:
+    """
+    Plain fastq files in dirname, as single-end datasets, or paired-end ones
+    for files named <name>_1 and <name>_2
+    """
+    stems = {}
+    for name in sorted(os.listdir(dirname)):
+        stem, ext = path.splitext(name)
+        if ext in FASTQ_SUFFIXES:
+            stems[stem] = path.join(dirname, name)
+
+    datasets = []
+    for stem, fastq in stems.items():
+        base, mate = stem[:-2], stem[-2:]
+        if mate == MATE_SUFFIXES[1] and base + MATE_SUFFIXES[0] in stems:
+            continue
+        if mate == MATE_SUFFIXES[0] and base + MATE_SUFFIXES[1] in stems:
+            datasets.append(Dataset(fastq, stems[base + MATE_SUFFIXES[1]]))
+        else:
+            datasets.append(Dataset(fastq))
+    return datasets
+
+
+def split_dataset(
+    data: Dataset, n_files: int, file_size: int, outdir: str
+) -> list[Dataset]:
+    """
+    Split the first records of data into up to n_files datasets of about file_size
+    bytes (of the first mate) each, every one in its own subdirectory of outdir
+    """
+    index = fastq_index(data.name1)
+    record_size = index.size / max(index.n_records, 1)
+    per_file = max(1, round(file_size / record_size))
+    n_files = min(n_files, index.n_records // per_file)
+    if n_files == 0:
+        logger.warn(f"{data.name1} is smaller than one small file, using all of it")
+        per_file, n_files = index.n_records, 1
+
+    logger.info(f"Writing {n_files} small files of {per_file} records each...")
+    indices = [index] + [fastq_index(f) for f in data.files[1:]]
+    datasets = []
+    for i in range(n_files):
+        dirname = path.join(outdir, str(i))
+        os.makedirs(dirname, exist_ok=True)
+        files = []
+        for fastq, fastq_idx in zip(data.files, indices):
+            stem, ext = path.splitext(path.basename(fastq))
+            part = path.join(dirname, f"{stem}_part{i}{ext}")
+            copy_range(fastq, part, *fastq_idx.range(i * per_file, per_file))
+            files.append(part)
+        datasets.append(Dataset(*files))
+    return datasets
+
+
+def _single_record(data: Dataset, outdir: str) -> Dataset:
+    """Dataset made of the first record of data"""
+    os.makedirs(outdir, exist_ok=True)
+    files = []
+    for fastq in data.files:
+        single = path.join(outdir, path.basename(fastq))
+        copy_range(fastq, single, *fastq_index(fastq).range(0, 1))
+        files.append(single)
+    return Dataset(*files)
+
+
+def _tools_by_name(
+    args: argparse.Namespace, data_local: Dataset, n_threads: int
+) -> dict[str, Tool]:
+    data_cont = container_dataset(data_local, args.container_runtime)
+    tools = get_tools(data_cont, n_threads, args.tools, args.zdur_modes)
+    return {t.name: t for t in tools}
+
+
+def _run_files(
+    tools: list[Tool],
+    datasets: list[Dataset],
+    runtime: str,
+    n_threads: int,
+    logfile_prefix: str,
+    estimator: Estimator,
+    options: MeasureOptions,
+    concurrency: int,
+) -> tuple[list[Result], float]:
+    """Measure tools on their datasets, concurrency at a time; return results and wall time"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(
+                measure_tool,
+                tool,
+                runtime,
+                data_local,
+                n_threads,
+                f"{logfile_prefix}_{i}",
+                estimator.timeout(
+                    tool.name, sum(path.getsize(f) for f in data_local.files)
+                ),
+                options,
+            )
+            for i, (tool, data_local) in enumerate(zip(tools, datasets))
+        ]
+        results = [f.result() for f in futures]
+    return results, time.perf_counter() - start
+
+
+def _row(
+    tool: Tool,
+    dataset: str,
+    results: list[Result],
+    wall: float,
+    startup: list[Result],
+) -> dict:
+    valid = [r for r in results if r]
+    original = sum(r.original_size for r in valid)
+    compressed = sum(r.compressed_size for r in valid)
+    file_ctime = round(mean(r.ctime for r in valid), 3) if valid else None
+    file_dtime = round(mean(r.dtime for r in valid), 3) if valid else None
+    startup_ctime = _median(r.ctime for r in startup)
+    startup_dtime = _median(r.dtime for r in startup)
+
+    startup_share = None
+    if valid and startup and file_ctime + file_dtime:
+        startup_share = round(
+            min((startup_ctime + startup_dtime) / (file_ctime + file_dtime), 1), 3
+        )
+    return {
+        "tool": tool.name,
+        "dataset": dataset,
+        "files": len(results),
+        "wall_time": round(wall, 3),
+        "files_per_second": round(len(valid) / wall, 3),
+        "mb_per_second": round(original / 1e6 / wall, 3),
+        "total_cr": round(original / compressed, 3) if compressed else None,
+        "file_ctime": file_ctime,
+        "file_dtime": file_dtime,
+        "startup_ctime": startup_ctime,
+        "startup_dtime": startup_dtime,
+        "startup_share": startup_share,
+        "failed": len(results) - len(valid),
+    }
+
+
+def _median(values) -> Optional[float]:
+    values = list(values)
+    return round(median(values), 3) if values else None
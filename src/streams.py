@@ -0,0 +1,216 @@
+import bz2
+import csv
+import lzma
+import math
+import zlib
+from multiprocessing import Pool
+
+from src.dataset import Dataset
+from src.fastq import fastq_index, record_lines
+from src.logger import logger
+from src.results import Result
+
+# line of a record -> stream; the "+" line carries no information
+STREAMS = {0: "header", 1: "sequence", 3: "quality"}
+
+# highest context order, and most (context, symbol) pairs to count
+MAX_ORDER = 12
+MAX_CONTEXTS = 1 << 24
+
+FIELDNAMES = [
+    "dataset",
+    "file",
+    "stream",
+    "sampled_records",
+    "symbols",  # estimated for the whole file
+    "order",  # order k of the context model
+    "order0_bps",  # empirical entropy, in bits per symbol
+    "orderk_bps",
+    "bound_size",  # orderk_bps * symbols, in bytes
+    # bits per symbol of baseline codecs (see _baseline_codecs)
+]
+
+
+def analyse_streams(
+    data: Dataset,
+    n_records: int,
+    n_workers: int,
+    outname: str,
+    symbols_per_context: float = 16,
+) -> list[dict]:
+    """
+    Split the first n_records of every file of data into header, sequence
+    and quality streams, write their empirical entropies and sizes compressed
+    with baseline codecs (in bits per symbol) to outname.
+
+    Entropies are lower bounds for compressors modelling every stream
+    separately with contexts of up to k preceding symbols; values of the sample
+    are extrapolated to the whole files. Entropies of high orders are underestimated
+    when (context, symbol) pairs are seen only a few times, so k is also limited
+    to orders with at least symbols_per_context sampled symbols per possible pair.
+    """
+    try:
+        # optional dependency, only needed for the analysis
+        import numpy  # noqa: F401
+    except ImportError:
+        logger.warn("NumPy is not installed, skipping the analysis of streams")
+        return []
+
+    codecs = _baseline_codecs()
+    rows = []
+    samples = []
+    for fastq in data.files:
+        logger.info(f"Analysing streams of {fastq}...")
+        index = fastq_index(fastq)
+        n_sampled = min(n_records, index.n_records)
+        with open(fastq, "rb") as fin:
+            sample = fin.read(index.offset(n_sampled))
+
+        for stream, symbols in split_streams(sample).items():
+            order0, _ = entropy(symbols, 0)
+            order, orderk = _highest_order(symbols, symbols_per_context)
+            n_symbols = round(len(symbols) * index.n_records / max(n_sampled, 1))
+            rows.append({
+                "dataset": data.name,
+                "file": fastq,
+                "stream": stream,
+                "sampled_records": n_sampled,
+                "symbols": n_symbols,
+                "order": order,
+                "order0_bps": round(order0, 4),
+                "orderk_bps": round(orderk, 4),
+                "bound_size": round(orderk * n_symbols / 8),
+            })
+            samples.append(symbols)
+
+    # baseline codecs on every stream, in parallel
+    tasks = [(codec, s) for s in samples for codec in codecs]
+    with Pool(max(1, min(n_workers, len(tasks)))) as pool:
+        sizes = pool.starmap(_compressed_size, tasks)
+    for i, row in enumerate(rows):
+        n_sampled_symbols = max(len(samples[i]), 1)
+        for j, codec in enumerate(codecs):
+            size = sizes[i * len(codecs) + j]
+            row[f"{codec}_bps"] = round(8 * size / n_sampled_symbols, 4)
+
+    rows.append({
+        "dataset": data.name,
+        "stream": "total",
+        "bound_size": sum(r["bound_size"] for r in rows),
+    })
+
+    with open(outname, "w") as fout:
+        writer = csv.DictWriter(
+            fout,
+            dialect="unix",
+            quoting=csv.QUOTE_MINIMAL,
+            fieldnames=FIELDNAMES + [f"{c}_bps" for c in codecs],
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+
+    for r in rows[:-1]:
+        logger.info(
+            f"{r['file']} {r['stream']}: {r['order0_bps']} bits/symbol (order 0), "
+            f"{r['orderk_bps']} (order {r['order']})"
+        )
+    logger.info(f"Order-k bound of {data.name}: {rows[-1]['bound_size']} bytes")
+    return rows
+
+
+def report_bounds(results: list[Result], streams: list[dict]):
+    """Log how close compressed sizes of the results get to the bound of their dataset"""
+    bounds = {r["dataset"]: r["bound_size"] for r in streams if r["stream"] == "total"}
+    for r in results:
+        if r and bounds.get(r.dataset):
+            logger.info(
+                f"{r.tool}: compressed size is {r.compressed_size / bounds[r.dataset]:.2f}x "
+                f"the order-k bound of {r.dataset}"
+            )
+
+
+def split_streams(data: bytes) -> dict:
+    """Header (with newlines), sequence and quality streams of records in data, as uint8 arrays"""
+    import numpy as np
+
+    buf = np.frombuffer(data, dtype=np.uint8)
+    newlines = buf == ord("\n")
+    line = record_lines(buf)
+
+    streams = {}
+    for idx, stream in STREAMS.items():
+        mask = line == idx
+        if stream != "header":
+            mask &= ~newlines
+        streams[stream] = buf[mask]
+    return streams
+
+
+def entropy(symbols, order: int) -> tuple[float, int]:
+    """
+    Empirical entropy (in bits per symbol) of symbols given the order preceding ones,
+    and the number of distinct (context, symbol) pairs
+    """
+    import numpy as np
+
+    if len(symbols) <= order:
+        return 0.0, 0
+
+    # map symbols to 0..alphabet-1, so that contexts are dense
+    present = np.flatnonzero(np.bincount(symbols, minlength=256))
+    lut = np.zeros(256, dtype=np.int64)
+    lut[present] = np.arange(len(present))
+    codes = lut[symbols]
+    alphabet = len(present)
+
+    n = len(codes) - order
+    pairs = np.zeros(n, dtype=np.int64)
+    for i in range(order + 1):
+        pairs = pairs * alphabet + codes[i : i + n]
+
+    counts = np.bincount(pairs, minlength=alphabet ** (order + 1))
+    counts = counts.reshape(-1, alphabet)
+    contexts = counts.sum(axis=1, keepdims=True)
+    seen = counts > 0
+    bits = -np.sum(counts[seen] * np.log2((counts / np.maximum(contexts, 1))[seen]))
+    return float(bits / n), int(seen.sum())
+
+
+def _highest_order(symbols, symbols_per_context: float) -> tuple[int, float]:
+    """
+    Highest order whose (context, symbol) pairs can be counted, and are few enough
+    for the sample to have symbols_per_context symbols per pair; and its entropy
+    """
+    import numpy as np
+
+    alphabet = max(np.count_nonzero(np.bincount(symbols, minlength=256)), 2)
+    n_pairs = min(MAX_CONTEXTS, len(symbols) / symbols_per_context)
+    order = min(MAX_ORDER, int(math.log(max(n_pairs, 1)) / math.log(alphabet)) - 1)
+    order = max(order, 0)
+    return order, entropy(symbols, order)[0]
+
+
+def _baseline_codecs() -> list[str]:
+    codecs = ["gzip", "bzip2", "xz"]
+    try:
+        import zstandard  # noqa: F401
+
+        codecs.append("zstd")
+    except ImportError:
+        pass
+    return codecs
+
+
+def _compressed_size(codec: str, symbols) -> int:
+    data = symbols.tobytes()
+    if codec == "gzip":
+        return len(zlib.compress(data, 6))
+    if codec == "bzip2":
+        return len(bz2.compress(data, 9))
+    if codec == "xz":
+        return len(lzma.compress(data, preset=6))
+    if codec == "zstd":
+        import zstandard
+
+        return len(zstandard.ZstdCompressor(level=19).compress(data))
+    raise ValueError(f"Unknown codec {codec}")
@@ -0,0 +1,140 @@
+import csv
+from statistics import median
+from typing import Optional
+
+from src.compat import dataclass
+from src.logger import logger
+from src.results import Result
+
+FIELDNAMES = [
+    "tool",
+    "dataset",
+    "throttle",
+    "bandwidth",  # MB/s
+    "latency",  # ms per block
+    "ctime",  # compression time with throttled input
+    "unthrottled_ctime",  # median compression time with input read from disk
+    "slowdown",  # ctime / unthrottled_ctime
+    "storage_wait",  # seconds the tool waited for input
+    "tool_wait",  # seconds input waited for the tool
+    "input_rate",  # MB/s read by the unthrottled tool: I/O-bound below this bandwidth
+    # "io" if the tool waited for storage longer than storage waited for it, else "cpu"
+    "bound",
+]
+
+# KB read from storage at once
+DEFAULT_BLOCK = 1024
+
+
+@dataclass(slots=True)
+class ThrottleProfile:
+    name: str = ""
+    bandwidth: float = 0  # MB/s
+    latency: float = 0  # ms before every block
+    block: int = DEFAULT_BLOCK  # KB read at once
+
+    def to_spec(self) -> str:
+        return f"{self.name}={self.bandwidth}:{self.latency}:{self.block}"
+
+
+# typical network storage
+PROFILES = {
+    "nas": ThrottleProfile("nas", bandwidth=200, latency=2),
+    "nfs": ThrottleProfile("nfs", bandwidth=350, latency=1),
+    "lustre": ThrottleProfile("lustre", bandwidth=500, latency=0.5),
+}
+
+
+def parse_profile(spec: str) -> ThrottleProfile:
+    """
+    Built-in profile, or one given as <name>=<bandwidth>[:<latency>[:<block>]],
+    in MB/s, ms and KB, e.g. slow=100:5
+    """
+    if spec in PROFILES:
+        return PROFILES[spec]
+
+    name, sep, values = spec.partition("=")
+    if not sep or not name:
+        raise ValueError(
+            f"Unknown throttle profile {spec}, expected one of "
+            f"{', '.join(PROFILES)} or <name>=<bandwidth>[:<latency>[:<block>]]"
+        )
+    fields = values.split(":")
+    try:
+        profile = ThrottleProfile(
+            name,
+            float(fields[0]),
+            float(fields[1]) if len(fields) > 1 else 0,
+            int(fields[2]) if len(fields) > 2 else DEFAULT_BLOCK,
+        )
+    except ValueError:
+        profile = None
+    if (
+        profile is None
+        or len(fields) > 3
+        or profile.bandwidth <= 0
+        or profile.latency < 0
+        or profile.block <= 0
+    ):
+        raise ValueError(f"Invalid throttle profile {spec}")
+    return profile
+
+
+def report_throttling(
+    results: list[Result], profiles: list[ThrottleProfile], outname: str
+) -> list[dict]:
+    """Compare compression of throttled and unthrottled input, write it to outname"""
+    by_name = {p.name: p for p in profiles}
+    unthrottled: dict[tuple[str, str], list[Result]] = {}
+    for r in results:
+        # e.g. concurrent commands read the input faster than one at a time
+        if r and not r.throttle and not r.concurrent and not r.transform:
+            unthrottled.setdefault((r.tool, r.dataset), []).append(r)
+
+    rows = []
+    for r in results:
+        if not r or not r.throttle:
+            continue
+        profile = by_name[r.throttle]
+        storage_wait = _pipe_wait(r, "storage_wait")
+        tool_wait = _pipe_wait(r, "tool_wait")
+        base: Optional[float] = None
+        if (r.tool, r.dataset) in unthrottled:
+            base = median(u.ctime for u in unthrottled[(r.tool, r.dataset)])
+        rows.append({
+            "tool": r.tool,
+            "dataset": r.dataset,
+            "throttle": r.throttle,
+            "bandwidth": profile.bandwidth,
+            "latency": profile.latency,
+            "ctime": r.ctime,
+            "unthrottled_ctime": base,
+            "slowdown": round(r.ctime / base, 3) if base else None,
+            "storage_wait": round(storage_wait, 3),
+            "tool_wait": round(tool_wait, 3),
+            "input_rate": round(r.original_size / 1e6 / base, 1) if base else None,
+            "bound": "io" if storage_wait > tool_wait else "cpu",
+        })
+
+    with open(outname, "w") as fout:
+        writer = csv.DictWriter(
+            fout,
+            dialect="unix",
+            quoting=csv.QUOTE_MINIMAL,
+            fieldnames=FIELDNAMES,
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+
+    for row in rows:
+        logger.info(
+            f"{row['tool']} with {row['throttle']} input ({row['bandwidth']} MB/s): "
+            f"{row['bound']}-bound, slowdown {row['slowdown']}"
+        )
+    return rows
+
+
+def _pipe_wait(result: Result, name: str) -> float:
+    return sum(
+        p.elapsed_time for p in result.phases if p.source == "pipe" and p.name == name
+    )
@@ -1,4 +1,5 @@
 import dataclasses
+import os
 from os import path
 from typing import Optional
 
@@ -6,6 +7,7 @@ from src.compat import dataclass
 from src.containers import PathConverter
 from src.dataset import Dataset
 from src.logger import logger
+from src.mock import MockOptions
 
 
 @dataclass(slots=True)
@@ -29,6 +31,15 @@ class CompressDecompress:
     decompression: str = ""
     post_decompression: str = ""
 
+    # optional command writing decompressed data to stdout instead of files,
+    # used to measure decoding speed without writing to disk;
+    # it is run after decompression, but before post_decompression
+    decompression_stdout: str = ""
+
+    # optional command compressing stdin to stdout (the only original file
+    # and archive file), used to feed the input through a throttled pipe
+    compression_stdin: str = ""
+
     def original_files_host(self, converter: Optional[PathConverter]):
         yield from _local_paths_gen(self.original_files, converter)
 
@@ -67,6 +78,27 @@ TOOL_NAMES = {
     "fastore": "FaStore",
     "repaq": "repaq",
     "zDUR": "zDUR",
+    # single-threaded tools run on chunks in parallel, named e.g. gzipx4
+    "gzipxN": "gzipxN",
+    "fqzcomp4xN": "fqzcomp4xN",
+    # fake tool for testing the harness, not included in "all"
+    "mock": "mock",
+}
+
+# options of the mock tool (see src/mock.py), e.g. cpu=2,memory=500
+MOCK_ENV = "MOCK_TOOL"
+
+# single-threaded tools which can be run on chunks of the input in parallel:
+# binary, command compressing chunk {} into {}.<ext>,
+# command decompressing {}.<ext> into {}, ext
+CHUNKED_TOOLS = {
+    "gzip": ("gzip", "gzip --keep -f {}", "gzip -d --keep -f {}.gz", "gz"),
+    "fqzcomp4": (
+        "fqzcomp",
+        "fqzcomp -X -P {} {}.fqz4",
+        "fqzcomp -d -X -P {}.fqz4 {}",
+        "fqz4",
+    ),
 }
 
 
@@ -84,14 +116,23 @@ def _filter_tools(all_tools: list[Tool], tools_for_testing: list[str]):
     for tool in all_tools:
         # because for zDUR tool.name is of the form zDUR_{mode}
         key = "zDUR" if tool.name.startswith("zDUR") else tool.name
+        # and chunked tools are named {tool}x{n_threads}
+        base, _, n = key.rpartition("x")
+        if base in CHUNKED_TOOLS and n.isdigit():
+            key = f"{base}xN"
         if key in tools_for_testing:
             filtered_tools.append(tool)
 
     return filtered_tools
 
 
-def get_all_tools(data: Dataset, n_threads: int, zdur_modes: str) -> list[Tool]:
-    """Return tools that support running with `n_threads`"""
+def get_all_tools(
+    data: Dataset, n_threads: int, zdur_modes: str, with_mock: bool = False
+) -> list[Tool]:
+    """
+    Return tools that support running with `n_threads`;
+    the mock tool only with_mock, since it is configured from the environment
+    """
     if n_threads == 1:
         tools = [
             gzip(data),
@@ -100,6 +141,7 @@ def get_all_tools(data: Dataset, n_threads: int, zdur_modes: str) -> list[Tool]:
         ]
     else:
         tools = [pigz(data, n_threads)]
+        tools.extend(chunked(data, n_threads, name) for name in CHUNKED_TOOLS)
 
     tools.extend([
         leon(data, n_threads),
@@ -110,6 +152,9 @@ def get_all_tools(data: Dataset, n_threads: int, zdur_modes: str) -> list[Tool]:
         repaq(data, n_threads),
     ])
 
+    if with_mock:
+        tools.append(mock(data, n_threads))
+
     for zdur_mode in zdur_modes.split(","):
         if zdur_mode not in ZDUR_MODES:
             logger.warn(
@@ -122,13 +167,24 @@ def get_all_tools(data: Dataset, n_threads: int, zdur_modes: str) -> list[Tool]:
     return tools
 
 
+def get_tool(data: Dataset, n_threads: int, name: str, zdur_modes: str) -> Tool:
+    """Return tool by its name (as reported in the output)"""
+    with_mock = name == TOOL_NAMES["mock"]
+    for tool in get_all_tools(data, n_threads, zdur_modes, with_mock):
+        if tool.name == name:
+            return tool
+    raise ValueError(f"Unknown tool: {name}")
+
+
 def get_tools(
     data: Dataset, n_threads: int, tools_for_testing: str, zdur_modes: str
 ) -> list[Tool]:
-    tools = get_all_tools(data, n_threads, zdur_modes)
     if tools_for_testing == "all":
-        return tools
+        return get_all_tools(data, n_threads, zdur_modes)
     tools_for_testing = tools_for_testing.split(",")
+    tools = get_all_tools(
+        data, n_threads, zdur_modes, TOOL_NAMES["mock"] in tools_for_testing
+    )
 
     single_thread_tools = {"gzip", "fqzcomp4", "quip"}
     if n_threads > 1:
@@ -137,6 +193,13 @@ def get_tools(
                 logger.warn(f"{tool_for_testing} skipped due to number of threads")
     if n_threads == 1 and "pigz" in tools_for_testing:
         logger.warn("pigz skipped due to number of threads, use gzip for single thread")
+    if n_threads == 1:
+        for tool_for_testing in tools_for_testing:
+            if (
+                tool_for_testing.endswith("xN")
+                and tool_for_testing.removesuffix("xN") in CHUNKED_TOOLS
+            ):
+                logger.warn(f"{tool_for_testing} skipped due to number of threads")
 
     return _filter_tools(tools, tools_for_testing)
 
@@ -156,6 +219,8 @@ def gzip(data: Dataset) -> Tool:
             archive_files=[archive],
             post_compression=f'mv "{archive}" "{moved_archive}"',
             decompression=f'gzip -d --keep -f "{moved_archive}"',
+            decompression_stdout=f'gzip -dc "{moved_archive}"',
+            compression_stdin="gzip -c",
             decompressed_files=[decomp],
             post_decompression=f'rm -f "{moved_archive}"',
         )
@@ -184,6 +249,8 @@ def pigz(data: Dataset, n_threads: int) -> Tool:
             archive_files=[archive],
             post_compression=f'mv "{archive}" "{moved_archive}"',
             decompression=f'pigz -d --keep -f "{moved_archive}" -p {n_threads}',
+            decompression_stdout=f'pigz -dc "{moved_archive}" -p {n_threads}',
+            compression_stdin=f"pigz -c -p {n_threads}",
             decompressed_files=[decomp],
             post_decompression=f'rm -f "{moved_archive}"',
         )
@@ -197,6 +264,65 @@ def pigz(data: Dataset, n_threads: int) -> Tool:
     return tool
 
 
+def chunked(data: Dataset, n_threads: int, name: str) -> Tool:
+    """
+    Split the input into n_threads record-aligned chunks (mates of PE data
+    are split alike), compress them concurrently with a single-threaded tool
+    and store the compressed chunks in a single (uncompressed) tar archive.
+    Decompression extracts and decompresses the chunks concurrently,
+    and concatenates them back.
+
+    Peak memory reported is that of the largest process, not of all of them.
+    """
+    binary, compress, decompress, ext = CHUNKED_TOOLS[name]
+    tool = Tool(name=f"{name}x{n_threads}", binary=binary)
+
+    archive = data.name1 + f".{tool.name}"
+    workdir = path.dirname(archive) or "."
+    base = path.basename(archive)
+    # e.g. {archive}.1.000 is the first chunk of the first mate
+    chunk = "[0-9][0-9][0-9]"
+    chunks = f"{base}.[12].{chunk}"
+
+    decomp_files = [f + ".decomp" for f in data.files]
+
+    # the commands are run as sh -c "...", so they have
+    # no double quotes, and $ is escaped from the outer shell;
+    # sh -c '...' makes GNU time measure the whole pipeline
+    n = n_threads
+    # records per chunk are taken from the first mate
+    compression = [
+        f"per=\\$(( (\\$(wc -l < {data.name1}) / 4 + {n} - 1) / {n} * 4 ))",
+        *(
+            f"split -l \\$per -d -a 3 {fastq} {workdir}/{base}.{idx}."
+            for idx, fastq in enumerate(data.files, start=1)
+        ),
+        f"ls {workdir}/{chunks} | xargs -P {n} -I{{}} {compress}",
+        f"(cd {workdir} && tar -cf {base} {chunks}.{ext})",
+        f"rm -f {workdir}/{chunks}*",
+    ]
+    decompression = [
+        f"(cd {workdir} && tar -xf {base})",
+        f"ls {workdir}/{chunks}.{ext} | sed s/.{ext}\\$// | xargs -P {n} -I{{}} {decompress}",
+        *(
+            f"cat {workdir}/{base}.{idx}.{chunk} > {decomp}"
+            for idx, decomp in enumerate(decomp_files, start=1)
+        ),
+        f"rm -f {workdir}/{chunks}*",
+    ]
+
+    tool.commands.append(
+        CompressDecompress(
+            original_files=data.files,
+            compression=f"sh -c '{' && '.join(compression)}'",
+            archive_files=[archive],
+            decompression=f"sh -c '{' && '.join(decompression)}'",
+            decompressed_files=decomp_files,
+        )
+    )
+    return tool
+
+
 def leon(data: Dataset, n_threads: int) -> Tool:
     def make_command(fastq: str, binary: str = "leon") -> CompressDecompress:
         archive = fastq + ".leon"
@@ -258,6 +384,10 @@ def fqzcomp4(data: Dataset) -> Tool:
             compression=f"{binary} -X -P {fastq} {archive}",
             archive_files=[archive],
             decompression=f"{binary} -d -X -P {archive} {decomp}",
+            # writes to stdout if output file is omitted
+            decompression_stdout=f"{binary} -d -X -P {archive}",
+            # and reads stdin if both are
+            compression_stdin=f"{binary} -X -P",
             decompressed_files=[decomp],
         )
         return cmd
@@ -281,6 +411,7 @@ def fqzcomp5(data: Dataset, threads: int) -> Tool:
             compression=f"{binary} -t{threads} -v {fastq} {archive}",
             archive_files=[archive],
             decompression=f"{binary} -d -t{threads} -v {archive} {decomp}",
+            decompression_stdout=f"{binary} -d -t{threads} -v {archive} /dev/stdout",
             decompressed_files=[decomp],
         )
 
@@ -304,6 +435,8 @@ def dsrc(data: Dataset, threads: int) -> Tool:
             compression=f"{binary} c -v -t{threads} {fastq} {archive}",
             archive_files=[archive],
             decompression=f"{binary} d -v -t{threads} {archive} {decomp}",
+            # -s to write to stdout
+            decompression_stdout=f"{binary} d -v -t{threads} -s {archive}",
             decompressed_files=[decomp],
         )
         return cmd
@@ -385,6 +518,7 @@ def repaq(data: Dataset, threads: int) -> Tool:
         # fmt: off
         cmd.compression = f"{tool.binary} -c --in1 {data.name1} -o {archive} -t {threads}"
         cmd.decompression = f"{tool.binary} -d -i {archive} --out1 {decomp1} -t {threads}"
+        cmd.decompression_stdout = f"{tool.binary} -d -i {archive} --stdout -t {threads}"
         cmd.decompressed_files = [decomp1]
         # fmt: on
 
@@ -418,3 +552,76 @@ def zdur(data: Dataset, threads: int, mode: str = "c-simtree") -> Tool:
 
     tool.commands.append(cmd)
     return tool
+
+
+def mock(data: Dataset, threads: int, options: Optional[MockOptions] = None) -> Tool:
+    """Fake tool, configured by options or by the MOCK_TOOL environment variable"""
+    if options is None:
+        options = MockOptions.from_spec(os.environ.get(MOCK_ENV, ""))
+        options.threads = threads
+    spec = options.to_spec()
+    binary = "python3 -m src.mock"
+
+    def make_command(fastq: str) -> CompressDecompress:
+        archive = fastq + ".mock"
+        decomp = archive + ".decomp"
+
+        cmd = CompressDecompress(
+            original_files=[fastq],
+            compression=f"{binary} compress {fastq} {archive} {spec}",
+            archive_files=[archive],
+            decompression=f"{binary} decompress {archive} {decomp} {spec}",
+            decompression_stdout=f"{binary} decompress {archive} /dev/stdout {spec}",
+            compression_stdin=f"{binary} compress /dev/stdin /dev/stdout {spec}",
+            decompressed_files=[decomp],
+        )
+        return cmd
+
+    tool = Tool(name=TOOL_NAMES["mock"], binary="python3")
+    tool.commands = [make_command(data.name1)]
+    if data.is_pe:
+        tool.commands.append(make_command(data.name2))
+    return tool
+
+
+def scaled_tool(data: Dataset, name: str, n_threads: int) -> Optional[Tool]:
+    """
+    Tool (by its name, as reported in the output) built with n_threads whether or not
+    get_tools offers it with that many threads, e.g. pigz with one thread; chunked
+    tools are split into n_threads chunks (and named after them). None for unknown names
+    """
+    factories = {
+        TOOL_NAMES["gzip"]: lambda: gzip(data),
+        TOOL_NAMES["pigz"]: lambda: pigz(data, n_threads),
+        TOOL_NAMES["leon"]: lambda: leon(data, n_threads),
+        TOOL_NAMES["quip"]: lambda: quip(data),
+        TOOL_NAMES["fqzcomp4"]: lambda: fqzcomp4(data),
+        TOOL_NAMES["fqzcomp5"]: lambda: fqzcomp5(data, n_threads),
+        TOOL_NAMES["dsrc"]: lambda: dsrc(data, n_threads),
+        TOOL_NAMES["spring"]: lambda: spring(data, n_threads),
+        TOOL_NAMES["fastore"]: lambda: fastore(data, n_threads),
+        TOOL_NAMES["repaq"]: lambda: repaq(data, n_threads),
+        TOOL_NAMES["mock"]: lambda: mock(data, n_threads),
+    }
+    if name in factories:
+        return factories[name]()
+
+    # e.g. gzipx4
+    base, _, n_chunks = name.rpartition("x")
+    if base in CHUNKED_TOOLS and n_chunks.isdigit():
+        return chunked(data, n_threads, base)
+
+    # e.g. zDUR_c-fast
+    prefix, _, mode = name.partition("_")
+    if prefix == TOOL_NAMES["zDUR"] and mode in ZDUR_MODES:
+        return zdur(data, n_threads, mode)
+    return None
+
+
+def per_mate_tool(data: Dataset, name: str, n_threads: int) -> Optional[Tool]:
+    """
+    Tool (by its name, as reported in the output) running one command per mate,
+    built with n_threads (see scaled_tool); None for tools compressing both mates at once
+    """
+    tool = scaled_tool(data, name, n_threads)
+    return tool if tool and len(tool.commands) > 1 else None
@@ -0,0 +1,481 @@
+import csv
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import os
+import shutil
+import tempfile
+import time
+from contextlib import ExitStack
+from functools import partial
+from multiprocessing import Pool
+from operator import itemgetter
+from os import path
+from typing import Callable, Optional
+
+from src.compat import dataclass
+from src.dataset import Dataset
+from src.fastq import INDEX_CHUNK_SIZE, LINES_PER_RECORD, fastq_index, record_lines
+from src.logger import logger
+from src.pipes import CHUNK_SIZE
+
+PHRED_OFFSET = 33
+MAX_QUALITY = 93
+
+COST_NAME = "transform.json"
+COST_FIELDNAMES = [
+    "transform",
+    "dataset",  # the transformed copy
+    "original_size",
+    "seconds",
+    "mb_per_second",
+    "reused",  # 1 if the copy was made by an earlier run, with the given cost
+]
+
+# signatures records are reordered by
+SIGNATURES = ("minimizer", "kmer")
+MAX_K = 32  # k-mers are packed into 64 bits
+# records sorted in memory take up to this many times their size
+SORT_OVERHEAD = 16
+# most runs merged at once, so that open files stay well below their limit
+MERGE_FANIN = 128
+# signatures of runs are read and written in blocks of this many
+MERGE_BLOCK = 1 << 16
+# odd multiplier of the hash of k-mers, so that minimizers are not biased towards poly-A
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+# name -> bins (lowest quality, highest quality, value);
+# qualities outside of all bins (e.g. 2 of no-calls) are kept
+BIN_SCHEMES = {
+    "illumina8": [
+        (3, 9, 6),
+        (10, 19, 15),
+        (20, 24, 22),
+        (25, 29, 27),
+        (30, 34, 33),
+        (35, 39, 37),
+        (40, MAX_QUALITY, 40),
+    ],
+    "illumina4": [
+        (3, 14, 12),
+        (15, 30, 23),
+        (31, MAX_QUALITY, 37),
+    ],
+}
+
+
+def parse_scheme(spec: str) -> tuple[str, list[tuple[int, int, int]]]:
+    """
+    Name and bins of a built-in scheme, or of one given as
+    <name>=<low>-<high>:<value>/<low>-<high>:<value>/..., e.g. coarse=0-19:10/20-93:30
+    """
+    if spec in BIN_SCHEMES:
+        return spec, BIN_SCHEMES[spec]
+
+    name, sep, bins_spec = spec.partition("=")
+    if not sep or not name:
+        raise ValueError(
+            f"Unknown binning scheme {spec}, expected one of "
+            f"{', '.join(BIN_SCHEMES)} or <name>=<low>-<high>:<value>/..."
+        )
+    bins = []
+    for item in bins_spec.split("/"):
+        bounds, _, value = item.partition(":")
+        low, _, high = bounds.partition("-")
+        try:
+            low, high, value = int(low), int(high), int(value)
+        except ValueError:
+            low = high = value = -1
+        if not 0 <= low <= high <= MAX_QUALITY or not 0 <= value <= MAX_QUALITY:
+            raise ValueError(f"Invalid bin {item} of binning scheme {name}")
+        bins.append((low, high, value))
+    return name, bins
+
+
+def quality_table(bins: list[tuple[int, int, int]]) -> bytes:
+    """Translation table of quality characters (for bytes.translate)"""
+    table = bytearray(range(256))
+    for low, high, value in bins:
+        for q in range(low, high + 1):
+            table[q + PHRED_OFFSET] = value + PHRED_OFFSET
+    return bytes(table)
+
+
+@dataclass(slots=True)
+class Transformed:
+    data: Dataset  # the transformed copy
+    transform: str
+    size: int  # bytes of the original files
+    seconds: float  # wall time of making the copy, reused or not
+    reused: bool
+
+
+def bin_qualities(data: Dataset, spec: str, outdir: str, n_workers: int) -> Transformed:
+    """Copy of data with qualities binned by the scheme of spec"""
+    name, bins = parse_scheme(spec)
+    table = quality_table(bins)
+    return _transform(
+        data,
+        name,
+        table,
+        outdir,
+        partial(_translate_files, table=table, n_workers=n_workers),
+    )
+
+
+def reorder_name(signature: str, k: int) -> str:
+    return f"reorder-{signature}{k}"
+
+
+def reorder_records(
+    data: Dataset,
+    signature: str,
+    k: int,
+    outdir: str,
+    n_workers: int,
+    memory: int,
+) -> Optional[Transformed]:
+    """
+    Copy of data with records sorted by a signature of their sequence: the lowest
+    hash of its k-mers ("minimizer") or its first k-mer ("kmer"). Paired-end records
+    are sorted by the sequence of the first mate, so mates stay in the same order,
+    and records with equal signatures keep their order.
+
+    Runs of records small enough to be sorted with about memory bytes are sorted
+    in parallel and merged from disk, so files larger than memory can be reordered.
+    """
+    try:
+        # optional dependency, signatures are computed with it
+        import numpy  # noqa: F401
+    except ImportError:
+        logger.warn("NumPy is not installed, skipping reordering of records")
+        return None
+
+    return _transform(
+        data,
+        reorder_name(signature, k),
+        f"{signature}:{k}".encode(),
+        outdir,
+        partial(
+            _reorder_files,
+            signature=signature,
+            k=k,
+            n_workers=n_workers,
+            memory=memory,
+        ),
+    )
+
+
+def write_costs(transformed: list[Transformed], outname: str):
+    """Write the preprocessing costs of transformed datasets to a .csv file"""
+    with open(outname, "w") as fout:
+        writer = csv.DictWriter(
+            fout,
+            dialect="unix",
+            quoting=csv.QUOTE_MINIMAL,
+            fieldnames=COST_FIELDNAMES,
+        )
+        writer.writeheader()
+        for t in transformed:
+            writer.writerow({
+                "transform": t.transform,
+                "dataset": t.data.name,
+                "original_size": t.size,
+                "seconds": round(t.seconds, 3),
+                "mb_per_second": round(t.size / 1e6 / max(t.seconds, 1e-9), 2),
+                "reused": int(t.reused),
+            })
+
+
+def _transform(
+    data: Dataset,
+    name: str,
+    params: bytes,
+    outdir: str,
+    make: Callable[[list[str], list[str]], None],
+) -> Transformed:
+    """
+    Return copy of data made by make(files, outputs), reusing a copy already in outdir.
+
+    Copies are named <stem>.<name><ext>, in folders specific to the original
+    files and params of the transform, so that they are remade if either changes.
+    """
+    key = params
+    for fastq in data.files:
+        stat = os.stat(fastq)
+        key += f"{path.realpath(fastq)}:{stat.st_size}:{stat.st_mtime_ns}".encode()
+    entry = path.join(outdir, hashlib.sha256(key).hexdigest()[:16])
+    outputs = []
+    for fastq in data.files:
+        stem, ext = path.splitext(path.basename(fastq))
+        outputs.append(path.join(entry, f"{stem}.{name}{ext}"))
+    size = sum(path.getsize(f) for f in data.files)
+
+    cost_path = path.join(entry, COST_NAME)
+    if path.exists(cost_path) and all(path.exists(f) for f in outputs):
+        with open(cost_path, "r") as fin:
+            seconds = json.load(fin)["seconds"]
+        logger.info(f"Reusing {name} copy of {data.name} from {entry}")
+        return Transformed(Dataset(*outputs), name, size, seconds, reused=True)
+
+    logger.info(f"Making {name} copy of {data.name}...")
+    os.makedirs(entry, exist_ok=True)
+    partials = [f + f".{os.getpid()}.partial" for f in outputs]
+    start = time.perf_counter()
+    make(data.files, partials)
+    seconds = time.perf_counter() - start
+    for partial_path, output in zip(partials, outputs):
+        os.replace(partial_path, output)
+    with open(cost_path, "w") as fout:
+        json.dump({"transform": name, "files": data.files, "seconds": seconds}, fout)
+    logger.info(f"Made {name} copy of {data.name} in {seconds:.1f} s")
+
+    return Transformed(Dataset(*outputs), name, size, seconds, reused=False)
+
+
+def _translate_files(
+    files: list[str], outputs: list[str], table: bytes, n_workers: int
+):
+    for src, dst in zip(files, outputs):
+        _translate_qualities(src, dst, table, n_workers)
+
+
+def _translate_qualities(src: str, dst: str, table: bytes, n_workers: int):
+    """Write src with quality lines translated by table; the size does not change"""
+    index = fastq_index(src)
+    n_shards = max(n_workers, math.ceil(index.size / INDEX_CHUNK_SIZE), 1)
+    shards = [(src, dst, begin, end, table) for begin, end in index.shards(n_shards)]
+
+    with open(dst, "wb") as fout:
+        fout.truncate(index.size)
+
+    if n_workers > 1 and len(shards) > 1:
+        with Pool(n_workers) as pool:
+            pool.starmap(_translate_range, shards)
+    else:
+        for shard in shards:
+            _translate_range(*shard)
+
+
+def _translate_range(src: str, dst: str, begin: int, end: int, table: bytes):
+    """Translate quality lines of whole records within [begin, end) of src into dst"""
+    with open(src, "rb") as fin:
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            translated = _translate(mm, begin, end, table)
+
+    fd = os.open(dst, os.O_WRONLY)
+    try:
+        os.pwrite(fd, translated, begin)
+    finally:
+        os.close(fd)
+
+
+def _translate(mm: mmap.mmap, begin: int, end: int, table: bytes) -> bytes:
+    try:
+        # optional dependency, translation is vectorised with it
+        import numpy as np
+    except ImportError:
+        lines = mm[begin:end].split(b"\n")
+        quality = LINES_PER_RECORD - 1
+        lines[quality::LINES_PER_RECORD] = [
+            line.translate(table) for line in lines[quality::LINES_PER_RECORD]
+        ]
+        return b"\n".join(lines)
+
+    buf = np.frombuffer(mm, dtype=np.uint8, count=end - begin, offset=begin)
+    lut = np.frombuffer(table, dtype=np.uint8)
+    # newlines are kept by the table
+    return np.where(record_lines(buf) == LINES_PER_RECORD - 1, lut[buf], buf).tobytes()
+
+
+def _reorder_files(
+    files: list[str],
+    outputs: list[str],
+    signature: str,
+    k: int,
+    n_workers: int,
+    memory: int,
+):
+    indexes = [fastq_index(f) for f in files]
+    n_records = indexes[0].n_records
+    if any(index.n_records != n_records for index in indexes):
+        raise ValueError(f"Mates of {files[0]} have different numbers of records")
+
+    run_size = max(memory // (n_workers * SORT_OVERHEAD * len(files)), 1)
+    n_runs = max(math.ceil(indexes[0].size / run_size), 1)
+    runs_dir = tempfile.mkdtemp(prefix="runs.", dir=path.dirname(outputs[0]))
+    try:
+        tasks = []
+        for i in range(n_runs):
+            start = round(i * n_records / n_runs)
+            count = round((i + 1) * n_records / n_runs) - start
+            ranges = [index.range(start, count) for index in indexes]
+            tasks.append((files, ranges, path.join(runs_dir, str(i)), signature, k))
+        logger.info(f"Sorting {n_records} records of {files[0]} in {n_runs} runs...")
+        if n_workers > 1 and n_runs > 1:
+            with Pool(n_workers) as pool:
+                runs = pool.starmap(_sort_run, tasks)
+        else:
+            runs = [_sort_run(*task) for task in tasks]
+
+        # merge runs in several passes if there are too many of them
+        level = 0
+        while len(runs) > MERGE_FANIN:
+            level += 1
+            groups = [
+                runs[i : i + MERGE_FANIN] for i in range(0, len(runs), MERGE_FANIN)
+            ]
+            runs = []
+            for i, group in enumerate(groups):
+                prefix = path.join(runs_dir, f"{level}.{i}")
+                runs.append(_run_paths(prefix, len(files)))
+                _merge_runs(group, *runs[-1])
+        _merge_runs(runs, None, outputs)
+    finally:
+        shutil.rmtree(runs_dir)
+
+
+def _run_paths(prefix: str, n_files: int) -> tuple[str, list[str]]:
+    """Paths of the signatures and of the records of every file of a run"""
+    return prefix + ".keys", [f"{prefix}.{i}.fastq" for i in range(n_files)]
+
+
+def _sort_run(
+    files: list[str],
+    ranges: list[tuple[int, int]],
+    prefix: str,
+    signature: str,
+    k: int,
+) -> tuple[str, list[str]]:
+    """Sort records within ranges of files by the signature of the first file, write them to a run"""
+    import numpy as np
+
+    chunks = []
+    for fastq, (begin, end) in zip(files, ranges):
+        with open(fastq, "rb") as fin:
+            fin.seek(begin)
+            chunks.append(fin.read(end - begin))
+
+    keys = _signatures(np.frombuffer(chunks[0], dtype=np.uint8), signature, k)
+    order = np.argsort(keys, kind="stable")
+
+    keys_path, run_paths = _run_paths(prefix, len(files))
+    keys[order].tofile(keys_path)
+    for chunk, run_path in zip(chunks, run_paths):
+        newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord("\n"))
+        ends = newlines[LINES_PER_RECORD - 1 :: LINES_PER_RECORD] + 1
+        starts = np.concatenate(([0], ends[:-1]))
+        view = memoryview(chunk)
+        with open(run_path, "wb", buffering=CHUNK_SIZE) as fout:
+            for begin, end in zip(starts[order].tolist(), ends[order].tolist()):
+                fout.write(view[begin:end])
+    return keys_path, run_paths
+
+
+def _signatures(buf, signature: str, k: int):
+    """Signatures of the sequences of records in buf (records without k bases sort last)"""
+    import numpy as np
+
+    newlines = buf == ord("\n")
+    line = np.cumsum(newlines, dtype=np.uint32)
+    line -= newlines
+    n_records = np.count_nonzero(newlines) // LINES_PER_RECORD
+    keys = np.full(n_records, np.iinfo(np.uint64).max, dtype=np.uint64)
+
+    # bases of all sequences, and the record of each
+    bases = np.flatnonzero((line % LINES_PER_RECORD == 1) & ~newlines)
+    record = line[bases] // LINES_PER_RECORD
+    codes = _base_codes()[buf[bases]]
+    del newlines, line, bases
+
+    n = len(codes) - k + 1
+    if n <= 0:
+        return keys
+    kmers = np.zeros(n, dtype=np.uint64)
+    for i in range(k):
+        kmers <<= np.uint64(2)
+        kmers |= codes[i : i + n]
+    # k-mers spanning two sequences are not valid
+    valid = record[:n] == record[k - 1 :]
+
+    firsts = np.flatnonzero(np.concatenate(([True], record[1:] != record[:-1])))
+    firsts = firsts[firsts < n]
+    if signature == "kmer":
+        firsts = firsts[valid[firsts]]
+        keys[record[firsts]] = kmers[firsts]
+    else:
+        kmers *= np.uint64(_HASH_MULTIPLIER)
+        kmers[~valid] = np.iinfo(np.uint64).max
+        keys[record[firsts]] = np.minimum.reduceat(kmers, firsts)
+    return keys
+
+
+def _base_codes():
+    """Codes of bases (A, C, G, T: 0-3, anything else: 0), as uint64 lookup table"""
+    import numpy as np
+
+    lut = np.zeros(256, dtype=np.uint64)
+    for code, bases in enumerate(("Aa", "Cc", "Gg", "Tt")):
+        for base in bases:
+            lut[ord(base)] = code
+    return lut
+
+
+def _merge_runs(
+    runs: list[tuple[str, list[str]]],
+    keys_path: Optional[str],
+    outputs: list[str],
+):
+    """Merge sorted runs into outputs, and their signatures into keys_path (if given)"""
+    import numpy as np
+
+    if len(runs) == 1 and keys_path is None:
+        for run_path, output in zip(runs[0][1], outputs):
+            os.replace(run_path, output)
+        return
+
+    with ExitStack() as stack:
+        fouts = [
+            stack.enter_context(open(f, "wb", buffering=CHUNK_SIZE)) for f in outputs
+        ]
+        keys_out = stack.enter_context(open(keys_path, "wb")) if keys_path else None
+        merged = heapq.merge(
+            *(_run_records(*run, stack) for run in runs), key=itemgetter(0)
+        )
+        keys = []
+        for key, records in merged:
+            for fout, record in zip(fouts, records):
+                fout.write(record)
+            if keys_out:
+                keys.append(key)
+                if len(keys) == MERGE_BLOCK:
+                    np.array(keys, dtype=np.uint64).tofile(keys_out)
+                    keys.clear()
+        if keys_out:
+            np.array(keys, dtype=np.uint64).tofile(keys_out)
+
+    for keys_done, run_paths in runs:
+        os.unlink(keys_done)
+        for run_path in run_paths:
+            os.unlink(run_path)
+
+
+def _run_records(keys_path: str, run_paths: list[str], stack: ExitStack):
+    """Signature and records (one of every file) of a run, in order"""
+    import numpy as np
+
+    if not path.getsize(keys_path):
+        return
+    keys = np.memmap(keys_path, dtype=np.uint64, mode="r")
+    fins = [stack.enter_context(open(f, "rb", buffering=CHUNK_SIZE)) for f in run_paths]
+    for block in range(0, len(keys), MERGE_BLOCK):
+        for key in keys[block : block + MERGE_BLOCK].tolist():
+            yield (
+                key,
+                [
+                    b"".join(fin.readline() for _ in range(LINES_PER_RECORD))
+                    for fin in fins
+                ],
+            )
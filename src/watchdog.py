@@ -0,0 +1,161 @@
+import os
+import time
+from collections import deque
+from os import path
+from typing import Optional
+
+from src.compat import dataclass
+from src.logger import logger
+
+PROC = "/proc"
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+MB = 1e6
+
+
+@dataclass(slots=True)
+class WatchdogOptions:
+    interval: float = 10  # seconds between checks
+    stall_window: float = 0  # abort if nothing progressed for this long; 0 disables
+    min_throughput: float = 0  # abort if I/O over stall_window is slower (MB/s)
+
+    @property
+    def enabled(self) -> bool:
+        return self.stall_window > 0
+
+
+@dataclass(slots=True)
+class Progress:
+    cpu: Optional[float] = None  # seconds of CPU time of the process tree
+    io: Optional[int] = None  # bytes read and written by the process tree
+    files: int = 0  # total size of the watched files
+
+
+class Watchdog:
+    """
+    Watches a running command: CPU time and I/O of its process tree
+    (from /proc) and sizes of the files it writes.
+
+    The command is considered stalled if none of them has grown within
+    stall_window seconds, and too slow if it has read and written less than
+    min_throughput MB/s within stall_window seconds.
+    """
+
+    def __init__(self, options: WatchdogOptions, files: list[str]):
+        self.options = options
+        self.files = files
+
+        self._start = time.monotonic()
+        self._best = Progress()
+        self._last_progress = self._start
+        self._io_history: deque[tuple[float, int]] = deque()
+        self._warned = False
+
+    def check(self, root_pid: Optional[int]) -> str:
+        """Return reason to abort the command, or empty string"""
+        now = time.monotonic()
+        current = sample(root_pid, self.files)
+
+        if current.cpu is None and current.io is None:
+            # a command only writing its outputs at the end can not
+            # be told from a hung one without the process tree
+            if not self._warned and root_pid is not None:
+                logger.warn("Can not read the process tree, watchdog is disabled")
+                self._warned = True
+            return ""
+
+        if self._progressed(current):
+            self._last_progress = now
+
+        window = self.options.stall_window
+        if now - self._last_progress > window:
+            return f"Stalled: no progress for {now - self._last_progress:.0f}s"
+
+        if self.options.min_throughput and self._best.io is not None:
+            self._io_history.append((now, self._best.io))
+            while self._io_history[0][0] < now - window:
+                self._io_history.popleft()
+            since, io_then = self._io_history[0]
+            if now - self._start > window and now - since >= window / 2:
+                rate = (self._best.io - io_then) / MB / (now - since)
+                if rate < self.options.min_throughput:
+                    return (
+                        f"Too slow: {rate:.2f} MB/s over the last {now - since:.0f}s "
+                        f"(floor is {self.options.min_throughput} MB/s)"
+                    )
+
+        return ""
+
+    def _progressed(self, current: Progress) -> bool:
+        """Update the highest values seen so far, return True if any has grown"""
+        # values of the tree might drop when processes exit
+        progressed = False
+        for name in ("cpu", "io", "files"):
+            value = getattr(current, name)
+            best = getattr(self._best, name)
+            if value is not None and (best is None or value > best):
+                setattr(self._best, name, value)
+                progressed = True
+        return progressed
+
+
+def sample(root_pid: Optional[int], files: list[str]) -> Progress:
+    progress = Progress(files=sum(path.getsize(f) for f in files if path.exists(f)))
+    if root_pid is None or not path.isdir(PROC):
+        return progress
+
+    for pid in _process_tree(root_pid):
+        cpu = _cpu_time(pid)
+        if cpu is not None:
+            progress.cpu = (progress.cpu or 0) + cpu
+        io = _io_bytes(pid)
+        if io is not None:
+            progress.io = (progress.io or 0) + io
+
+    return progress
+
+
+def _process_tree(root_pid: int) -> list[int]:
+    children: dict[int, list[int]] = {}
+    for entry in os.listdir(PROC):
+        if not entry.isdigit():
+            continue
+        stat = _read_stat(int(entry))
+        if stat:
+            children.setdefault(int(stat[1]), []).append(int(entry))
+
+    tree = []
+    todo = [root_pid]
+    while todo:
+        pid = todo.pop()
+        tree.append(pid)
+        todo.extend(children.get(pid, []))
+    return tree
+
+
+def _read_stat(pid: int) -> Optional[list[str]]:
+    """Fields of /proc/<pid>/stat following the command name"""
+    try:
+        with open(path.join(PROC, str(pid), "stat"), "r") as fin:
+            stat = fin.read()
+    except OSError:
+        return None  # exited in the meantime
+    # the command name is in parentheses and might contain spaces
+    return stat[stat.rfind(")") + 2 :].split()
+
+
+def _cpu_time(pid: int) -> Optional[float]:
+    """User and system time of the process and of its waited-for children"""
+    stat = _read_stat(pid)
+    if not stat:
+        return None
+    utime, stime, cutime, cstime = map(int, stat[11:15])
+    return (utime + stime + cutime + cstime) / CLOCK_TICKS
+
+
+def _io_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(path.join(PROC, str(pid), "io"), "r") as fin:
+            fields = dict(line.split(":") for line in fin)
+    except (OSError, ValueError):
+        return None  # exited, or not permitted
+    return int(fields["rchar"]) + int(fields["wchar"])
@@ -0,0 +1,326 @@
+import argparse
+import csv
+import dataclasses
+import json
+import os
+import platform
+import shutil
+import threading
+import time
+from os import path
+from typing import Optional
+
+from src.compat import dataclass
+from src.containers import container_dataset
+from src.dataset import Dataset
+from src.estimate import Estimator
+from src.history import collect_run_metadata
+from src.logger import logger
+from src.measure import measure_tool, options_from_args
+from src.phases import PhaseWriter
+from src.records import Outputs, RecordWriter
+from src.results import ResultWriter
+from src.tools import Tool, get_tool
+
+PENDING = "pending"
+CLAIMED = "claimed"
+DONE = "done"
+RESULTS = "results"
+PHASES = "phases"
+RECORDS = "records"
+LOGS = "logs"
+SCRATCH = "scratch"
+
+CLAIM_SEP = "@"
+
+
+@dataclass(slots=True)
+class Job:
+    tool: str = ""
+    input1: str = ""  # local paths, relative to the current folder
+    input2: str = ""
+    threads: int = 0
+    zdur_modes: str = ""
+    iteration: int = 1
+    timeout: float = 0  # in hours
+
+    @property
+    def name(self) -> str:
+        return f"{self.tool}_iter{self.iteration}"
+
+
+class WorkQueue:
+    """
+    Job queue on a shared filesystem.
+
+    Every job is a small .json file; its state is given by the folder it is in:
+        pending/  - waiting to be claimed
+        claimed/  - being executed by a worker (name is suffixed with the worker id)
+        done/     - finished (successfully or not)
+    Jobs are claimed and released with atomic renames, and workers keep
+    touching their claims, so claims of dead workers can be detected and released.
+    """
+
+    def __init__(self, queue_dir: str, stale_timeout: float):
+        self.queue_dir = queue_dir
+        self.stale_timeout = stale_timeout
+
+        for sub in (PENDING, CLAIMED, DONE, RESULTS, PHASES, RECORDS, LOGS, SCRATCH):
+            os.makedirs(self._dir(sub), exist_ok=True)
+
+    def _dir(self, sub: str) -> str:
+        return path.join(self.queue_dir, sub)
+
+    def _list(self, sub: str) -> list[str]:
+        return sorted(f for f in os.listdir(self._dir(sub)) if f.endswith(".json"))
+
+    @property
+    def is_empty(self) -> bool:
+        """True if no jobs were ever added"""
+        return not any(os.listdir(self._dir(sub)) for sub in (PENDING, CLAIMED, DONE))
+
+    @property
+    def n_pending(self) -> int:
+        return len(self._list(PENDING))
+
+    @property
+    def n_claimed(self) -> int:
+        return len(os.listdir(self._dir(CLAIMED)))
+
+    def enqueue(self, jobs: list[Job]):
+        for idx, job in enumerate(jobs):
+            fname = f"{idx:06d}_{job.name}.json"
+            tmp = path.join(self.queue_dir, fname + ".tmp")
+            with open(tmp, "w") as fout:
+                json.dump(dataclasses.asdict(job), fout)
+            # write, then rename, so that workers never see partial files
+            os.rename(tmp, path.join(self._dir(PENDING), fname))
+
+        logger.info(f"Added {len(jobs)} jobs to {self.queue_dir}")
+
+    def claim(self, worker_id: str) -> Optional[tuple[str, Job]]:
+        """Return name of the claim file and the claimed job, or None"""
+        for fname in self._list(PENDING):
+            claim = fname + CLAIM_SEP + worker_id
+            src = path.join(self._dir(PENDING), fname)
+            try:
+                # renames keep mtime, so refresh it first
+                # to not have the claim immediately considered stale
+                os.utime(src)
+                os.rename(src, path.join(self._dir(CLAIMED), claim))
+            except FileNotFoundError:
+                continue  # claimed by someone else
+
+            with open(path.join(self._dir(CLAIMED), claim), "r") as fin:
+                job = Job(**json.load(fin))
+            return claim, job
+
+        return None
+
+    def heartbeat(self, claim: str):
+        os.utime(path.join(self._dir(CLAIMED), claim))
+
+    def finish(self, claim: str) -> bool:
+        """Return False if the claim was released in the meantime"""
+        fname = claim.rsplit(CLAIM_SEP, 1)[0]
+        try:
+            os.rename(
+                path.join(self._dir(CLAIMED), claim), path.join(self._dir(DONE), fname)
+            )
+        except FileNotFoundError:
+            return False
+        return True
+
+    def release_stale(self):
+        """Move claims that were not touched for too long back to pending"""
+        deadline = time.time() - self.stale_timeout
+        for claim in os.listdir(self._dir(CLAIMED)):
+            src = path.join(self._dir(CLAIMED), claim)
+            try:
+                if path.getmtime(src) > deadline:
+                    continue
+                fname = claim.rsplit(CLAIM_SEP, 1)[0]
+                os.rename(src, path.join(self._dir(PENDING), fname))
+            except FileNotFoundError:
+                continue  # finished or released by someone else
+
+            logger.warn(f"Released stale claim {claim}")
+
+    def merge_results(self, results_dir: str) -> str:
+        """
+        Concatenate files written by workers into results_dir,
+        return path to the merged records
+        """
+        self._merge_csv(
+            RESULTS, ResultWriter(path.join(results_dir, "benchmark_results.csv"))
+        )
+        self._merge_csv(PHASES, PhaseWriter(path.join(results_dir, "phases.csv")))
+
+        records = path.join(results_dir, "records.jsonl")
+        with open(records, "w") as fout:
+            for fname in sorted(os.listdir(self._dir(RECORDS))):
+                with open(path.join(self._dir(RECORDS), fname), "r") as fin:
+                    shutil.copyfileobj(fin, fout)
+        return records
+
+    def _merge_csv(self, sub: str, writer):
+        result_files = sorted(
+            path.join(self._dir(sub), f)
+            for f in os.listdir(self._dir(sub))
+            if f.endswith(".csv")
+        )
+
+        n_rows = 0
+        with open(writer.outname, "a") as fout:
+            out = csv.DictWriter(
+                fout,
+                dialect="unix",
+                quoting=csv.QUOTE_MINIMAL,
+                fieldnames=writer.fieldnames,
+            )
+            for fname in result_files:
+                with open(fname, "r") as fin:
+                    for row in csv.DictReader(fin):
+                        out.writerow(row)
+                        n_rows += 1
+
+        logger.info(f"Merged {n_rows} {sub} rows from {len(result_files)} workers")
+
+
+def make_jobs(
+    args: argparse.Namespace,
+    data_local: Dataset,
+    tools: list[Tool],
+    estimator: Estimator,
+) -> list[Job]:
+    cwd = os.getcwd()
+    size = sum(path.getsize(f) for f in data_local.files)
+    input1 = path.relpath(data_local.name1, cwd)
+    input2 = path.relpath(data_local.name2, cwd) if data_local.is_pe else ""
+
+    return [
+        Job(
+            tool=tool.name,
+            input1=input1,
+            input2=input2,
+            threads=args.threads,
+            zdur_modes=args.zdur_modes,
+            iteration=iteration,
+            timeout=estimator.timeout(tool.name, size),
+        )
+        for iteration in range(1, args.repeats + 1)
+        for tool in tools
+    ]
+
+
+def coordinate(
+    args: argparse.Namespace,
+    data_local: Dataset,
+    tools: list[Tool],
+    results_dir: str,
+    estimator: Estimator,
+):
+    """Fill the queue with jobs, wait for workers to finish them and merge the results"""
+    queue = WorkQueue(args.queue_dir, args.stale_timeout)
+
+    if queue.is_empty:
+        queue.enqueue(make_jobs(args, data_local, tools, estimator))
+    else:
+        logger.info(f"{args.queue_dir} already contains jobs, waiting for them")
+
+    while True:
+        queue.release_stale()
+        pending, claimed = queue.n_pending, queue.n_claimed
+        if not pending and not claimed:
+            break
+        logger.info(f"Jobs pending: {pending}, running: {claimed}")
+        time.sleep(args.heartbeat)
+
+    records = queue.merge_results(results_dir)
+    if args.parquet:
+        RecordWriter(records, {}, append=True).to_parquet()
+
+
+def work(args: argparse.Namespace):
+    """Claim and execute jobs until the queue is drained"""
+    worker_id = f"{platform.node()}-{os.getpid()}"
+    queue = WorkQueue(args.queue_dir, args.stale_timeout)
+
+    scratch = path.join(args.queue_dir, SCRATCH, worker_id)
+    logdir = path.join(args.queue_dir, LOGS)
+    outputs = Outputs(
+        writer=ResultWriter(path.join(args.queue_dir, RESULTS, f"{worker_id}.csv")),
+        phase_writer=PhaseWriter(path.join(args.queue_dir, PHASES, f"{worker_id}.csv")),
+        record_writer=RecordWriter(
+            path.join(args.queue_dir, RECORDS, f"{worker_id}.jsonl"),
+            collect_run_metadata(args),
+        ),
+    )
+
+    logger.info(f"Worker {worker_id} started")
+    while True:
+        queue.release_stale()
+        claimed = queue.claim(worker_id)
+        if claimed is None:
+            if not queue.is_empty and not queue.n_pending and not queue.n_claimed:
+                break
+            # jobs of other workers might still be released,
+            # and workers started before the coordinator wait for it to add jobs
+            time.sleep(args.heartbeat)
+            continue
+
+        claim, job = claimed
+        logger.info(f"Worker {worker_id} claimed {job.name}")
+
+        stop = threading.Event()
+        beat = threading.Thread(
+            target=_heartbeat, args=(queue, claim, args.heartbeat, stop), daemon=True
+        )
+        beat.start()
+        try:
+            result = _execute(job, args, scratch, logdir, worker_id)
+        finally:
+            stop.set()
+            beat.join()
+
+        if not queue.finish(claim):
+            logger.warn(f"Claim on {job.name} was released, discarding its results")
+            continue
+
+        outputs.add_result(result, job.iteration)
+        if not result:
+            logger.warn(f"Results for {job.tool} are invalid")
+
+    logger.info(f"Worker {worker_id} finished: no jobs left")
+
+
+def _heartbeat(queue: WorkQueue, claim: str, interval: float, stop: threading.Event):
+    while not stop.wait(interval):
+        try:
+            queue.heartbeat(claim)
+        except FileNotFoundError:
+            return
+
+
+def _execute(
+    job: Job, args: argparse.Namespace, scratch: str, logdir: str, worker_id: str
+):
+    # outputs of the tools are written next to the symlinks,
+    # so concurrent jobs on the same dataset do not interfere
+    data_local = Dataset(job.input1, job.input2).linked_into(scratch)
+    data_cont = container_dataset(data_local, args.container_runtime)
+    tool = get_tool(data_cont, job.threads, job.tool, job.zdur_modes)
+
+    options = options_from_args(args)
+    options.instance = worker_id
+
+    return measure_tool(
+        tool,
+        args.container_runtime,
+        data_local,
+        job.threads,
+        # a retried job must not overwrite logs of the stalled attempt
+        path.join(logdir, f"{job.name}_{worker_id}"),
+        job.timeout,
+        options,
+    )
@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import stat
+from os import path
+
+import pytest
+
+# stands in for docker: "run --rm -v <outdir>:<mount> <image> <tool> <args>",
+# with prefetch and fasterq-dump of SRA Toolkit writing small paired-end files
+STUB_RUNTIME = """#!/usr/bin/env python3
+import os
+import sys
+
+_, _, _, volume, _, tool, *args = sys.argv[1:]
+outdir, mount = volume.split(":")
+args = [a.replace(mount, outdir) for a in args]
+with open(os.path.join(outdir, "calls.log"), "a") as fout:
+    fout.write(tool + "\\n")
+
+sra_id = os.path.basename(args[-1])
+if tool == "prefetch":
+    sra_dir = args[args.index("--output-directory") + 1]
+    os.makedirs(os.path.join(sra_dir, sra_id), exist_ok=True)
+elif tool == "fasterq-dump":
+    if os.environ.get("STUB_FAIL"):
+        sys.exit(1)
+    for mate in (1, 2):
+        with open(os.path.join(outdir, f"{sra_id}_{mate}.fastq"), "w") as fout:
+            for seq in ("ACGT", "ACGT", "ACG"):
+                fout.write(f"@{sra_id}\\n{seq}\\n+\\n{'I' * len(seq)}\\n")
+"""
+
+
+@pytest.fixture
+def download(monkeypatch):
+    monkeypatch.syspath_prepend(path.join(path.dirname(__file__), "..", "scripts"))
+    import download
+
+    return download
+
+
+@pytest.fixture
+def runtime(tmp_path):
+    stub = tmp_path / "runtime"
+    stub.write_text(STUB_RUNTIME)
+    stub.chmod(stub.stat().st_mode | stat.S_IEXEC)
+    return str(stub)
+
+
+def _calls(outdir) -> list[str]:
+    calls = path.join(outdir, "calls.log")
+    if not path.exists(calls):
+        return []
+    with open(calls, "r") as fin:
+        return fin.read().split()
+
+
+def test_download_then_skip(download, runtime, tmp_path):
+    outdir = tmp_path / "out"
+    outdir.mkdir()
+
+    files = download.download_fastq(runtime, "SRR1", str(outdir), verbose=False)
+    assert [path.basename(f) for f in files] == ["SRR1_1.fastq", "SRR1_2.fastq"]
+    assert _calls(outdir) == ["prefetch", "fasterq-dump"]
+    assert download.is_complete(str(outdir), "SRR1", expected_reads=3)
+    # the .sra file is removed once converted
+    assert not path.exists(outdir / ".sra" / "SRR1")
+
+    assert download.download_fastq(runtime, "SRR1", str(outdir)) == files
+    assert _calls(outdir) == ["prefetch", "fasterq-dump"]
+
+
+def test_incomplete_download_is_redone(download, runtime, tmp_path):
+    outdir = str(tmp_path)
+    files = download.download_fastq(runtime, "SRR1", outdir, verbose=False)
+
+    # e.g. interrupted while the files were being copied elsewhere
+    with open(files[1], "r+") as fout:
+        fout.truncate(10)
+    assert not download.is_complete(outdir, "SRR1")
+
+    download.download_fastq(runtime, "SRR1", outdir, verbose=False)
+    assert _calls(outdir) == ["prefetch", "fasterq-dump"] * 2
+    assert download.is_complete(outdir, "SRR1")
+
+
+def test_failed_download_leaves_no_marker(download, runtime, tmp_path, monkeypatch):
+    monkeypatch.setenv("STUB_FAIL", "1")
+    with pytest.raises(RuntimeError, match="SRR1"):
+        download.download_fastq(runtime, "SRR1", str(tmp_path), verbose=False)
+    assert not path.exists(download.marker_path(str(tmp_path), "SRR1"))
+
+
+def test_unexpected_number_of_reads(download, runtime, tmp_path):
+    with pytest.raises(RuntimeError, match="expected 5 reads"):
+        download.download_fastq(
+            runtime, "SRR1", str(tmp_path), expected_reads=5, verbose=False
+        )
+    assert not download.is_complete(str(tmp_path), "SRR1")
+
+
+def test_filtering_is_resumed(download, runtime, tmp_path):
+    args = argparse.Namespace(
+        container_runtime=runtime,
+        outdir=str(tmp_path),
+        threads=1,
+        image="stub",
+        jobs=2,
+        filter_const_length=True,
+    )
+    download.fetch(args, "SRR1", None)
+    filtered = [tmp_path / f"SRR1_{mate}_len-4.fastq" for mate in (1, 2)]
+    with open(download.marker_path(str(tmp_path), "SRR1"), "r") as fin:
+        assert json.load(fin)["filtered"] == [f.name for f in filtered]
+    assert all(f.read_text().count("\n") == 8 for f in filtered)
+
+    mtimes = [os.stat(f).st_mtime_ns for f in filtered]
+    download.fetch(args, "SRR1", None)
+    assert [os.stat(f).st_mtime_ns for f in filtered] == mtimes
+    assert _calls(tmp_path) == ["prefetch", "fasterq-dump"]
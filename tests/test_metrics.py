@@ -0,0 +1,89 @@
+import os
+
+from src.metrics import METRICS, PREFIX, MetricsExporter
+from src.results import Result
+
+
+def _samples(outname: str) -> dict[str, str]:
+    """Sample (name with labels) -> value, checking that every metric is declared"""
+    samples = {}
+    declared = set()
+    with open(outname, "r") as fin:
+        for line in fin:
+            line = line.rstrip("\n")
+            if line.startswith("# TYPE "):
+                _, _, name, kind = line.split(" ")
+                assert kind in ("gauge", "counter")
+                declared.add(name)
+            elif not line.startswith("#"):
+                name, value = line.rsplit(" ", 1)
+                assert name.split("{")[0] in declared
+                samples[name] = value
+    assert declared == {f"{PREFIX}_{m}" for m in METRICS}
+    return samples
+
+
+def test_progress(tmp_path):
+    outname = str(tmp_path / "fastq_benchmark.prom")
+    metrics = MetricsExporter(outname, n_jobs=2)
+    samples = _samples(outname)
+    assert samples[f"{PREFIX}_jobs_planned"] == "2"
+    assert samples[f"{PREFIX}_jobs_remaining"] == "2"
+    assert samples[f"{PREFIX}_running"] == "1"
+
+    metrics.start_job("gzip", "toy (SE)", 1)
+    metrics.start_step("compression1")
+    current = (
+        f'{PREFIX}_current_job{{tool="gzip",dataset="toy (SE)",'
+        f'iteration="1",step="compression1"}}'
+    )
+    assert _samples(outname)[current] == "1"
+
+    metrics.finish_job(
+        Result(
+            tool="gzip",
+            original_size=1000,
+            ctime=2,
+            dtime=1,
+            cmem=10,
+            dmem=20,
+            is_valid=True,
+        )
+    )
+    samples = _samples(outname)
+    assert current not in samples
+    assert samples[f"{PREFIX}_jobs_completed_total"] == "1"
+    assert samples[f"{PREFIX}_jobs_remaining"] == "1"
+    throughput = f"{PREFIX}_throughput_bytes_per_second"
+    assert samples[f'{throughput}{{tool="gzip",direction="compression"}}'] == "500.0"
+    assert samples[f'{throughput}{{tool="gzip",direction="decompression"}}'] == "1000.0"
+    assert samples[f'{PREFIX}_peak_memory_bytes{{tool="gzip"}}'] == str(20 * 1024)
+
+    metrics.close()
+    assert _samples(outname)[f"{PREFIX}_running"] == "0"
+    # nothing but the file itself is left behind
+    assert os.listdir(tmp_path) == ["fastq_benchmark.prom"]
+
+
+def test_failures(tmp_path):
+    outname = str(tmp_path / "fastq_benchmark.prom")
+    metrics = MetricsExporter(outname, n_jobs=1)
+    metrics.add_jobs(2)
+    for failure in ("decompression1: Timeout 60s expired", "mock not found"):
+        metrics.finish_job(Result(tool="mock", is_valid=False, failure=failure))
+
+    samples = _samples(outname)
+    assert samples[f"{PREFIX}_jobs_planned"] == "3"
+    assert samples[f"{PREFIX}_jobs_remaining"] == "1"
+    failures = f"{PREFIX}_failures_total"
+    assert samples[f'{failures}{{tool="mock",step="decompression1"}}'] == "1"
+    assert samples[f'{failures}{{tool="mock",step="start"}}'] == "1"
+
+
+def test_label_values_are_escaped(tmp_path):
+    outname = str(tmp_path / "fastq_benchmark.prom")
+    metrics = MetricsExporter(outname, n_jobs=1)
+    metrics.start_job("gzip", 'a "quoted"\\name\n', 1)
+    with open(outname, "r") as fin:
+        text = fin.read()
+    assert 'dataset="a \\"quoted\\"\\\\name\\n"' in text
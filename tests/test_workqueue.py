@@ -0,0 +1,92 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+
+from src.workqueue import CLAIMED, DONE, PENDING, Job, WorkQueue
+
+
+def _jobs(n: int) -> list[Job]:
+    return [
+        Job(tool="gzip", input1="toy.fastq", threads=1, iteration=i) for i in range(n)
+    ]
+
+
+def test_claim_and_finish(tmp_path):
+    queue = WorkQueue(str(tmp_path), stale_timeout=60)
+    assert queue.is_empty
+    queue.enqueue(_jobs(2))
+    assert queue.n_pending == 2
+
+    claim, job = queue.claim("w1")
+    assert job == _jobs(2)[0]
+    assert (queue.n_pending, queue.n_claimed) == (1, 1)
+    assert os.listdir(tmp_path / CLAIMED) == [claim]
+
+    assert queue.finish(claim)
+    assert queue.n_claimed == 0
+    assert os.listdir(tmp_path / DONE) == [claim.split("@")[0]]
+
+
+def test_every_job_claimed_once(tmp_path):
+    n_jobs = 50
+    queue = WorkQueue(str(tmp_path), stale_timeout=60)
+    queue.enqueue(_jobs(n_jobs))
+
+    def drain(worker_id: str) -> list[int]:
+        # every worker has its own view of the queue, as on separate hosts
+        own = WorkQueue(str(tmp_path), stale_timeout=60)
+        claimed = []
+        while (item := own.claim(worker_id)) is not None:
+            claimed.append(item[1].iteration)
+        return claimed
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        claimed = [i for c in pool.map(drain, [f"w{k}" for k in range(8)]) for i in c]
+
+    assert sorted(claimed) == list(range(n_jobs))
+    assert (queue.n_pending, queue.n_claimed) == (0, n_jobs)
+
+
+def test_fresh_claim_is_not_stale(tmp_path):
+    queue = WorkQueue(str(tmp_path), stale_timeout=60)
+    queue.enqueue(_jobs(1))
+    # the job file was written long ago, claiming it must not look stale
+    pending = path.join(tmp_path, PENDING, os.listdir(tmp_path / PENDING)[0])
+    old = time.time() - 3600
+    os.utime(pending, (old, old))
+
+    queue.claim("w1")
+    queue.release_stale()
+    assert (queue.n_pending, queue.n_claimed) == (0, 1)
+
+
+def test_stale_claim_is_requeued(tmp_path):
+    queue = WorkQueue(str(tmp_path), stale_timeout=60)
+    queue.enqueue(_jobs(1))
+    claim, job = queue.claim("dead")
+    old = time.time() - 3600
+    os.utime(path.join(tmp_path, CLAIMED, claim), (old, old))
+
+    queue.release_stale()
+    assert (queue.n_pending, queue.n_claimed) == (1, 0)
+
+    # another worker takes the job over, the dead one can not finish it anymore
+    new_claim, new_job = queue.claim("alive")
+    assert new_job == job
+    assert not queue.finish(claim)
+    assert queue.finish(new_claim)
+    assert len(os.listdir(tmp_path / DONE)) == 1
+
+
+def test_heartbeat_keeps_claim(tmp_path):
+    queue = WorkQueue(str(tmp_path), stale_timeout=60)
+    queue.enqueue(_jobs(1))
+    claim, _ = queue.claim("w1")
+    claimed = path.join(tmp_path, CLAIMED, claim)
+    old = time.time() - 3600
+    os.utime(claimed, (old, old))
+
+    queue.heartbeat(claim)
+    queue.release_stale()
+    assert queue.n_claimed == 1